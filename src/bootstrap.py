@@ -0,0 +1,156 @@
+"""
+Startup bootstrap and the hot cache snapshot.
+
+Before polling starts the bot connects the database, stores and preloads
+the question bank versions tests use, caches the identity of every bot
+it runs, hands tests from before multi-bot hosting to the first bot, and warms
+the in-memory caches from the snapshot written at the previous shutdown.
+The snapshot only lists cache keys; contents are read back from the
+database, so a stale snapshot can cost time but never serve stale data.
+"""
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+from src.consts import CACHE_SNAPSHOT_FILE
+from src.db import db
+from src.identity import fetch_identity
+from src.questions import get_question_set, preload_bank_versions, question_set_cache, register_bank
+from src.share import get_share_cards, share_index
+
+logger = logging.getLogger(__name__)
+
+# 2: share index keys are [bot_id, user_id]
+SNAPSHOT_VERSION = 2
+
+
+@contextlib.asynccontextmanager
+async def _phase(name, timings):
+    """Time one bootstrap phase and log its duration."""
+    started = time.perf_counter()
+    yield
+    timings[name] = time.perf_counter() - started
+    logger.info("Bootstrap: %s took %.1f ms", name, timings[name] * 1000)
+
+
+async def bootstrap(bots, snapshot_path=CACHE_SNAPSHOT_FILE):
+    """
+    Get everything the first updates need ready before polling.
+
+    Args:
+        bots: Bot instances served by this process, the first one owns
+            tests created before multi-bot hosting
+        snapshot_path: Hot cache snapshot to restore, None to start cold
+
+    Returns:
+        dict: Phase name -> seconds
+    """
+    timings = {}
+
+    async with _phase("database", timings):
+        await db.connect()
+        await db.check_retake_policy()
+        resumed = await db.resume_rescores()
+    if resumed:
+        logger.info("Bootstrap: finished the rescore of %d edited tests", resumed)
+
+    async with _phase("question bank", timings):
+        await register_bank()
+        preloaded = await preload_bank_versions()
+    logger.info("Bootstrap: %d older bank versions preloaded", preloaded)
+
+    async with _phase("bot identity", timings):
+        identities = await asyncio.gather(*(fetch_identity(bot) for bot in bots))
+    logger.info("Bootstrap: running as %s", ", ".join(f"@{identity.username}" for identity in identities))
+
+    async with _phase("test owners", timings):
+        assigned = await db.assign_unowned_tests(bots[0].id)
+    if assigned:
+        logger.info("Bootstrap: %d tests assigned to @%s", assigned, identities[0].username)
+
+    if snapshot_path:
+        async with _phase("cache snapshot", timings):
+            restored = await restore_cache_snapshot(snapshot_path, bots)
+        logger.info(
+            "Bootstrap: restored %d question sets and share cards of %d users",
+            restored['question_sets'], restored['share_index']
+        )
+
+    logger.info("Bootstrap finished in %.1f ms", sum(timings.values()) * 1000)
+    return timings
+
+
+def save_cache_snapshot(path=CACHE_SNAPSHOT_FILE):
+    """
+    Write the keys of the hot caches, least recently used first.
+
+    The file is replaced atomically so a crash mid-write leaves the
+    previous snapshot intact.
+
+    Args:
+        path: Snapshot file
+
+    Returns:
+        dict: Number of keys written per cache
+    """
+    snapshot = {
+        'version': SNAPSHOT_VERSION,
+        'saved_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'question_sets': question_set_cache.keys(),
+        'share_index': share_index.keys()
+    }
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f)
+    os.replace(temporary_path, path)
+
+    return {'question_sets': len(snapshot['question_sets']), 'share_index': len(snapshot['share_index'])}
+
+
+async def restore_cache_snapshot(path, bots):
+    """
+    Refill the hot caches from a snapshot, in the order they were used.
+
+    A missing or unreadable snapshot is not an error, the caches just
+    start cold. Share cards of bots that are no longer configured are
+    skipped.
+
+    Args:
+        path: Snapshot file
+        bots: Bot instances served by this process
+
+    Returns:
+        dict: Number of entries restored per cache
+    """
+    restored = {'question_sets': 0, 'share_index': 0}
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            snapshot = json.load(f)
+    except FileNotFoundError:
+        return restored
+    except (OSError, ValueError) as e:
+        logger.warning("Cache snapshot %s was not restored: %s", path, e)
+        return restored
+
+    if not isinstance(snapshot, dict) or snapshot.get('version') != SNAPSHOT_VERSION:
+        logger.warning("Cache snapshot %s has an unknown format", path)
+        return restored
+
+    # Oldest first, so the most recently used entries end up the freshest
+    for set_hash in snapshot.get('question_sets', [])[-question_set_cache.maxsize:]:
+        if await get_question_set(set_hash) is not None:
+            restored['question_sets'] += 1
+
+    bots_by_id = {bot.id: bot for bot in bots}
+    for bot_id, user_id in snapshot.get('share_index', [])[-share_index.maxsize:]:
+        bot = bots_by_id.get(bot_id)
+        if bot is not None:
+            await get_share_cards(bot, user_id)
+            restored['share_index'] += 1
+
+    return restored
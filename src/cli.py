@@ -0,0 +1,495 @@
+"""
+Command line maintenance jobs for the Friends Test bot.
+
+Usage:
+    python -m src.cli <command> [options]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import tempfile
+
+from src.consts import (
+    BACKUP_KEEP,
+    DB_NAME,
+    EXPORT_CHUNK_SIZE,
+    QUESTIONS_FILE,
+    RETAKE_POLICY,
+    RETENTION_DAYS,
+    RETENTION_MODE,
+    RETENTION_MODES,
+    SHARD_COUNT,
+    SHARD_DIR,
+    STORAGE_BACKEND
+)
+from src.db import db, sqlite_databases
+from src.db.backup import BackupUnsupportedError, create_backup, verify_backup
+from src.db.benchmark import benchmark_rescore, compare_reports, run_benchmarks
+from src.db.conformance import memory_factory, run_conformance, sharded_factory, sqlite_factory
+from src.db.database import Database
+from src.db.export import EXPORT_FORMATS, EXPORT_TABLES, export_tables, format_export_report
+from src.db.maintenance import format_storage_report, run_maintenance_pass
+from src.db.sharded import ShardedDatabase, reshard
+from src.db.synthetic import generate_dataset
+from src.handler_checks import run_handler_checks
+from src.render_benchmark import benchmark_render
+from src.replay import compare_replays, replay_log
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - [%(levelname)s] %(name)s: %(message)s',
+    datefmt='%H:%M:%S'
+)
+
+logger = logging.getLogger(__name__)
+
+# Jobs work on the storage the bot is configured with: the single SQLite
+# file, or every shard of the sharded backend
+
+
+def sqlite_targets(include_users=False):
+    """
+    SQLite databases of the configured storage a job runs on.
+
+    Args:
+        include_users: Also return the shared users file of the sharded backend
+
+    Returns:
+        list: The single database, or every shard
+    """
+    databases = sqlite_databases(db, include_users)
+    if not databases:
+        raise SystemExit(f"The {STORAGE_BACKEND} backend keeps nothing on disk, there is nothing to maintain")
+    return databases
+
+
+async def backfill_question_stats(args):
+    """Rebuild the /qstats answer counters from existing tests and results."""
+    databases = sqlite_targets()
+    await db.connect()
+    try:
+        for database in databases:
+            processed = await database.rebuild_answer_counters(chunk_size=args.chunk_size)
+            logger.info(
+                "Answer counters of %s rebuilt from %d tests and %d results",
+                database.db_name, processed['tests'], processed['results']
+            )
+    finally:
+        await db.close()
+
+
+async def rebuild_histograms(args):
+    """Rebuild the per-test score histograms from existing results."""
+    databases = sqlite_targets()
+    await db.connect()
+    try:
+        for database in databases:
+            buckets = await database.rebuild_score_histograms()
+            logger.info("Score histograms of %s rebuilt: %d buckets", database.db_name, buckets)
+    finally:
+        await db.close()
+
+
+async def rebuild_taker_stats(args):
+    """Rebuild the /mystats per-friend totals from existing results."""
+    databases = sqlite_targets()
+    await db.connect()
+    try:
+        for database in databases:
+            await database.rebuild_taker_stats()
+            logger.info("Taker totals of %s rebuilt", database.db_name)
+    finally:
+        await db.close()
+
+
+async def dedup_results(args):
+    """Collapse repeated passes into one row per friend and test."""
+    databases = sqlite_targets()
+    await db.connect()
+    try:
+        for database in databases:
+            removed = await database.dedup_test_results(args.policy)
+            logger.info(
+                "Removed %d repeated passes from %s using the %s policy", removed, database.db_name, args.policy
+            )
+    finally:
+        await db.close()
+
+
+async def retake_policy(args):
+    """Migrate the unique (test, friend) index to RETAKE_POLICY."""
+    databases = sqlite_targets()
+    await db.connect()
+    try:
+        for database in databases:
+            await database.apply_retake_policy()
+        logger.info("%d databases migrated to the %s retake policy", len(databases), RETAKE_POLICY)
+    finally:
+        await db.close()
+
+
+async def maintenance(args):
+    """Run one retention, vacuum and analyze pass, or report what it would reclaim."""
+    await db.connect()
+    try:
+        if args.enable_incremental_vacuum:
+            for database in sqlite_targets(include_users=True):
+                await database.enable_incremental_vacuum()
+            logger.info("Incremental auto-vacuum enabled")
+        for database in sqlite_targets():
+            if args.dry_run:
+                print(f"{database.db_name}:")
+                print(format_storage_report(await database.get_storage_report(args.days, args.mode)))
+                continue
+            summary = await run_maintenance_pass(database, args.days, args.mode)
+            logger.info(
+                "%s: %d results retired, %d pages released, longest step %.3fs",
+                database.db_name, summary['retired_results'], summary['released_pages'], summary['longest_step']
+            )
+    finally:
+        await db.close()
+
+
+async def backup(args):
+    """Take an online snapshot of the configured storage."""
+    try:
+        report = await create_backup(keep=args.keep)
+    except BackupUnsupportedError as e:
+        raise SystemExit(str(e))
+    print(
+        f"{report['path']}: {report['files']} files, {report['size']} bytes in {report['duration']:.2f}s, "
+        f"{report['steps']} steps, {report['restarts']} restarts, {report['fallbacks']} VACUUM INTO fallbacks, "
+        f"longest lock {report['max_step_lock'] * 1000:.1f}ms, total lock {report['total_lock'] * 1000:.1f}ms"
+    )
+
+
+async def verify(args):
+    """Check the integrity of a snapshot before restoring it."""
+    report = verify_backup(args.path)
+    for table, count in report['counts'].items():
+        print(f"{table}: {count} rows")
+    print("integrity: " + "; ".join(report['messages']))
+    if not report['ok']:
+        raise SystemExit(1)
+
+
+async def export(args):
+    """Stream tables into CSV or JSON Lines files."""
+    try:
+        reports = await export_tables(args.tables, args.out_dir, args.format, args.gzip, args.chunk_size)
+    except ValueError as e:
+        raise SystemExit(str(e))
+    for report in reports:
+        print(format_export_report(report))
+
+
+async def conformance(args):
+    """Run the shared storage conformance checks against the selected backends."""
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        factories = {
+            "sqlite": sqlite_factory(directory),
+            "sharded": sharded_factory(directory),
+            "memory": memory_factory
+        }
+        for backend in args.backends:
+            for name, error in await run_conformance(factories[backend]):
+                print(f"[{backend}] {name}: {'ok' if error is None else 'FAILED'}")
+                if error is not None:
+                    print(error)
+                    failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+async def handler_checks(args):
+    """Run the handler checks through the dispatcher against a scratch database."""
+    failed = False
+    for name, error in await run_handler_checks():
+        print(f"{name}: {'ok' if error is None else 'FAILED'}")
+        if error is not None:
+            print(error)
+            failed = True
+    if failed:
+        raise SystemExit(1)
+
+
+def load_questions(path=QUESTIONS_FILE):
+    """Load the question bank used to generate synthetic data."""
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)['questions']
+
+
+async def generate(args):
+    """Bulk-load a synthetic dataset into a scratch database."""
+    # Synthetic friends retake tests, so the scratch file keeps every pass;
+    # an existing file keeps its index, opening it changes no schema
+    database = Database(args.db, retake_policy="keep_all")
+    await database.connect()
+    try:
+        counts = await generate_dataset(
+            database, load_questions(), args.users, args.results, args.tests, seed=args.seed
+        )
+        logger.info("Generated %d users, %d tests and %d results in %s",
+                    counts['users'], counts['tests'], counts['results'], args.db)
+    finally:
+        await database.close()
+
+
+async def bench(args):
+    """Benchmark the database methods and guard their query plans."""
+    report = await run_benchmarks(load_questions(), args.sizes, args.repeat, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    violations = []
+    for size, size_report in report['sizes'].items():
+        print(f"{size} results (generated in {size_report['generation_seconds']}s):")
+        for name, timing in size_report['timings'].items():
+            print(f"  {name:30} median {timing['median_ms']:9.3f}ms  p95 {timing['p95_ms']:9.3f}ms")
+        violations.extend(f"[{size}] {violation}" for violation in size_report['violations'])
+    print(f"Report written to {args.output}")
+
+    if violations:
+        print("Query plan violations:")
+        print("\n".join(violations))
+        raise SystemExit(1)
+
+
+async def bench_compare(args):
+    """Compare the median timings of two benchmark reports."""
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        candidate = json.load(f)
+
+    for size, name, before, after, ratio in compare_reports(baseline, candidate):
+        ratio_text = f"x{ratio:.2f}" if ratio is not None else "n/a"
+        print(f"{size:>9} {name:30} {before:9.3f}ms -> {after:9.3f}ms  {ratio_text}")
+
+
+async def bench_rescore(args):
+    """Time rescoring one large test after an answer edit."""
+    report = await benchmark_rescore(load_questions(), args.results, args.seed)
+    print(
+        f"{report['results']} results: rescored {report['rescored']}, kept {report['kept']} "
+        f"in {report['rescore_seconds']}s (row by row: {report['row_by_row_seconds']}s)"
+    )
+    if report['mismatches']:
+        print(f"{report['mismatches']} of {report['sampled']} sampled scores are wrong")
+        raise SystemExit(1)
+
+
+async def bench_render(args):
+    """Time rendering a pass notification against the number of questions."""
+    mismatched = False
+    for row in benchmark_render(args.questions, args.repeat):
+        print(
+            f"{row['questions']:>6} questions: render {row['render_ms']:8.4f}ms "
+            f"(concatenation {row['concatenation_ms']:8.4f}ms, fragments built in {row['build_ms']:.2f}ms), "
+            f"{row['messages']} message(s), longest {row['longest_message']}"
+        )
+        mismatched = mismatched or not row['matches_baseline']
+    if mismatched:
+        print("Rendered text differs from the concatenated baseline")
+        raise SystemExit(1)
+
+
+async def replay(args):
+    """Replay a recorded update log against a scratch database and time it."""
+    report = await replay_log(args.log, args.speed, args.api_latency / 1000, args.max_gap, args.seed)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(
+        f"{report['updates']} updates ({report['recorded_seconds']}s recorded) replayed in {report['wall_seconds']}s: "
+        f"{report['throughput_per_second']} updates/s, {report['errors']} errors, "
+        f"lag p95 {report['lag']['p95_ms']:.3f}ms"
+    )
+    errors_by_kind = dict(report['errors_by_kind'], **{"all updates": report['errors']})
+    for kind, timing in [("all updates", report['latency'])] + list(report['kinds'].items()):
+        print(
+            f"  {kind:30} {timing['calls']:7} calls  median {timing['median_ms']:9.3f}ms  "
+            f"p95 {timing['p95_ms']:9.3f}ms  {errors_by_kind.get(kind, 0)} errors"
+        )
+    print(f"Report written to {args.output}")
+
+
+async def replay_compare(args):
+    """Compare two replays of the same log, usually from two revisions."""
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r', encoding='utf-8') as f:
+        candidate = json.load(f)
+
+    if baseline['log'] != candidate['log'] or baseline['speed'] != candidate['speed']:
+        print("Warning: the reports replayed different logs or speeds")
+    print(
+        f"revision {baseline['revision']} -> {candidate['revision']}: "
+        f"{baseline['throughput_per_second']} -> {candidate['throughput_per_second']} updates/s"
+    )
+    for name, before, after, before_p95, after_p95, ratio in compare_replays(baseline, candidate):
+        ratio_text = f"x{ratio:.2f}" if ratio is not None else "n/a"
+        print(
+            f"  {name:30} median {before:9.3f}ms -> {after:9.3f}ms  {ratio_text}  "
+            f"p95 {before_p95:9.3f}ms -> {after_p95:9.3f}ms"
+        )
+
+
+async def reshard_data(args):
+    """Copy the single database or an existing shard layout into a new shard layout."""
+    if os.path.exists(args.target_dir) and os.listdir(args.target_dir):
+        raise SystemExit(f"Target directory {args.target_dir} is not empty")
+
+    # The new layout gets the retake index of the configured policy on creation
+    if args.source_shards:
+        source = ShardedDatabase(args.source_dir, args.source_shards)
+    else:
+        source = Database(args.source_db)
+    target = ShardedDatabase(args.target_dir, args.target_shards)
+
+    await source.connect()
+    await target.connect()
+    try:
+        try:
+            copied = await reshard(source, target)
+        except RuntimeError as e:
+            raise SystemExit(str(e)) from e
+        logger.info(
+            "Copied %d users, %d tests and %d results into %d shards in %s",
+            copied['users'], copied['tests'], copied['results'], args.target_shards, args.target_dir
+        )
+    finally:
+        await target.close()
+        await source.close()
+
+
+def build_parser():
+    """Build the argument parser with one sub-command per job."""
+    parser = argparse.ArgumentParser(prog="python -m src.cli", description=__doc__.strip().splitlines()[0])
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill = subparsers.add_parser("backfill-qstats", help="rebuild the /qstats answer counters")
+    backfill.add_argument("--chunk-size", type=int, default=1000, help="rows fetched at a time")
+    backfill.set_defaults(handler=backfill_question_stats)
+
+    histograms = subparsers.add_parser("rebuild-histograms", help="rebuild the per-test score histograms")
+    histograms.set_defaults(handler=rebuild_histograms)
+
+    taker_stats = subparsers.add_parser("rebuild-taker-stats", help="rebuild the /mystats per-friend totals")
+    taker_stats.set_defaults(handler=rebuild_taker_stats)
+
+    dedup = subparsers.add_parser("dedup-results", help="keep one pass per friend and test")
+    dedup.add_argument(
+        "--policy",
+        choices=("keep_best", "keep_latest"),
+        default=RETAKE_POLICY if RETAKE_POLICY != "keep_all" else "keep_best",
+        help="which pass to keep (defaults to RETAKE_POLICY)"
+    )
+    dedup.set_defaults(handler=dedup_results)
+
+    retake = subparsers.add_parser("retake-policy", help="migrate the database to RETAKE_POLICY (stop the bot first)")
+    retake.set_defaults(handler=retake_policy)
+
+    maintenance_parser = subparsers.add_parser("maintenance", help="retire old results, vacuum and analyze")
+    maintenance_parser.add_argument("--days", type=int, default=RETENTION_DAYS, help="retention age in days, 0 disables retention")
+    maintenance_parser.add_argument("--mode", choices=RETENTION_MODES, default=RETENTION_MODE)
+    maintenance_parser.add_argument("--dry-run", action="store_true", help="only report reclaimable space")
+    maintenance_parser.add_argument(
+        "--enable-incremental-vacuum", action="store_true",
+        help="convert the database to incremental auto-vacuum (full VACUUM, stop the bot first)"
+    )
+    maintenance_parser.set_defaults(handler=maintenance)
+
+    backup_parser = subparsers.add_parser("backup", help="take an online snapshot of the database")
+    backup_parser.add_argument("--keep", type=int, default=BACKUP_KEEP, help="snapshots to keep")
+    backup_parser.set_defaults(handler=backup)
+
+    verify_parser = subparsers.add_parser("verify-backup", help="check a snapshot before restoring it")
+    verify_parser.add_argument("path", help="path to the snapshot")
+    verify_parser.set_defaults(handler=verify)
+
+    export_parser = subparsers.add_parser("export", help="stream tables to CSV or JSON Lines")
+    export_parser.add_argument("--tables", nargs="+", choices=EXPORT_TABLES, default=list(EXPORT_TABLES))
+    export_parser.add_argument("--format", choices=EXPORT_FORMATS, default="jsonl")
+    export_parser.add_argument("--gzip", action="store_true", help="compress the output")
+    export_parser.add_argument("--out-dir", default="exports", help="directory for the files")
+    export_parser.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE, help="rows fetched at a time")
+    export_parser.set_defaults(handler=export)
+
+    conformance_parser = subparsers.add_parser("conformance", help="check storage backends against the interface")
+    conformance_parser.add_argument(
+        "--backends", nargs="+", choices=("sqlite", "sharded", "memory"), default=["sqlite", "sharded", "memory"]
+    )
+    conformance_parser.set_defaults(handler=conformance)
+
+    handler_checks_parser = subparsers.add_parser("handler-checks", help="check handlers against racing updates")
+    handler_checks_parser.set_defaults(handler=handler_checks)
+
+    generate_parser = subparsers.add_parser("generate", help="bulk-load a synthetic dataset")
+    generate_parser.add_argument("--db", default="synthetic.db", help="scratch database to fill")
+    generate_parser.add_argument("--users", type=int, default=10000)
+    generate_parser.add_argument("--results", type=int, default=100000)
+    generate_parser.add_argument("--tests", type=int, default=None, help="one per 20 results by default")
+    generate_parser.add_argument("--seed", type=int, default=0)
+    generate_parser.set_defaults(handler=generate)
+
+    bench_parser = subparsers.add_parser("bench", help="benchmark database methods at several dataset sizes")
+    bench_parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000], help="numbers of results")
+    bench_parser.add_argument("--repeat", type=int, default=20, help="calls per method")
+    bench_parser.add_argument("--seed", type=int, default=0)
+    bench_parser.add_argument("--output", default="bench.json", help="JSON report path")
+    bench_parser.set_defaults(handler=bench)
+
+    compare_parser = subparsers.add_parser("bench-compare", help="compare two benchmark reports")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("candidate")
+    compare_parser.set_defaults(handler=bench_compare)
+
+    rescore_parser = subparsers.add_parser("bench-rescore", help="time rescoring a test after an answer edit")
+    rescore_parser.add_argument("--results", type=int, default=100000, help="results of the test")
+    rescore_parser.add_argument("--seed", type=int, default=0)
+    rescore_parser.set_defaults(handler=bench_rescore)
+
+    render_parser = subparsers.add_parser("bench-render", help="time notification rendering against question count")
+    render_parser.add_argument("--questions", type=int, nargs="+", default=[10, 50, 200, 1000], help="question counts")
+    render_parser.add_argument("--repeat", type=int, default=200, help="renders per measurement")
+    render_parser.set_defaults(handler=bench_render)
+
+    replay_parser = subparsers.add_parser("replay", help="replay a recorded update log against a scratch database")
+    replay_parser.add_argument("log", help="log written with RECORD_UPDATES_FILE")
+    replay_parser.add_argument("--speed", type=float, default=1.0, help="speed-up of the recording, 0 for no waiting")
+    replay_parser.add_argument("--api-latency", type=float, default=0.0, help="milliseconds per fake Bot API call")
+    replay_parser.add_argument("--max-gap", type=float, default=60.0, help="longest idle gap kept, in seconds")
+    replay_parser.add_argument("--seed", type=int, default=0)
+    replay_parser.add_argument("--output", default="replay.json", help="JSON report path")
+    replay_parser.set_defaults(handler=replay)
+
+    replay_compare_parser = subparsers.add_parser("replay-compare", help="compare two replay reports")
+    replay_compare_parser.add_argument("baseline")
+    replay_compare_parser.add_argument("candidate")
+    replay_compare_parser.set_defaults(handler=replay_compare)
+
+    reshard_parser = subparsers.add_parser("reshard", help="copy data into a new shard layout")
+    reshard_parser.add_argument("--source-db", default=DB_NAME, help="single database to read")
+    reshard_parser.add_argument("--source-dir", default=SHARD_DIR, help="shard directory to read")
+    reshard_parser.add_argument(
+        "--source-shards", type=int, default=0, help="shard count of the source layout, 0 for the single database"
+    )
+    reshard_parser.add_argument("--target-dir", required=True, help="empty directory for the new layout")
+    reshard_parser.add_argument("--target-shards", type=int, default=SHARD_COUNT)
+    reshard_parser.set_defaults(handler=reshard_data)
+
+    return parser
+
+
+def main():
+    """Parse arguments and run the selected job."""
+    args = build_parser().parse_args()
+    asyncio.run(args.handler(args))
+
+
+if __name__ == "__main__":
+    main()
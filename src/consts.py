@@ -10,9 +10,102 @@ load_dotenv()
 # Bot token from BotFather
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 
+# Tokens of every bot served by this process, comma separated; BOT_TOKEN
+# alone if empty. All bots share the handlers, caches and database, each
+# bot only serves the tests created with it
+BOT_TOKENS = [token.strip() for token in os.getenv("BOT_TOKENS", "").split(",") if token.strip()] or [BOT_TOKEN]
+
+# Global question bank
+QUESTIONS_FILE = "questions.json"
+
+# Hot reload of the bank: seconds between checks of the file, between
+# collections of unused versions, and after which an idle session no
+# longer keeps its version alive
+BANK_WATCH_INTERVAL = int(os.getenv("BANK_WATCH_INTERVAL", "5"))
+BANK_GC_INTERVAL = 3600
+BANK_SESSION_TTL = 24 * 3600
+
+# Question sets uploaded by creators: maximum file size in bytes, limits on
+# questions, options and text lengths, and how many parsed sets are cached
+QUESTION_SET_MAX_BYTES = 64 * 1024
+QUESTION_SET_MAX_QUESTIONS = 50
+QUESTION_SET_MIN_OPTIONS = 2
+QUESTION_SET_MAX_OPTIONS = 10
+QUESTION_TEXT_MAX_LENGTH = 300
+OPTION_TEXT_MAX_LENGTH = 100
+QUESTION_SET_CACHE_SIZE = int(os.getenv("QUESTION_SET_CACHE_SIZE", "1024"))
+
+# Inline mode: seconds Telegram may cache a user's share cards, cards per
+# answer (Telegram's maximum) and how many users' cards are kept in memory
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+INLINE_RESULTS_LIMIT = 50
+SHARE_INDEX_SIZE = int(os.getenv("SHARE_INDEX_SIZE", "10000"))
+
+# Keys of the hot caches written at shutdown and restored at startup;
+# an empty value disables the snapshot
+CACHE_SNAPSHOT_FILE = os.getenv("CACHE_SNAPSHOT_FILE", "cache_snapshot.json") or None
+
+# Anonymized incoming updates are appended here as gzip-compressed JSON
+# Lines for replay; empty (the default) disables recording
+RECORD_UPDATES_FILE = os.getenv("RECORD_UPDATES_FILE", "") or None
+
 # Database settings
 DB_NAME = "friendsbot.db"
 
+# Storage backend: "sqlite" (persistent), "sharded" (tests spread over
+# SHARD_COUNT files in SHARD_DIR) or "memory" (nothing is persisted)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "sqlite")
+SHARD_DIR = os.getenv("SHARD_DIR", "shards")
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "4"))
+
+# What to keep when a friend takes the same test again:
+# "keep_all" stores every pass, "keep_best" / "keep_latest" keep one row per
+# friend and roll the other attempts into its attempts counters
+RETAKE_POLICIES = ("keep_all", "keep_best", "keep_latest")
+RETAKE_POLICY = os.getenv("RETAKE_POLICY", "keep_all")
+
+# Retention of old results, off unless RETENTION_DAYS is set above 0: "strip"
+# drops the stored answers of results older than RETENTION_DAYS, "delete"
+# removes them and keeps only aggregates. Neither can be undone
+RETENTION_MODES = ("strip", "delete")
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS") or "0")
+RETENTION_MODE = os.getenv("RETENTION_MODE", "strip")
+
+# Background maintenance: pause between passes, rows per retention batch,
+# pages per incremental vacuum step and the pause between steps (seconds)
+MAINTENANCE_INTERVAL = int(os.getenv("MAINTENANCE_INTERVAL", "3600"))
+MAINTENANCE_BATCH_SIZE = 500
+MAINTENANCE_VACUUM_PAGES = 200
+MAINTENANCE_STEP_PAUSE = 0.05
+
+# Online backups: snapshot directory, number of snapshots kept, seconds
+# between automatic snapshots (0 disables them), pages copied per step and
+# the pause between steps (seconds)
+BACKUP_DIR = os.getenv("BACKUP_DIR", "backups")
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL = int(os.getenv("BACKUP_INTERVAL", "86400"))
+BACKUP_STEP_PAGES = 64
+BACKUP_STEP_PAUSE = 0.01
+# A copy restarted by writes more often, or running longer, than this is
+# abandoned for a VACUUM INTO snapshot
+BACKUP_MAX_RESTARTS = 5
+BACKUP_MAX_SECONDS = 600
+
+# Results rescored per transaction when a creator edits their answers
+RESCORE_CHUNK_SIZE = 5000
+
+# Rows fetched at a time by the streaming export
+EXPORT_CHUNK_SIZE = 1000
+
+# Telegram IDs of users allowed to run admin commands, comma separated
+ADMIN_IDS = {int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id.strip()}
+
+# Maximum length of a Telegram message in UTF-16 code units
+TELEGRAM_MESSAGE_LIMIT = 4096
+
+# Number of rows on one page of the statistics browser
+STATS_PAGE_SIZE = 10
+
 # Result ranges and status descriptions
 RESULT_RANGES = {
     (0, 10): "вы два ноунейма друг для друга 😢",
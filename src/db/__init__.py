@@ -1,6 +1,54 @@
 """
 Database module for the bot.
 """
-from src.db.database import db
+from src.consts import STORAGE_BACKEND
+from src.db.base import Storage
+from src.db.database import Database
+from src.db.memory import MemoryDatabase
+from src.db.sharded import ShardedDatabase
 
-__all__ = ["db"]
+STORAGE_BACKENDS = {
+    "sqlite": Database,
+    "sharded": ShardedDatabase,
+    "memory": MemoryDatabase
+}
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    """
+    Create the storage backend selected by name.
+
+    Args:
+        backend: "sqlite", "sharded" or "memory"
+
+    Returns:
+        Storage: A new, not yet connected backend
+    """
+    if backend not in STORAGE_BACKENDS:
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return STORAGE_BACKENDS[backend]()
+
+
+def sqlite_databases(storage, include_users=False):
+    """
+    SQLite databases behind a storage backend.
+
+    Args:
+        storage: Storage backend, connected or not
+        include_users: Also return the shared users file of the sharded backend
+
+    Returns:
+        list: Database instances, every shard for the sharded backend and
+        none for the memory backend
+    """
+    if isinstance(storage, ShardedDatabase):
+        return storage.databases if include_users else list(storage.shards)
+    if isinstance(storage, Database):
+        return [storage]
+    return []
+
+
+# Create a single instance of the selected backend
+db = create_storage()
+
+__all__ = ["Database", "MemoryDatabase", "ShardedDatabase", "Storage", "STORAGE_BACKENDS", "create_storage", "db", "sqlite_databases"]
@@ -0,0 +1,298 @@
+"""
+Online backups of the bot database.
+
+Uses SQLite's online backup API through a separate connection in a worker
+thread. Pages are copied in small steps and the source is unlocked between
+steps, so the bot's writer is only held up for the duration of one step.
+A write made by the bot between steps makes SQLite restart the copy, which
+keeps every snapshot consistent. Under steady writes the copy could restart
+forever, so after BACKUP_MAX_RESTARTS restarts or BACKUP_MAX_SECONDS it is
+abandoned for VACUUM INTO, which writes the snapshot from one read
+transaction; with the bot's database in WAL mode that never blocks the writer.
+
+A single SQLite database is snapshotted to one file. The sharded backend
+is snapshotted to a directory with users.db and every shard, copied one
+after another: each file is consistent on its own, and a test written
+between two copies can only be missing, never half-written.
+"""
+import asyncio
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from datetime import datetime
+
+from src.consts import (
+    BACKUP_DIR,
+    BACKUP_INTERVAL,
+    BACKUP_KEEP,
+    BACKUP_MAX_RESTARTS,
+    BACKUP_MAX_SECONDS,
+    BACKUP_STEP_PAGES,
+    BACKUP_STEP_PAUSE
+)
+from src.db import ShardedDatabase, db, sqlite_databases
+
+logger = logging.getLogger(__name__)
+
+BACKUP_PREFIX = "friendsbot-"
+BACKUP_SUFFIX = ".db"
+PARTIAL_SUFFIX = ".partial"
+
+
+class BackupUnsupportedError(ValueError):
+    """The storage backend keeps no SQLite files to snapshot."""
+
+
+def backup_sources(storage):
+    """
+    SQLite files behind a storage backend.
+
+    Args:
+        storage: Storage backend, connected or not
+
+    Returns:
+        list: Paths of the files, users file first for the sharded backend
+
+    Raises:
+        BackupUnsupportedError: If the backend keeps nothing on disk
+    """
+    databases = sqlite_databases(storage, include_users=True)
+    if databases:
+        return [database.db_name for database in databases]
+    raise BackupUnsupportedError(
+        f"The {type(storage).__name__} backend keeps nothing on disk, "
+        "only the sqlite and sharded backends can be backed up"
+    )
+
+
+class _BackupBoundReached(Exception):
+    """The step-wise copy restarted too often or ran too long."""
+
+
+def _run_backup(source_path, target_path, pages, pause,
+                max_restarts=BACKUP_MAX_RESTARTS, max_seconds=BACKUP_MAX_SECONDS):
+    """
+    Copy the database page by page (runs in a worker thread).
+
+    Falls back to VACUUM INTO once the copy has restarted more than
+    max_restarts times or run longer than max_seconds.
+
+    Returns:
+        dict: Number of steps and restarts, the longest and total time the
+        source was locked, the total duration in seconds and the method used
+    """
+    step_durations = []
+    restarts = 0
+    last_remaining = None
+    started = time.perf_counter()
+    step_started = started
+
+    def progress(status, remaining, total):
+        nonlocal step_started, restarts, last_remaining
+        step_durations.append(time.perf_counter() - step_started)
+        # A write to the source starts the copy over with every page remaining
+        if last_remaining is not None and remaining > last_remaining:
+            restarts += 1
+        last_remaining = remaining
+        if restarts > max_restarts or time.perf_counter() - started > max_seconds:
+            raise _BackupBoundReached()
+        # The source lock is released between steps, let the writer in
+        time.sleep(pause)
+        step_started = time.perf_counter()
+
+    method = 'backup'
+    source = sqlite3.connect(source_path)
+    try:
+        target = sqlite3.connect(target_path)
+        try:
+            source.backup(target, pages=pages, progress=progress)
+            # Make the snapshot a self-contained file without -wal/-shm companions
+            target.execute('PRAGMA journal_mode = DELETE')
+        except _BackupBoundReached:
+            method = 'vacuum_into'
+        finally:
+            target.close()
+
+        if method == 'vacuum_into':
+            logger.warning(
+                "Backup of %s restarted %d times in %.1fs, falling back to VACUUM INTO",
+                source_path, restarts, time.perf_counter() - started
+            )
+            os.remove(target_path)
+            # One read transaction, not a lock the writer waits on, so it
+            # adds no step timing
+            source.execute('VACUUM INTO ?', (target_path,))
+    finally:
+        source.close()
+
+    return {
+        'steps': len(step_durations),
+        'restarts': restarts,
+        'max_step_lock': max(step_durations, default=0.0),
+        'total_lock': sum(step_durations),
+        'duration': time.perf_counter() - started,
+        'method': method
+    }
+
+
+def rotate_backups(backup_dir=BACKUP_DIR, keep=BACKUP_KEEP):
+    """
+    Delete all but the newest backups.
+
+    Args:
+        backup_dir: Directory with the snapshots
+        keep: Number of snapshots to keep
+
+    Returns:
+        list: Paths of the deleted snapshots
+    """
+    snapshots = sorted(
+        name for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and not name.endswith(PARTIAL_SUFFIX)
+        and (name.endswith(BACKUP_SUFFIX) or os.path.isdir(os.path.join(backup_dir, name)))
+    )
+    removed = [os.path.join(backup_dir, name) for name in snapshots[:-keep]] if keep else []
+    for path in removed:
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        else:
+            os.remove(path)
+    return removed
+
+
+async def create_backup(storage=None, backup_dir=BACKUP_DIR, keep=BACKUP_KEEP,
+                        pages=BACKUP_STEP_PAGES, pause=BACKUP_STEP_PAUSE):
+    """
+    Take a consistent snapshot of the database while the bot keeps running.
+
+    The snapshot is written under a temporary name and renamed when complete,
+    then old snapshots are rotated out. Names carry microseconds, so two
+    backups taken within one second never overwrite each other.
+
+    Args:
+        storage: Storage backend to snapshot, the bot's configured one if None
+        backup_dir: Directory for the snapshots
+        keep: Number of snapshots to keep
+        pages: Pages copied per step
+        pause: Seconds to wait between steps
+
+    Returns:
+        dict: Snapshot path, size and step timings
+
+    Raises:
+        BackupUnsupportedError: If the backend keeps nothing on disk
+    """
+    storage = db if storage is None else storage
+    sources = backup_sources(storage)
+    sharded = isinstance(storage, ShardedDatabase)
+
+    os.makedirs(backup_dir, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+    path = os.path.join(backup_dir, f"{BACKUP_PREFIX}{stamp}" + ("" if sharded else BACKUP_SUFFIX))
+    partial_path = path + PARTIAL_SUFFIX
+
+    reports = []
+    try:
+        if sharded:
+            os.makedirs(partial_path)
+            for source_path in sources:
+                target_path = os.path.join(partial_path, os.path.basename(source_path))
+                reports.append(await asyncio.to_thread(_run_backup, source_path, target_path, pages, pause))
+        else:
+            reports.append(await asyncio.to_thread(_run_backup, sources[0], partial_path, pages, pause))
+    except Exception:
+        if os.path.isdir(partial_path):
+            shutil.rmtree(partial_path)
+        elif os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    os.replace(partial_path, path)
+
+    files = [os.path.join(path, name) for name in os.listdir(path)] if sharded else [path]
+    report = {
+        'steps': sum(part['steps'] for part in reports),
+        'restarts': sum(part['restarts'] for part in reports),
+        'fallbacks': sum(part['method'] == 'vacuum_into' for part in reports),
+        'max_step_lock': max(part['max_step_lock'] for part in reports),
+        'total_lock': sum(part['total_lock'] for part in reports),
+        'duration': sum(part['duration'] for part in reports),
+        'path': path,
+        'files': len(files),
+        'size': sum(os.path.getsize(file) for file in files),
+        'rotated': rotate_backups(backup_dir, keep)
+    }
+
+    logger.info(
+        "Backup %s written: %d files, %d bytes in %.2fs, %d steps, %d restarts, "
+        "%d VACUUM INTO fallbacks, longest lock %.1fms",
+        path, report['files'], report['size'], report['duration'], report['steps'],
+        report['restarts'], report['fallbacks'], report['max_step_lock'] * 1000
+    )
+    return report
+
+
+def verify_backup(path):
+    """
+    Check that a snapshot can be restored.
+
+    Opens every file of the snapshot read-only, runs PRAGMA integrity_check
+    and counts the rows of the main tables across the files.
+
+    Args:
+        path: Path of the snapshot file or sharded snapshot directory
+
+    Returns:
+        dict: Whether the snapshot is intact, the integrity messages and row counts
+    """
+    if not os.path.exists(path):
+        raise FileNotFoundError(path)
+
+    if os.path.isdir(path):
+        files = sorted(
+            os.path.join(path, name) for name in os.listdir(path) if name.endswith(BACKUP_SUFFIX)
+        )
+    else:
+        files = [path]
+
+    ok = bool(files)
+    messages = []
+    counts = dict.fromkeys(('users', 'tests', 'test_results'), 0)
+    for file in files:
+        conn = sqlite3.connect(f"file:{file}?mode=ro", uri=True)
+        try:
+            file_messages = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+            tables = {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+            for table in counts:
+                if table in tables:
+                    counts[table] += conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        finally:
+            conn.close()
+        ok = ok and file_messages == ['ok']
+        if len(files) > 1:
+            file_messages = [f"{os.path.basename(file)}: {message}" for message in file_messages]
+        messages.extend(file_messages)
+
+    return {
+        'ok': ok,
+        'messages': messages,
+        'counts': counts
+    }
+
+
+async def backup_loop(interval=BACKUP_INTERVAL):
+    """
+    Take a snapshot every interval seconds.
+
+    Args:
+        interval: Seconds between snapshots
+    """
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await create_backup()
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Backup failed")
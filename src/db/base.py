@@ -0,0 +1,405 @@
+"""
+Storage interface shared by all database backends.
+
+Handlers only talk to the methods declared here, so the backend can be
+chosen at startup (see STORAGE_BACKEND) without touching them.
+"""
+import random
+from abc import ABC, abstractmethod
+
+from src.consts import RESULT_RANGES, STATS_PAGE_SIZE
+
+
+def generate_test_id():
+    """Generate a random test ID used in deep links."""
+    return f"s_{random.randint(1000000000, 9999999999)}"
+
+
+def score_answers(original_answers, answers):
+    """
+    Calculate the percentage of a taker's answers matching the creator's.
+
+    Args:
+        original_answers: The creator's answers (question_id -> option index)
+        answers: The taker's answers
+
+    Returns:
+        int: Score in percent
+    """
+    correct_count = 0
+    for q_id, original_answer_index in original_answers.items():
+        taker_answer_index = answers.get(q_id)
+        if taker_answer_index == original_answer_index:
+            correct_count += 1
+
+    return percentage_of(correct_count, len(original_answers))
+
+
+def percentage_of(correct_count, total_questions):
+    """
+    Score in percent for a number of matching answers.
+
+    Args:
+        correct_count: Number of answers matching the creator's
+        total_questions: Number of questions the creator answered
+
+    Returns:
+        int: Score in percent
+    """
+    return round((correct_count / total_questions) * 100)
+
+
+def get_status(percentage):
+    """
+    Determine the status text for a score.
+
+    Args:
+        percentage: Score in percent
+
+    Returns:
+        str: Status from RESULT_RANGES, or None
+    """
+    for (min_val, max_val), status_text in RESULT_RANGES.items():
+        if min_val <= percentage <= max_val:
+            return status_text
+    return None
+
+
+def test_summary(test_id, created_at, passes_count, score_sum):
+    """
+    Per-test aggregates as shown by the /stats browser.
+
+    Args:
+        test_id: ID of the test
+        created_at: Creation time of the test
+        passes_count: Passes, rolled up ones included
+        score_sum: Sum of their scores
+
+    Returns:
+        dict: The aggregates with the average score
+    """
+    return {
+        'test_id': test_id,
+        'created_at': created_at,
+        'passes_count': passes_count,
+        'score_sum': score_sum,
+        'average_score': round(score_sum / passes_count) if passes_count else 0
+    }
+
+
+# Key of the per-bot aggregates for tests of no bot: those created before
+# multi-bot hosting, until assign_unowned_tests hands them to a bot
+NO_BOT = 0
+
+
+def bot_key(bot_id):
+    """Key of a test's bot in the per-bot aggregates."""
+    return NO_BOT if bot_id is None else bot_id
+
+
+def answer_counter_rows(original_answers, taker_answers=None):
+    """
+    Turn a test or a result into answer counter deltas.
+
+    Args:
+        original_answers: The creator's answers (question_id -> option index)
+        taker_answers: A taker's answers, or None when counting the test itself
+
+    Returns:
+        list: (question_id, option_index, role, delta) tuples
+    """
+    if taker_answers is None:
+        return [(q_id, option_index, 'creator', 1) for q_id, option_index in original_answers.items()]
+
+    rows = []
+    for q_id, option_index in taker_answers.items():
+        rows.append((q_id, option_index, 'taker', 1))
+        if q_id in original_answers and original_answers[q_id] != option_index:
+            rows.append((q_id, option_index, 'miss', 1))
+    return rows
+
+
+def rank_from_histogram(buckets, score):
+    """
+    Rank a score against a score histogram with a prefix sum.
+
+    Args:
+        buckets: (score, count) pairs
+        score: Score to rank
+
+    Returns:
+        dict: Place, total passes and the share of other passes beaten
+    """
+    total = 0
+    below = 0
+    above = 0
+    for bucket_score, count in buckets:
+        total += count
+        if bucket_score < score:
+            below += count
+        elif bucket_score > score:
+            above += count
+
+    # The ranked pass itself, if stored, is not counted among the beaten ones
+    others = total - 1 if total > below + above else total
+    return {
+        'place': above + 1,
+        'total': total,
+        'beaten_percentage': round(below * 100 / others) if others > 0 else None
+    }
+
+
+class Storage(ABC):
+    """
+    Abstract storage backend.
+
+    Every backend must pass the shared conformance checks in
+    src.db.conformance.
+    """
+
+    @abstractmethod
+    async def connect(self):
+        """Open the backend and create its structures."""
+
+    @abstractmethod
+    async def close(self):
+        """Release the backend's resources."""
+
+    @abstractmethod
+    async def check_retake_policy(self):
+        """
+        Make sure the stored data is laid out for the configured retake policy.
+
+        Raises:
+            RuntimeError: A migration has to be run first
+        """
+
+    @abstractmethod
+    async def add_user(self, user_id, username, first_name, last_name):
+        """Add or update user."""
+
+    @abstractmethod
+    async def add_question_set(self, set_hash, questions, user_id):
+        """
+        Store a question set under its content hash; storing it again is a no-op.
+        """
+
+    @abstractmethod
+    async def get_question_set(self, set_hash):
+        """
+        Get a stored question set.
+
+        Returns:
+            list: Questions of the set, or None
+        """
+
+    @abstractmethod
+    async def add_bank_version(self, set_hash, questions):
+        """
+        Store a version of the global question bank under its content hash.
+        """
+
+    @abstractmethod
+    async def get_bank_versions(self):
+        """
+        Get all stored versions of the global bank.
+
+        Returns:
+            list: Content hashes
+        """
+
+    @abstractmethod
+    async def get_referenced_bank_versions(self):
+        """
+        Get the content hashes stored tests use.
+
+        A hash counts whether a test is pinned to it as a bank version or
+        uses it as an uploaded set: both live in the same question store,
+        so an upload with the same content as a bank version keeps it.
+
+        Returns:
+            set: Content hashes
+        """
+
+    @abstractmethod
+    async def pin_unversioned_tests(self, set_hash):
+        """
+        Pin tests on the global bank created before versioning to a version.
+
+        Returns:
+            int: Number of tests pinned
+        """
+
+    @abstractmethod
+    async def assign_unowned_tests(self, bot_id):
+        """
+        Assign tests created before multi-bot hosting to a bot.
+
+        Their share of the per-bot aggregates moves to the bot with them.
+
+        Returns:
+            int: Number of tests assigned
+        """
+
+    @abstractmethod
+    async def delete_bank_versions(self, set_hashes):
+        """
+        Delete bank versions; the caller makes sure nothing references them.
+        """
+
+    @abstractmethod
+    async def create_test(self, user_id, answers, question_set=None, bank_version=None, bot_id=None):
+        """
+        Create a new test for a user.
+
+        A test uses either a custom set (question_set) or the version of the
+        global bank it was created on (bank_version). Only tests on the
+        global bank feed the answer counters, custom sets have their own
+        question IDs. bot_id is the bot the test was created with; only
+        that bot serves it.
+
+        Returns:
+            str: ID of the new test
+        """
+
+    @abstractmethod
+    async def get_test(self, test_id):
+        """
+        Get test details by test_id.
+
+        Returns:
+            dict: Creator ID, answers, question set and bank version hashes, bot ID and creator names, or None
+        """
+
+    @abstractmethod
+    async def save_test_result(self, test_id, taker_id, taker_username, answers):
+        """
+        Save the results of a test taken by a user.
+
+        Returns:
+            dict: Percentage, status, rank and creator info, or None if the test does not exist
+        """
+
+    @abstractmethod
+    async def update_test_answers(self, test_id, answers):
+        """
+        Replace the creator's answers and rescore every stored result.
+
+        The new answers must be for the same questions, otherwise
+        ValueError is raised.
+
+        Returns:
+            dict: Number of rescored results and of results kept as they
+            were because their answers were dropped, or None if the test
+            does not exist
+        """
+
+    @abstractmethod
+    async def resume_rescores(self):
+        """
+        Finish rescores of answer edits an earlier run was cut short in.
+
+        Returns:
+            int: Number of tests whose rescore was finished
+        """
+
+    @abstractmethod
+    async def get_user_tests(self, user_id, bot_id=None):
+        """
+        Get all tests created by a user, with one bot only if bot_id is given.
+
+        Returns:
+            list: (test_id, created_at) rows, newest first
+        """
+
+    @abstractmethod
+    async def get_test_statistics(self, user_id, bot_id=None):
+        """
+        Get statistics for all tests created by a user, with one bot only if bot_id is given.
+
+        Returns:
+            dict: Aggregates, best and worst friends and per-test summaries, or None
+        """
+
+    @abstractmethod
+    async def get_test_summaries_page(self, user_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """
+        Get one page of a creator's tests with their aggregates, newest first.
+
+        Returns:
+            dict: 'tests' as in get_test_statistics and the (created_at, test_id)
+                cursor of the next page (None if last)
+        """
+
+    @abstractmethod
+    async def get_test_results_page(self, test_id, cursor=None, limit=STATS_PAGE_SIZE):
+        """
+        Get one page of passes of a test ordered by (score, result_id) descending.
+
+        Returns:
+            dict: Page rows and the cursor of the next page (None if last)
+        """
+
+    @abstractmethod
+    async def get_friend_history_page(self, creator_id, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """
+        Get one page of a friend's passes ordered by (created_at, result_id) descending.
+
+        With bot_id only passes of tests created with that bot are listed.
+
+        Returns:
+            dict: Page rows and the cursor of the next page (None if last)
+        """
+
+    @abstractmethod
+    async def get_taker_stats(self, taker_id, bot_id=None):
+        """
+        Get the running totals of every pass a friend made, retakes included.
+
+        Only passes of tests of bot_id count when it is given.
+
+        Returns:
+            dict: Number of passes, score sum and average score, or None if there are none
+        """
+
+    @abstractmethod
+    async def get_taken_tests_page(self, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """
+        Get one page of the tests a friend took ordered by (created_at, result_id) descending.
+
+        Only tests of bot_id are listed when it is given.
+
+        Returns:
+            dict: Page rows with the creators and the cursor of the next page (None if last)
+        """
+
+    @abstractmethod
+    async def get_top_friends(self, limit=10, bot_id=None):
+        """
+        Get top friends with highest average scores over every pass, retakes included.
+
+        Only passes of tests of bot_id count when it is given.
+
+        Returns:
+            list: Friends with their average scores and number of passes
+        """
+
+    @abstractmethod
+    async def get_question_statistics(self, bot_id=None):
+        """
+        Get answer distributions for every question.
+
+        Only tests of bot_id and their passes count when it is given.
+
+        Returns:
+            dict: question_id -> role -> {option_index: count}
+        """
+
+    @abstractmethod
+    async def get_score_rank(self, test_id, score):
+        """
+        Get the rank of a score among all passes of a test.
+
+        Returns:
+            dict: Place, total passes and the share of other passes beaten
+        """
@@ -0,0 +1,363 @@
+"""
+Database benchmark suite with query-plan guards.
+
+For every dataset size a scratch database is generated, each hot Database
+method is timed, and every SELECT it runs is checked with EXPLAIN QUERY PLAN:
+any scan of a large table, even through an index, or a temporary sort in a paginated query, is
+reported as a violation so index regressions fail loudly.
+
+benchmark_rescore times rescoring a single large test after its creator
+edits the answers.
+"""
+import json
+import os
+import re
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from src.consts import STATS_PAGE_SIZE
+from src.db.base import score_answers
+from src.db.database import Database
+from src.db.synthetic import generate_dataset
+
+# Tables that grow with traffic and must only be searched: a SCAN reads
+# every entry even through a covering index, so only SEARCH plans pass
+LARGE_TABLES = ("users", "tests", "test_results", "taker_stats")
+FULL_SCAN = re.compile(r"^SCAN (%s)\b" % "|".join(LARGE_TABLES))
+TEMP_SORT = re.compile(r"USE TEMP B-TREE FOR (ORDER BY|RIGHT PART OF ORDER BY)")
+
+# The bot every synthetic test belongs to; the handlers always pass their bot
+BOT_ID = 101
+
+# Methods that must read rows in index order to stay bounded
+PAGINATED_METHODS = (
+    "get_test_summaries_page", "get_test_results_page", "get_friend_history_page", "get_taken_tests_page"
+)
+
+
+async def _sample_ids(database):
+    """Pick the IDs the benchmarked calls are made with."""
+    async with database.conn.execute('''
+    SELECT test_id, SUM(count) AS passes
+    FROM score_histogram
+    GROUP BY test_id
+    ORDER BY passes DESC
+    LIMIT 1
+    ''') as cursor:
+        popular_test_id, _ = await cursor.fetchone()
+
+    async with database.conn.execute(
+        'SELECT user_id FROM tests WHERE test_id = ?', (popular_test_id,)
+    ) as cursor:
+        (creator_id,) = await cursor.fetchone()
+
+    async with database.conn.execute(
+        'SELECT taker_id FROM test_results WHERE test_id = ? LIMIT 1', (popular_test_id,)
+    ) as cursor:
+        (taker_id,) = await cursor.fetchone()
+
+    # A cursor halfway down the popular test
+    async with database.conn.execute('''
+    SELECT score, result_id
+    FROM test_results
+    WHERE test_id = ?
+    ORDER BY score DESC, result_id DESC
+    LIMIT 1 OFFSET (SELECT SUM(count) / 2 FROM score_histogram WHERE test_id = ?)
+    ''', (popular_test_id, popular_test_id)) as cursor:
+        deep_cursor = await cursor.fetchone()
+
+    return {
+        'test_id': popular_test_id,
+        'creator_id': creator_id,
+        'taker_id': taker_id,
+        'deep_cursor': tuple(deep_cursor) if deep_cursor else None
+    }
+
+
+def _benchmark_calls(ids, questions, next_taker_id):
+    """The benchmarked calls as (name, method name, argument factory) tuples."""
+    answers = {str(question['id']): 0 for question in questions}
+    taker_ids = iter(range(next_taker_id, next_taker_id + 10 ** 9))
+
+    return [
+        ("get_test", "get_test", lambda: (ids['test_id'],)),
+        ("get_test_statistics", "get_test_statistics", lambda: (ids['creator_id'],)),
+        ("get_test_summaries_page", "get_test_summaries_page", lambda: (ids['creator_id'],)),
+        ("get_test_results_page", "get_test_results_page", lambda: (ids['test_id'],)),
+        ("get_test_results_page_deep", "get_test_results_page", lambda: (ids['test_id'], ids['deep_cursor'])),
+        ("get_friend_history_page", "get_friend_history_page", lambda: (ids['creator_id'], ids['taker_id'])),
+        ("get_taker_stats", "get_taker_stats", lambda: (ids['taker_id'], BOT_ID)),
+        ("get_taken_tests_page", "get_taken_tests_page", lambda: (ids['taker_id'], None, STATS_PAGE_SIZE, BOT_ID)),
+        ("get_top_friends", "get_top_friends", lambda: (10, BOT_ID)),
+        ("get_question_statistics", "get_question_statistics", lambda: (BOT_ID,)),
+        ("get_score_rank", "get_score_rank", lambda: (ids['test_id'], 50)),
+        (
+            "save_test_result", "save_test_result",
+            lambda: (ids['test_id'], next(taker_ids), "bench", answers)
+        ),
+    ]
+
+
+async def _query_plans(database, method, args):
+    """
+    Run a method once and explain every SELECT it executed.
+
+    Returns:
+        list: (statement, plan details) pairs
+    """
+    statements = []
+    await database.conn.set_trace_callback(statements.append)
+    try:
+        await method(*args)
+    finally:
+        await database.conn.set_trace_callback(None)
+
+    plans = []
+    for statement in statements:
+        if not statement.lstrip().upper().startswith("SELECT"):
+            continue
+        async with database.conn.execute(f"EXPLAIN QUERY PLAN {statement}") as cursor:
+            plans.append((" ".join(statement.split()), [row[3] for row in await cursor.fetchall()]))
+    return plans
+
+
+def find_plan_violations(name, method_name, plans):
+    """
+    Check explained statements against the index rules.
+
+    Args:
+        name: Benchmark name
+        method_name: Database method that ran the statements
+        plans: (statement, plan details) pairs
+
+    Returns:
+        list: Violation descriptions
+    """
+    violations = []
+    for statement, details in plans:
+        for detail in details:
+            if FULL_SCAN.search(detail):
+                violations.append(f"{name}: full scan '{detail}' in: {statement}")
+            elif method_name in PAGINATED_METHODS and TEMP_SORT.search(detail):
+                violations.append(f"{name}: temporary sort '{detail}' in: {statement}")
+    return violations
+
+
+def summarize_timings(samples):
+    """Summarize call durations in milliseconds."""
+    samples = sorted(sample * 1000 for sample in samples)
+    return {
+        'min_ms': round(samples[0], 3),
+        'median_ms': round(statistics.median(samples), 3),
+        'p95_ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))], 3),
+        'calls': len(samples)
+    }
+
+
+def git_revision():
+    """Current git revision, if the tree is a git checkout."""
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def benchmark_size(questions, results_count, repeat=20, seed=0, directory=None):
+    """
+    Generate a dataset of the given size and benchmark it.
+
+    Args:
+        questions: Question bank used for the dataset
+        results_count: Number of results in the dataset
+        repeat: Calls per benchmarked method
+        seed: Random seed of the dataset
+        directory: Directory for the scratch database
+
+    Returns:
+        dict: Dataset counts, generation time, timings, plans and violations
+    """
+    fd, path = tempfile.mkstemp(suffix=".db", dir=directory)
+    os.close(fd)
+    database = Database(path, retake_policy="keep_all")
+    await database.connect()
+    try:
+        started = time.perf_counter()
+        users_count = max(100, results_count // 10)
+        dataset = await generate_dataset(database, questions, users_count, results_count, seed=seed, bot_id=BOT_ID)
+        await database.analyze_table("test_results")
+        generation_seconds = time.perf_counter() - started
+
+        ids = await _sample_ids(database)
+        calls = _benchmark_calls(ids, questions, users_count + 1)
+
+        timings = {}
+        plans = {}
+        violations = []
+        for name, method_name, make_args in calls:
+            method = getattr(database, method_name)
+
+            explained = await _query_plans(database, method, make_args())
+            plans[name] = [{'sql': sql, 'plan': details} for sql, details in explained]
+            violations.extend(find_plan_violations(name, method_name, explained))
+
+            samples = []
+            for _ in range(repeat):
+                args = make_args()
+                call_started = time.perf_counter()
+                await method(*args)
+                samples.append(time.perf_counter() - call_started)
+            timings[name] = summarize_timings(samples)
+
+        return {
+            'dataset': dataset,
+            'generation_seconds': round(generation_seconds, 3),
+            'database_bytes': os.path.getsize(path),
+            'timings': timings,
+            'plans': plans,
+            'violations': violations
+        }
+    finally:
+        await database.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+async def run_benchmarks(questions, sizes, repeat=20, seed=0, directory=None):
+    """
+    Benchmark every dataset size.
+
+    Args:
+        questions: Question bank used for the datasets
+        sizes: Numbers of results to benchmark
+        repeat: Calls per benchmarked method
+        seed: Random seed of the datasets
+        directory: Directory for the scratch databases
+
+    Returns:
+        dict: JSON-serializable report
+    """
+    report = {
+        'revision': git_revision(),
+        'started_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'repeat': repeat,
+        'sizes': {}
+    }
+    for size in sizes:
+        report['sizes'][str(size)] = await benchmark_size(questions, size, repeat, seed, directory)
+    return report
+
+
+def compare_reports(baseline, candidate):
+    """
+    Compare the median timings of two benchmark reports.
+
+    Args:
+        baseline: Earlier report
+        candidate: Newer report
+
+    Returns:
+        list: (size, benchmark, baseline ms, candidate ms, ratio) rows
+    """
+    rows = []
+    for size, candidate_size in candidate['sizes'].items():
+        baseline_size = baseline['sizes'].get(size)
+        if not baseline_size:
+            continue
+        for name, timing in candidate_size['timings'].items():
+            if name not in baseline_size['timings']:
+                continue
+            before = baseline_size['timings'][name]['median_ms']
+            after = timing['median_ms']
+            rows.append((size, name, before, after, after / before if before else None))
+    return rows
+
+
+async def _rescore_row_by_row(database, test_id, answers):
+    """Baseline for rescoring: score every result in Python, one UPDATE per row."""
+    async with database.conn.execute(
+        'SELECT result_id, answers FROM test_results WHERE test_id = ? AND answers IS NOT NULL', (test_id,)
+    ) as cursor:
+        rows = await cursor.fetchall()
+
+    for result_id, taker_answers in rows:
+        score = score_answers(answers, json.loads(taker_answers))
+        await database.conn.execute(
+            'UPDATE test_results SET score = ? WHERE result_id = ?', (score, result_id)
+        )
+    await database.conn.commit()
+    return len(rows)
+
+
+async def benchmark_rescore(questions, results_count, seed=0, directory=None, sample_size=1000):
+    """
+    Time rescoring every result of one test after its answers are edited.
+
+    The set-based update_test_answers is compared with a row-by-row
+    baseline that only rewrites scores, and a random sample of rescored
+    results is checked against score_answers.
+
+    Args:
+        questions: Question bank used for the dataset
+        results_count: Number of results of the test
+        seed: Random seed of the dataset
+        directory: Directory for the scratch database
+        sample_size: Number of results checked after rescoring
+
+    Returns:
+        dict: Timings, rescore summary and the number of mismatched scores
+    """
+    fd, path = tempfile.mkstemp(suffix=".db", dir=directory)
+    os.close(fd)
+    database = Database(path, retake_policy="keep_all")
+    await database.connect()
+    try:
+        await generate_dataset(database, questions, results_count + 1, results_count, tests_count=1, seed=seed)
+        await database.analyze_table("test_results")
+
+        async with database.conn.execute('SELECT test_id, answers FROM tests') as cursor:
+            test_id, original = await cursor.fetchone()
+        original = json.loads(original)
+
+        # Move every answer to the next option
+        options_count = {str(question['id']): len(question['options']) for question in questions}
+        edited = {q_id: (option + 1) % options_count[q_id] for q_id, option in original.items()}
+
+        started = time.perf_counter()
+        summary = await database.update_test_answers(test_id, edited)
+        rescore_seconds = time.perf_counter() - started
+
+        async with database.conn.execute('''
+        SELECT score, answers
+        FROM test_results
+        WHERE test_id = ? AND answers IS NOT NULL
+        ORDER BY random()
+        LIMIT ?
+        ''', (test_id, sample_size)) as cursor:
+            sample = await cursor.fetchall()
+        mismatches = sum(score != score_answers(edited, json.loads(answers)) for score, answers in sample)
+
+        started = time.perf_counter()
+        await _rescore_row_by_row(database, test_id, original)
+        baseline_seconds = time.perf_counter() - started
+
+        return {
+            'results': results_count,
+            'rescored': summary['rescored'],
+            'kept': summary['kept'],
+            'rescore_seconds': round(rescore_seconds, 3),
+            'row_by_row_seconds': round(baseline_seconds, 3),
+            'sampled': len(sample),
+            'mismatches': mismatches
+        }
+    finally:
+        await database.close()
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
@@ -0,0 +1,543 @@
+"""
+Conformance checks every storage backend must pass.
+
+Each check gets a fresh, connected backend and verifies the behaviour the
+handlers rely on. Failures raise ConformanceError rather than using
+assert, so the checks still run under python -O. Run them with:
+
+    python -m src.cli conformance
+"""
+import os
+import tempfile
+import traceback
+
+from src.db.database import Database
+from src.db.memory import MemoryDatabase
+from src.db.sharded import ShardedDatabase
+
+CHECKS = []
+
+CREATOR_ID = 1
+ANSWERS = {"1": 0, "2": 1, "3": 2, "4": 3}
+
+
+class ConformanceError(Exception):
+    """A backend does not behave the way the handlers rely on."""
+
+
+def expect(condition, detail=None):
+    """
+    Fail the running check unless condition holds.
+
+    Args:
+        condition: Expected outcome
+        detail: Value shown in the failure, e.g. the object compared
+
+    Raises:
+        ConformanceError: If condition is false
+    """
+    if not condition:
+        raise ConformanceError("expectation failed" if detail is None else repr(detail))
+
+
+def check(retake_policy="keep_all"):
+    """Register a conformance check run against a backend with the given retake policy."""
+    def register(func):
+        func.retake_policy = retake_policy
+        CHECKS.append(func)
+        return func
+    return register
+
+
+async def _create_test(storage, creator_id=CREATOR_ID):
+    """Create a creator and a test with the reference answers."""
+    await storage.add_user(creator_id, f"creator{creator_id}", "Creator", "")
+    return await storage.create_test(creator_id, ANSWERS)
+
+
+def _answers_with_score(correct):
+    """Answers matching the reference answers on the first `correct` questions."""
+    return {
+        q_id: option_index if i < correct else option_index + 1
+        for i, (q_id, option_index) in enumerate(ANSWERS.items())
+    }
+
+
+@check()
+async def check_missing_test(storage):
+    expect(await storage.get_test("s_0") is None)
+    expect(await storage.save_test_result("s_0", 2, "friend", ANSWERS) is None)
+    expect(await storage.get_test_statistics(CREATOR_ID) is None)
+
+
+@check()
+async def check_test_round_trip(storage):
+    test_id = await _create_test(storage)
+    expect(test_id.startswith("s_"))
+
+    test_info = await storage.get_test(test_id)
+    expect(test_info == {
+        'user_id': CREATOR_ID,
+        'answers': ANSWERS,
+        'question_set': None,
+        'bank_version': None,
+        'bot_id': None,
+        'username': f"creator{CREATOR_ID}",
+        'first_name': "Creator",
+        'last_name': ""
+    }, test_info)
+
+    # Returned answers must not alias the stored ones
+    test_info['answers']["1"] = 99
+    expect((await storage.get_test(test_id))['answers'] == ANSWERS)
+
+    user_tests = await storage.get_user_tests(CREATOR_ID)
+    expect([row[0] for row in user_tests] == [test_id], user_tests)
+
+
+@check()
+async def check_tests_per_bot(storage):
+    legacy_test = await _create_test(storage)
+    first_bot_test = await storage.create_test(CREATOR_ID, ANSWERS, bot_id=101)
+    second_bot_test = await storage.create_test(CREATOR_ID, ANSWERS, bot_id=202)
+    await storage.save_test_result(second_bot_test, 2, "friend", ANSWERS)
+
+    expect((await storage.get_test(first_bot_test))['bot_id'] == 101)
+    expect(await storage.assign_unowned_tests(101) == 1)
+    expect((await storage.get_test(legacy_test))['bot_id'] == 101)
+
+    first_bot_tests = {row[0] for row in await storage.get_user_tests(CREATOR_ID, bot_id=101)}
+    expect(first_bot_tests == {legacy_test, first_bot_test}, first_bot_tests)
+    expect(len(await storage.get_user_tests(CREATOR_ID)) == 3)
+
+    stats = await storage.get_test_statistics(CREATOR_ID, bot_id=202)
+    expect([test['test_id'] for test in stats['tests']] == [second_bot_test], stats)
+    expect(stats['total_passes'] == 1)
+    expect(await storage.get_test_statistics(CREATOR_ID, bot_id=303) is None)
+
+    history = await storage.get_friend_history_page(CREATOR_ID, 2, bot_id=202)
+    expect([result['test_id'] for result in history['results']] == [second_bot_test], history)
+    expect((await storage.get_friend_history_page(CREATOR_ID, 2, bot_id=101))['results'] == [])
+    expect(len((await storage.get_friend_history_page(CREATOR_ID, 2))['results']) == 1)
+
+
+@check()
+async def check_aggregates_per_bot(storage):
+    legacy_test = await _create_test(storage)
+    first_bot_test = await storage.create_test(CREATOR_ID, ANSWERS, bot_id=101)
+    second_bot_test = await storage.create_test(CREATOR_ID, ANSWERS, bot_id=202)
+    await storage.save_test_result(legacy_test, 7, "friend", _answers_with_score(2))
+    await storage.save_test_result(first_bot_test, 7, "friend", _answers_with_score(4))
+    await storage.save_test_result(second_bot_test, 7, "friend", _answers_with_score(1))
+    await storage.save_test_result(second_bot_test, 8, "other", _answers_with_score(3))
+
+    # The legacy test's share of the aggregates moves to the bot with it
+    expect(await storage.assign_unowned_tests(101) == 1)
+
+    expect(await storage.get_taker_stats(7, bot_id=101) == {'passes': 2, 'score_sum': 150, 'average_score': 75})
+    expect(await storage.get_taker_stats(7, bot_id=202) == {'passes': 1, 'score_sum': 25, 'average_score': 25})
+    expect(await storage.get_taker_stats(8, bot_id=101) is None)
+    expect((await storage.get_taker_stats(7))['passes'] == 3)
+
+    page = await storage.get_taken_tests_page(7, bot_id=202)
+    expect([result['test_id'] for result in page['results']] == [second_bot_test], page)
+    page = await storage.get_taken_tests_page(7, bot_id=101)
+    expect({result['test_id'] for result in page['results']} == {legacy_test, first_bot_test}, page)
+    expect((await storage.get_taken_tests_page(7, bot_id=303))['results'] == [])
+    expect(len((await storage.get_taken_tests_page(7))['results']) == 3)
+
+    top = await storage.get_top_friends(10, bot_id=202)
+    expect(top == [
+        {'username': "other", 'average_score': 75, 'passes_count': 1},
+        {'username': "friend", 'average_score': 25, 'passes_count': 1}
+    ], top)
+    top = await storage.get_top_friends(10, bot_id=101)
+    expect(top == [{'username': "friend", 'average_score': 75, 'passes_count': 2}], top)
+    expect(await storage.get_top_friends(10, bot_id=303) == [])
+
+    first_bot_stats = await storage.get_question_statistics(bot_id=101)
+    expect(first_bot_stats["1"]['creator'] == {0: 2}, first_bot_stats["1"])
+    expect(first_bot_stats["4"]['miss'] == {4: 1}, first_bot_stats["4"])
+    second_bot_stats = await storage.get_question_statistics(bot_id=202)
+    expect(second_bot_stats["1"]['creator'] == {0: 1}, second_bot_stats["1"])
+    expect(second_bot_stats["4"]['miss'] == {4: 2}, second_bot_stats["4"])
+    expect(await storage.get_question_statistics(bot_id=303) == {})
+    expect((await storage.get_question_statistics())["4"]['miss'] == {4: 3})
+
+
+@check()
+async def check_scoring_and_rank(storage):
+    test_id = await _create_test(storage)
+
+    result = await storage.save_test_result(test_id, 2, "first", _answers_with_score(3))
+    expect(result['percentage'] == 75, result)
+    expect(result['status'] is not None)
+    expect(result['creator']['user_id'] == CREATOR_ID)
+    expect(result['rank'] == {'place': 1, 'total': 1, 'beaten_percentage': None}, result['rank'])
+
+    await storage.save_test_result(test_id, 3, "second", _answers_with_score(1))
+    result = await storage.save_test_result(test_id, 4, "third", _answers_with_score(2))
+    expect(result['percentage'] == 50)
+    expect(result['rank'] == {'place': 2, 'total': 3, 'beaten_percentage': 50}, result['rank'])
+
+    expect(await storage.get_score_rank(test_id, 100) == {'place': 1, 'total': 3, 'beaten_percentage': 100})
+
+
+@check()
+async def check_test_statistics(storage):
+    first_test = await _create_test(storage)
+    second_test = await storage.create_test(CREATOR_ID, ANSWERS)
+    empty_test = await storage.create_test(CREATOR_ID, ANSWERS)
+
+    await storage.save_test_result(first_test, 2, "alice", _answers_with_score(4))
+    await storage.save_test_result(first_test, 3, "bob", _answers_with_score(1))
+    await storage.save_test_result(second_test, 3, "bob", _answers_with_score(2))
+
+    stats = await storage.get_test_statistics(CREATOR_ID)
+    expect(stats['tests_count'] == 3)
+    expect(stats['total_passes'] == 3)
+    expect(stats['average_score'] == round((100 + 25 + 50) / 3))
+    expect([friend['username'] for friend in stats['best_friends']] == ["alice", "bob"], stats['best_friends'])
+    expect([friend['username'] for friend in stats['worst_friends']] == ["bob", "bob"], stats['worst_friends'])
+
+    per_test = {test['test_id']: test for test in stats['tests']}
+    expect(per_test[first_test]['passes_count'] == 2)
+    expect(per_test[first_test]['average_score'] == round((100 + 25) / 2))
+    expect(per_test[empty_test]['passes_count'] == 0)
+
+
+@check()
+async def check_test_results_pages(storage):
+    test_id = await _create_test(storage)
+    for taker_id in range(2, 13):
+        await storage.save_test_result(test_id, taker_id, f"friend{taker_id}", _answers_with_score(taker_id % 5))
+
+    seen = []
+    cursor = None
+    while True:
+        page = await storage.get_test_results_page(test_id, cursor, limit=3)
+        expect(len(page['results']) <= 3)
+        seen.extend(page['results'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    keys = [(result['score'], result['result_id']) for result in seen]
+    expect(len(seen) == 11, len(seen))
+    expect(keys == sorted(keys, reverse=True), keys)
+
+
+@check()
+async def check_friend_history_pages(storage):
+    own_tests = [await _create_test(storage) for _ in range(5)]
+    other_test = await _create_test(storage, creator_id=50)
+
+    for test_id in own_tests + [other_test]:
+        await storage.save_test_result(test_id, 7, "friend", _answers_with_score(2))
+
+    seen = []
+    cursor = None
+    while True:
+        page = await storage.get_friend_history_page(CREATOR_ID, 7, cursor, limit=2)
+        seen.extend(page['results'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    expect(sorted(result['test_id'] for result in seen) == sorted(own_tests), seen)
+    keys = [(result['created_at'], result['result_id']) for result in seen]
+    expect(keys == sorted(keys, reverse=True), keys)
+
+
+@check()
+async def check_test_summaries_pages(storage):
+    tests = [await _create_test(storage) for _ in range(5)]
+    other_test = await _create_test(storage, creator_id=50)
+    await storage.save_test_result(tests[0], 2, "friend", _answers_with_score(2))
+    await storage.save_test_result(tests[0], 3, "other", ANSWERS)
+
+    seen = []
+    cursor = None
+    while True:
+        page = await storage.get_test_summaries_page(CREATOR_ID, cursor, limit=2)
+        expect(len(page['tests']) <= 2)
+        seen.extend(page['tests'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    expect(sorted(test['test_id'] for test in seen) == sorted(tests), seen)
+    expect(other_test not in {test['test_id'] for test in seen})
+    keys = [(test['created_at'], test['test_id']) for test in seen]
+    expect(keys == sorted(keys, reverse=True), keys)
+
+    stats = await storage.get_test_statistics(CREATOR_ID)
+    expect(seen == stats['tests'], (seen, stats['tests']))
+    per_test = {test['test_id']: test for test in seen}
+    expect(per_test[tests[0]]['passes_count'] == 2)
+    expect(per_test[tests[0]]['average_score'] == 75)
+    expect(stats['best_friends'] == [{'username': "other", 'score': 100, 'test_id': tests[0]}], stats)
+    expect(stats['worst_friends'] == [{'username': "friend", 'score': 50, 'test_id': tests[0]}], stats)
+
+
+@check()
+async def check_taken_tests_pages(storage):
+    tests = [await _create_test(storage, creator_id=creator_id) for creator_id in range(20, 25)]
+    other_test = await _create_test(storage)
+    for test_id in tests:
+        await storage.save_test_result(test_id, 7, "friend", _answers_with_score(2))
+    await storage.save_test_result(other_test, 8, "stranger", ANSWERS)
+
+    seen = []
+    cursor = None
+    while True:
+        page = await storage.get_taken_tests_page(7, cursor, limit=2)
+        expect(len(page['results']) <= 2)
+        seen.extend(page['results'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    expect(sorted(result['test_id'] for result in seen) == sorted(tests), seen)
+    keys = [(result['created_at'], result['result_id']) for result in seen]
+    expect(keys == sorted(keys, reverse=True), keys)
+    expect({result['creator_id'] for result in seen} == set(range(20, 25)), seen)
+    expect({result['creator_username'] for result in seen} == {f"creator{i}" for i in range(20, 25)}, seen)
+
+
+@check()
+async def check_taker_stats(storage):
+    expect(await storage.get_taker_stats(7) is None)
+
+    first_test = await _create_test(storage)
+    second_test = await _create_test(storage, creator_id=50)
+    await storage.save_test_result(first_test, 7, "friend", _answers_with_score(4))
+    await storage.save_test_result(second_test, 7, "friend", _answers_with_score(1))
+    await storage.save_test_result(second_test, 8, "stranger", _answers_with_score(3))
+
+    stats = await storage.get_taker_stats(7)
+    expect(stats == {'passes': 2, 'score_sum': 125, 'average_score': 62}, stats)
+
+    # Rescoring moves the running totals with the scores
+    await storage.update_test_answers(first_test, dict(ANSWERS, **{"4": ANSWERS["4"] + 1}))
+    expect((await storage.get_taker_stats(7))['score_sum'] == 100)
+
+
+@check(retake_policy="keep_best")
+async def check_taker_stats_count_retakes(storage):
+    test_id = await _create_test(storage)
+    await storage.save_test_result(test_id, 7, "friend", _answers_with_score(4))
+    await storage.save_test_result(test_id, 7, "friend", _answers_with_score(2))
+
+    # One kept row, but both attempts count
+    expect(len((await storage.get_taken_tests_page(7))['results']) == 1)
+    expect(await storage.get_taker_stats(7) == {'passes': 2, 'score_sum': 150, 'average_score': 75})
+
+
+@check()
+async def check_top_friends(storage):
+    test_id = await _create_test(storage)
+    await storage.save_test_result(test_id, 2, "alice", _answers_with_score(4))
+    await storage.save_test_result(test_id, 3, "bob", _answers_with_score(1))
+    await storage.save_test_result(test_id, 3, "bob", _answers_with_score(2))
+
+    top = await storage.get_top_friends(10)
+    expect(top == [
+        {'username': "alice", 'average_score': 100, 'passes_count': 1},
+        {'username': "bob", 'average_score': 38, 'passes_count': 2}
+    ], top)
+    expect(len(await storage.get_top_friends(1)) == 1)
+
+
+@check()
+async def check_question_statistics(storage):
+    test_id = await _create_test(storage)
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(3))
+
+    stats = await storage.get_question_statistics()
+    expect(stats["1"]['creator'] == {0: 1}, stats["1"])
+    expect(stats["1"]['taker'] == {0: 1})
+    expect(stats["1"]['miss'] == {})
+    expect(stats["4"]['taker'] == {4: 1})
+    expect(stats["4"]['miss'] == {4: 1})
+
+
+@check()
+async def check_update_test_answers(storage):
+    expect(await storage.update_test_answers("s_0", ANSWERS) is None)
+
+    test_id = await _create_test(storage)
+    await storage.save_test_result(test_id, 2, "alice", _answers_with_score(4))
+    await storage.save_test_result(test_id, 3, "bob", _answers_with_score(1))
+
+    # The creator fixes the last answer to what both friends picked
+    new_answers = dict(ANSWERS, **{"4": ANSWERS["4"] + 1})
+    expect(await storage.update_test_answers(test_id, new_answers) == {'rescored': 2, 'kept': 0})
+    expect((await storage.get_test(test_id))['answers'] == new_answers)
+
+    page = await storage.get_test_results_page(test_id)
+    expect([(result['username'], result['score']) for result in page['results']] == [("alice", 75), ("bob", 50)], page)
+    expect(await storage.get_score_rank(test_id, 75) == {'place': 1, 'total': 2, 'beaten_percentage': 100})
+    expect((await storage.get_test_statistics(CREATOR_ID))['average_score'] == round((75 + 50) / 2))
+
+    stats = await storage.get_question_statistics()
+    expect(stats["4"]['creator'] == {4: 1}, stats["4"])
+    expect(stats["4"]['miss'] == {3: 1}, stats["4"])
+    expect(stats["2"]['miss'] == {2: 1}, stats["2"])
+
+    # Later passes are scored against the new answers
+    result = await storage.save_test_result(test_id, 4, "carol", new_answers)
+    expect(result['percentage'] == 100)
+
+
+@check()
+async def check_update_test_answers_without_questions(storage):
+    await storage.add_user(CREATOR_ID, "creator", "Creator", "")
+    test_id = await storage.create_test(CREATOR_ID, {})
+    expect(await storage.update_test_answers(test_id, {}) == {'rescored': 0, 'kept': 0})
+    expect(await storage.resume_rescores() == 0)
+
+
+@check(retake_policy="keep_best")
+async def check_update_test_answers_keeps_attempts(storage):
+    test_id = await _create_test(storage)
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(4))
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(2))
+
+    new_answers = dict(ANSWERS, **{"4": ANSWERS["4"] + 1})
+    await storage.update_test_answers(test_id, new_answers)
+
+    # Only the kept pass is rescored, the retake policy is not re-applied
+    page = await storage.get_test_results_page(test_id)
+    expect([result['score'] for result in page['results']] == [75], page)
+    expect((await storage.get_score_rank(test_id, 75))['total'] == 1)
+
+
+@check()
+async def check_question_sets(storage):
+    questions = [{'id': "a", 'text': "Question", 'options': ["Yes", "No"]}]
+    expect(await storage.get_question_set("missing") is None)
+
+    await storage.add_question_set("hash", questions, CREATOR_ID)
+    # Storing the same content again keeps the first copy
+    await storage.add_question_set("hash", [], 2)
+    expect(await storage.get_question_set("hash") == questions)
+
+    await storage.add_user(CREATOR_ID, "creator", "Creator", "")
+    test_id = await storage.create_test(CREATOR_ID, {"a": 1}, question_set="hash")
+    expect((await storage.get_test(test_id))['question_set'] == "hash")
+
+    result = await storage.save_test_result(test_id, 2, "friend", {"a": 1})
+    expect(result['percentage'] == 100, result)
+    # Custom sets stay out of the global answer counters
+    expect(await storage.get_question_statistics() == {})
+
+
+@check()
+async def check_bank_versions(storage):
+    old_bank = [{'id': 1, 'text': "Old", 'options': ["A", "B"]}]
+    new_bank = [{'id': 1, 'text': "New", 'options': ["A", "B"]}]
+
+    # A test created before the bank was versioned
+    legacy_test = await _create_test(storage)
+    await storage.add_bank_version("old", old_bank)
+    expect(await storage.pin_unversioned_tests("old") == 1)
+    expect(await storage.pin_unversioned_tests("old") == 0)
+    expect((await storage.get_test(legacy_test))['bank_version'] == "old")
+
+    await storage.add_bank_version("new", new_bank)
+    await storage.add_bank_version("new", new_bank)
+    new_test = await storage.create_test(CREATOR_ID, ANSWERS, bank_version="new")
+    expect((await storage.get_test(new_test))['bank_version'] == "new")
+    expect(sorted(await storage.get_bank_versions()) == ["new", "old"])
+    expect(await storage.get_referenced_bank_versions() == {"old", "new"})
+
+    await storage.delete_bank_versions(["old"])
+    expect(await storage.get_bank_versions() == ["new"])
+    expect(await storage.get_question_set("old") is None)
+    expect(await storage.get_question_set("new") == new_bank)
+
+    # An upload with the same content as a bank version shares its row
+    await storage.add_bank_version("shared", old_bank)
+    await storage.add_question_set("shared", old_bank, CREATOR_ID)
+    await storage.create_test(CREATOR_ID, ANSWERS, question_set="shared")
+    expect("shared" in await storage.get_referenced_bank_versions())
+    await storage.delete_bank_versions(["shared"])
+    expect(await storage.get_question_set("shared") == old_bank)
+
+
+@check(retake_policy="keep_best")
+async def check_keep_best_retakes(storage):
+    test_id = await _create_test(storage)
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(2))
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(4))
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(1))
+
+    page = await storage.get_test_results_page(test_id)
+    expect([result['score'] for result in page['results']] == [100], page)
+    expect((await storage.get_score_rank(test_id, 100))['total'] == 1)
+
+    stats = await storage.get_question_statistics()
+    expect(sum(stats["1"]['taker'].values()) == 1, stats["1"])
+
+
+@check(retake_policy="keep_latest")
+async def check_keep_latest_retakes(storage):
+    test_id = await _create_test(storage)
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(4))
+    await storage.save_test_result(test_id, 2, "friend", _answers_with_score(1))
+
+    page = await storage.get_test_results_page(test_id)
+    expect([result['score'] for result in page['results']] == [25], page)
+    expect((await storage.get_test_statistics(CREATOR_ID))['total_passes'] == 1)
+
+
+def sqlite_factory(directory):
+    """Backend factory creating a fresh SQLite file per check."""
+    def create(retake_policy):
+        fd, path = tempfile.mkstemp(suffix=".db", dir=directory)
+        os.close(fd)
+        return Database(path, retake_policy)
+    return create
+
+
+def sharded_factory(directory, shard_count=3):
+    """Backend factory creating a fresh sharded layout per check."""
+    def create(retake_policy):
+        return ShardedDatabase(tempfile.mkdtemp(dir=directory), shard_count, retake_policy)
+    return create
+
+
+def memory_factory(retake_policy):
+    """Backend factory creating a fresh in-memory backend per check."""
+    return MemoryDatabase(retake_policy)
+
+
+async def run_conformance(factory):
+    """
+    Run all checks against backends produced by a factory.
+
+    Args:
+        factory: Callable taking a retake policy and returning a new backend
+
+    Returns:
+        list: (check name, error text or None) per check
+    """
+    outcomes = []
+    for conformance_check in CHECKS:
+        storage = factory(conformance_check.retake_policy)
+        await storage.connect()
+        try:
+            await conformance_check(storage)
+            outcomes.append((conformance_check.__name__, None))
+        except ConformanceError as e:
+            # The frame that called expect() names the failed expectation
+            frame = traceback.extract_tb(e.__traceback__)[-2]
+            outcomes.append((
+                conformance_check.__name__,
+                f"{type(storage).__name__} failed {conformance_check.__name__} "
+                f"at line {frame.lineno}: {frame.line}\n{e}"
+            ))
+        finally:
+            await storage.close()
+    return outcomes
@@ -2,35 +2,137 @@
 Database operations for the bot using aiosqlite for async operations.
 """
 import aiosqlite
-import random
+import asyncio
+import contextlib
 import json
-from src.consts import DB_NAME, RESULT_RANGES
+from collections import Counter
+from src.consts import (
+    DB_NAME,
+    RESCORE_CHUNK_SIZE,
+    RETAKE_POLICY,
+    RETAKE_POLICIES,
+    RETENTION_MODE,
+    RETENTION_MODES,
+    STATS_PAGE_SIZE
+)
+from src.db.base import (
+    NO_BOT,
+    Storage,
+    answer_counter_rows,
+    bot_key,
+    generate_test_id,
+    get_status,
+    percentage_of,
+    rank_from_histogram,
+    score_answers,
+    test_summary
+)
 
+# Which of two passes of the same test by the same taker is kept
+RETAKE_ORDER = {
+    'keep_best': 'score DESC, created_at DESC, result_id DESC',
+    'keep_latest': 'created_at DESC, result_id DESC'
+}
 
-class Database:
-    """Database class for handling all database operations."""
+
+def _json_path(q_id):
+    """JSON path of a question's answer in a stored answers object."""
+    return f'$."{q_id}"'
+
+
+def _rescore_expression(original_answers):
+    """
+    SQL expression scoring a row's answers column against the creator's.
+
+    Returns:
+        tuple: (SQL, parameters)
+
+    Raises:
+        ValueError: If there are no answers, which would leave an empty sum
+    """
+    if not original_answers:
+        raise ValueError("Cannot score against an empty set of answers")
+    matches = " + ".join("(json_extract(answers, ?) IS ?)" for _ in original_answers)
+    cases = " ".join("WHEN ? THEN ?" for _ in range(len(original_answers) + 1))
+
+    params = []
+    for q_id, option_index in original_answers.items():
+        params += [_json_path(q_id), option_index]
+    # Same rounding as score_answers for every possible number of matches
+    for correct_count in range(len(original_answers) + 1):
+        params += [correct_count, percentage_of(correct_count, len(original_answers))]
+
+    return f"(CASE ({matches}) {cases} END)", params
+
+
+class Database(Storage):
+    """SQLite storage backend built on aiosqlite."""
     
-    def __init__(self):
-        """Initialize database connection."""
+    def __init__(self, db_name=DB_NAME, retake_policy=RETAKE_POLICY, users_db_name=None):
+        """
+        Initialize database connection.
+
+        Args:
+            db_name: Path to the SQLite database file
+            retake_policy: 'keep_all', 'keep_best' or 'keep_latest'
+            users_db_name: Path to a shared file holding the users table; it is
+                attached read-side and no users table is created in db_name
+        """
+        if retake_policy not in RETAKE_POLICIES:
+            raise ValueError(f"Unknown retake policy: {retake_policy}")
+
+        self.db_name = db_name
+        self.retake_policy = retake_policy
+        self.users_db_name = users_db_name
         self.conn = None
+        # test_id -> [lock, number of holders and waiters]
+        self._test_locks = {}
     
     async def connect(self):
         """Connect to the database asynchronously."""
-        self.conn = await aiosqlite.connect(DB_NAME)
+        self.conn = await aiosqlite.connect(self.db_name)
+        # Only takes effect on a new database, existing ones need a full
+        # VACUUM first (see enable_incremental_vacuum)
+        await self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        # Readers such as the export job never block the bot's writer in WAL mode
+        async with self.conn.execute('PRAGMA journal_mode = WAL') as cursor:
+            await cursor.fetchone()
+        # Unqualified "users" resolves to the attached file when main has none
+        if self.users_db_name:
+            await self.conn.execute('ATTACH DATABASE ? AS shared', (self.users_db_name,))
         await self.create_tables()
     
     async def create_tables(self):
         """Create necessary tables if they don't exist."""
-        # Users table
-        await self.conn.execute('''
-        CREATE TABLE IF NOT EXISTS users (
-            user_id INTEGER PRIMARY KEY,
-            username TEXT,
-            first_name TEXT,
-            last_name TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        ''')
+        # Users and question sets, unless they live in an attached shared file
+        if not self.users_db_name:
+            await self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS users (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                first_name TEXT,
+                last_name TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+
+            # Uploaded question sets, stored once per content hash
+            await self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS question_sets (
+                set_hash TEXT PRIMARY KEY,
+                questions TEXT,  -- canonical JSON list of questions
+                user_id INTEGER,  -- first uploader
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
+
+            # Versions of the global bank, their questions live in question_sets
+            await self.conn.execute('''
+            CREATE TABLE IF NOT EXISTS bank_versions (
+                set_hash TEXT PRIMARY KEY,
+                loaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            ''')
         
         # Tests table
         await self.conn.execute('''
@@ -43,7 +145,12 @@ class Database:
         )
         ''')
         
-        # Test results table
+        # Test results table; a new one gets the index of the retake policy
+        # right away, an existing one only changes through apply_retake_policy
+        async with self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'test_results'"
+        ) as cursor:
+            new_results_table = await cursor.fetchone() is None
         await self.conn.execute('''
         CREATE TABLE IF NOT EXISTS test_results (
             result_id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -57,8 +164,178 @@ class Database:
             FOREIGN KEY (taker_id) REFERENCES users (user_id)
         )
         ''')
+
+        # Custom question set of a test, NULL for the global bank
+        await self._add_column_if_missing('tests', 'question_set', 'TEXT')
+        # Version of the global bank a test was created on
+        await self._add_column_if_missing('tests', 'bank_version', 'TEXT')
+        # Bot the test was created with when several bots share the database
+        await self._add_column_if_missing('tests', 'bot_id', 'INTEGER')
+        await self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tests_bank_version
+        ON tests (bank_version)
+        ''')
+
+        # Retake history rolled into the kept row
+        await self._add_column_if_missing('test_results', 'attempts', 'INTEGER NOT NULL DEFAULT 1')
+        if await self._add_column_if_missing('test_results', 'attempts_score_sum', 'INTEGER'):
+            await self.conn.execute('UPDATE test_results SET attempts_score_sum = score')
+
+        # One row per (test, taker) unless every retake is kept
+        if new_results_table and self.retake_policy != 'keep_all':
+            await self.conn.execute('''
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_test_results_test_taker
+            ON test_results (test_id, taker_id)
+            ''')
+
+        # Running totals of every pass per taker and bot for /mystats and
+        # /top; a new table, or one from before the totals were kept per
+        # bot, is backfilled from the stored results once everything exists
+        backfill_taker_stats = await self._create_bot_keyed_table('taker_stats', '''
+            taker_id INTEGER,
+            bot_id INTEGER NOT NULL DEFAULT 0,  -- NO_BOT for tests of no bot
+            taker_username TEXT,  -- name of the latest pass
+            passes INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (taker_id, bot_id)
+        ''')
+        # A bot's /top walks its best averages in index order and stops at the limit
+        await self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_taker_stats_bot_average
+        ON taker_stats (bot_id, score_sum * 1.0 / passes)
+        ''')
+
+        # Answer edits whose rescore has not reached every result yet: the
+        # answers rescored from and the result_id range still to do
+        await self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS rescore_jobs (
+            test_id TEXT PRIMARY KEY,
+            old_answers TEXT NOT NULL,
+            next_result_id INTEGER NOT NULL,
+            last_result_id INTEGER NOT NULL
+        )
+        ''')
+
+        # Aggregates of results removed by the retention job
+        await self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS test_rollups (
+            test_id TEXT PRIMARY KEY,
+            passes INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0
+        )
+        ''')
+        # Rollups from before they were kept per bot stay with NO_BOT
+        await self._create_bot_keyed_table('taker_rollups', '''
+            taker_id INTEGER,
+            bot_id INTEGER NOT NULL DEFAULT 0,
+            taker_username TEXT,
+            passes INTEGER NOT NULL DEFAULT 0,
+            score_sum INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (taker_id, bot_id)
+        ''')
+        await self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS score_histogram_rollups (
+            test_id TEXT,
+            score INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (test_id, score)
+        ) WITHOUT ROWID
+        ''')
+        # Answer counter contributions of results whose answers were dropped
+        await self._create_bot_keyed_table('retired_answer_counters', '''
+            bot_id INTEGER NOT NULL DEFAULT 0,
+            question_id TEXT,
+            option_index INTEGER,
+            role TEXT,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bot_id, question_id, option_index, role)
+        ''')
+
+        # Indexes backing the keyset-paginated statistics; the tests index
+        # replaced idx_tests_user_created to also order the /stats overview pages
+        await self.conn.execute('DROP INDEX IF EXISTS idx_tests_user_created')
+        await self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_tests_user_page
+        ON tests (user_id, created_at, test_id)
+        ''')
+        await self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_test_results_test_score
+        ON test_results (test_id, score, result_id)
+        ''')
+        # Covers a page of /mystats and the friend history without reading rows
+        await self.conn.execute('DROP INDEX IF EXISTS idx_test_results_taker_created')
+        await self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_test_results_taker_page
+        ON test_results (taker_id, created_at, result_id, test_id, score)
+        ''')
+        await self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_test_results_created
+        ON test_results (created_at)
+        ''')
+        # Strip batches only walk rows that still hold answers
+        await self.conn.execute('''
+        CREATE INDEX IF NOT EXISTS idx_test_results_live_created
+        ON test_results (created_at)
+        WHERE answers IS NOT NULL
+        ''')
+        # /top reads taker_stats now
+        await self.conn.execute('DROP INDEX IF EXISTS idx_test_results_username_score')
+
+        # Answer distribution counters per bot, maintained together with every
+        # create_test and save_test_result so /qstats never reads the JSON rows;
+        # counters from before they were kept per bot are rebuilt below
+        backfill_answer_counters = await self._create_bot_keyed_table('answer_counters', '''
+            bot_id INTEGER NOT NULL DEFAULT 0,
+            question_id TEXT,
+            option_index INTEGER,
+            role TEXT,  -- 'creator', 'taker' or 'miss' (a taker's wrong guess)
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (bot_id, question_id, option_index, role)
+        ''')
+
+        # Per-test 0-100 score histogram for instant rank lookups
+        await self.conn.execute('''
+        CREATE TABLE IF NOT EXISTS score_histogram (
+            test_id TEXT,
+            score INTEGER,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (test_id, score)
+        ) WITHOUT ROWID
+        ''')
         
         await self.conn.commit()
+
+        if backfill_taker_stats:
+            await self.rebuild_taker_stats()
+        if backfill_answer_counters:
+            await self.rebuild_answer_counters()
+
+    async def _create_bot_keyed_table(self, table, schema):
+        """
+        Create an aggregate table keyed by bot.
+
+        A table from before the aggregates were kept per bot is recreated
+        with the new schema and its rows are kept under NO_BOT.
+
+        Args:
+            table: Table name
+            schema: Column and key definitions, with a bot_id column
+
+        Returns:
+            bool: True if the table is new or was recreated
+        """
+        columns = await self._table_columns(table)
+        if 'bot_id' in columns:
+            return False
+
+        if columns:
+            await self.conn.execute(f'ALTER TABLE {table} RENAME TO {table}_unkeyed')
+        await self.conn.execute(f'CREATE TABLE {table} ({schema})')
+        if columns:
+            column_list = ", ".join(columns)
+            await self.conn.execute(f'INSERT INTO {table} ({column_list}) SELECT {column_list} FROM {table}_unkeyed')
+            await self.conn.execute(f'DROP TABLE {table}_unkeyed')
+        return True
     
     async def add_user(self, user_id, username, first_name, last_name):
         """Add or update user in the database."""
@@ -68,19 +345,170 @@ class Database:
         ''', (user_id, username, first_name, last_name))
         await self.conn.commit()
     
-    async def create_test(self, user_id, answers):
-        """Create a new test for a user."""
-        # Generate a random test_id
-        test_id = f"s_{random.randint(1000000000, 9999999999)}"
+    async def add_question_set(self, set_hash, questions, user_id):
+        """
+        Store a question set under its content hash.
+
+        Args:
+            set_hash: Content hash of the set
+            questions: Validated list of questions
+            user_id: ID of the uploader
+        """
+        await self.conn.execute('''
+        INSERT OR IGNORE INTO question_sets (set_hash, questions, user_id)
+        VALUES (?, ?, ?)
+        ''', (set_hash, json.dumps(questions, ensure_ascii=False), user_id))
+        await self.conn.commit()
+
+    async def get_question_set(self, set_hash):
+        """Get the questions of a stored set, or None."""
+        async with self.conn.execute(
+            'SELECT questions FROM question_sets WHERE set_hash = ?', (set_hash,)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def add_bank_version(self, set_hash, questions):
+        """
+        Store a version of the global question bank.
+
+        Args:
+            set_hash: Content hash of the bank
+            questions: Validated list of questions
+        """
+        await self.conn.execute('''
+        INSERT OR IGNORE INTO question_sets (set_hash, questions)
+        VALUES (?, ?)
+        ''', (set_hash, json.dumps(questions, ensure_ascii=False)))
+        await self.conn.execute(
+            'INSERT OR IGNORE INTO bank_versions (set_hash) VALUES (?)', (set_hash,)
+        )
+        await self.conn.commit()
+
+    async def get_bank_versions(self):
+        """Get the content hashes of all stored bank versions."""
+        async with self.conn.execute('SELECT set_hash FROM bank_versions ORDER BY loaded_at') as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+    async def get_referenced_bank_versions(self):
+        """Get the content hashes stored tests use, as a bank version or an uploaded set."""
+        async with self.conn.execute('''
+        SELECT bank_version FROM tests WHERE bank_version IS NOT NULL
+        UNION
+        SELECT question_set FROM tests WHERE question_set IS NOT NULL
+        ''') as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+    async def get_uploaded_question_sets(self):
+        """Get the content hashes stored tests use as uploaded sets."""
+        async with self.conn.execute(
+            'SELECT DISTINCT question_set FROM tests WHERE question_set IS NOT NULL'
+        ) as cursor:
+            return {row[0] for row in await cursor.fetchall()}
+
+    async def pin_unversioned_tests(self, set_hash):
+        """
+        Pin tests on the global bank created before versioning.
+
+        Args:
+            set_hash: Bank version to pin them to
+
+        Returns:
+            int: Number of tests pinned
+        """
+        cursor = await self.conn.execute('''
+        UPDATE tests SET bank_version = ?
+        WHERE bank_version IS NULL AND question_set IS NULL
+        ''', (set_hash,))
+        await self.conn.commit()
+        return cursor.rowcount
+
+    async def assign_unowned_tests(self, bot_id):
+        """
+        Assign tests created before multi-bot hosting to a bot.
+
+        Their share of the per-bot aggregates, kept under NO_BOT, is added
+        to the bot's in the same transaction.
+
+        Args:
+            bot_id: Bot that served them
+
+        Returns:
+            int: Number of tests assigned
+        """
+        cursor = await self.conn.execute('UPDATE tests SET bot_id = ? WHERE bot_id IS NULL', (bot_id,))
+        assigned = cursor.rowcount
+
+        # table -> (key columns besides bot_id, summed columns)
+        aggregates = {
+            'answer_counters': (('question_id', 'option_index', 'role'), ('count',)),
+            'retired_answer_counters': (('question_id', 'option_index', 'role'), ('count',)),
+            'taker_stats': (('taker_id',), ('passes', 'score_sum')),
+            'taker_rollups': (('taker_id',), ('passes', 'score_sum')),
+        }
+        for table, (keys, sums) in aggregates.items():
+            names = ('taker_username',) if table.startswith('taker_') else ()
+            columns = ", ".join(keys + names + sums)
+            updates = ", ".join(
+                [f'{name} = COALESCE({name}, excluded.{name})' for name in names]
+                + [f'{column} = {column} + excluded.{column}' for column in sums]
+            )
+            await self.conn.execute(f'''
+            INSERT INTO {table} (bot_id, {columns})
+            SELECT ?, {columns} FROM {table} WHERE bot_id = ?
+            ON CONFLICT (bot_id, {", ".join(keys)}) DO UPDATE SET {updates}
+            ''', (bot_id, NO_BOT))
+            await self.conn.execute(f'DELETE FROM {table} WHERE bot_id = ?', (NO_BOT,))
+
+        await self.conn.commit()
+        return assigned
+
+    async def delete_bank_versions(self, set_hashes, uploaded_elsewhere=()):
+        """
+        Delete bank versions and their questions.
+
+        Questions a test uses as its uploaded set are kept.
+
+        Args:
+            set_hashes: Content hashes of unreferenced versions
+            uploaded_elsewhere: Hashes tests in other files use as uploads,
+                e.g. the shards when this is the sharded users file
+        """
+        rows = [(set_hash,) for set_hash in set_hashes]
+        await self.conn.executemany('DELETE FROM bank_versions WHERE set_hash = ?', rows)
+        await self.conn.executemany('''
+        DELETE FROM question_sets
+        WHERE set_hash = ?1 AND NOT EXISTS (SELECT 1 FROM tests WHERE question_set = ?1)
+        ''', [row for row in rows if row[0] not in uploaded_elsewhere])
+        await self.conn.commit()
+
+    async def create_test(self, user_id, answers, question_set=None, bank_version=None, bot_id=None, test_id=None):
+        """
+        Create a new test for a user.
+
+        Args:
+            user_id: ID of the creator
+            answers: The creator's answers (question_id -> option index)
+            question_set: Hash of a custom question set, None for the global bank
+            bank_version: Hash of the global bank version the test was created on
+            bot_id: ID of the bot the test was created with
+            test_id: Preassigned ID, e.g. when a sharded layout routes by it
+
+        Returns:
+            str: ID of the new test
+        """
+        test_id = test_id or generate_test_id()
         
         # Store answers as JSON string
         answers_json = json.dumps(answers)
         
         # Insert into database
         await self.conn.execute('''
-        INSERT INTO tests (test_id, user_id, answers)
-        VALUES (?, ?, ?)
-        ''', (test_id, user_id, answers_json))
+        INSERT INTO tests (test_id, user_id, answers, question_set, bank_version, bot_id)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (test_id, user_id, answers_json, question_set, bank_version, bot_id))
+        if question_set is None:
+            await self._increment_answer_counters(answer_counter_rows(answers), bot_id)
         await self.conn.commit()
         
         return test_id
@@ -88,7 +516,7 @@ class Database:
     async def get_test(self, test_id):
         """Get test details by test_id."""
         async with self.conn.execute('''
-        SELECT t.user_id, t.answers, u.username, u.first_name, u.last_name
+        SELECT t.user_id, t.answers, t.question_set, t.bank_version, t.bot_id, u.username, u.first_name, u.last_name
         FROM tests t
         JOIN users u ON t.user_id = u.user_id
         WHERE t.test_id = ?
@@ -98,91 +526,515 @@ class Database:
             if not result:
                 return None
             
-            user_id, answers_json, username, first_name, last_name = result
+            user_id, answers_json, question_set, bank_version, bot_id, username, first_name, last_name = result
             answers = json.loads(answers_json)
             
             return {
                 'user_id': user_id,
                 'answers': answers,
+                'question_set': question_set,
+                'bank_version': bank_version,
+                'bot_id': bot_id,
                 'username': username,
                 'first_name': first_name,
                 'last_name': last_name
             }
     
+    @contextlib.asynccontextmanager
+    async def _test_lock(self, test_id):
+        """
+        Serialize passes and answer edits of one test.
+
+        An edit adjusts the counters of the results it rescores, so no pass
+        may be scored against the old answers while it runs.
+        """
+        entry = self._test_locks.setdefault(test_id, [asyncio.Lock(), 0])
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._test_locks[test_id]
+
     async def save_test_result(self, test_id, taker_id, taker_username, answers):
         """Save the results of a test taken by a user."""
+        async with self._test_lock(test_id):
+            return await self._save_test_result(test_id, taker_id, taker_username, answers)
+
+    async def _save_test_result(self, test_id, taker_id, taker_username, answers):
+        """Save a pass while holding the test's lock."""
         # Get original test answers
         test_info = await self.get_test(test_id)
         if not test_info:
             return None
         
         original_answers = test_info['answers']
+        # Custom sets have their own question IDs and stay out of /qstats
+        count_answers = test_info['question_set'] is None
         
-        # Calculate score
-        correct_count = 0
-        for q_id, original_answer_index in original_answers.items():
-            taker_answer_index = answers.get(q_id)
-            if taker_answer_index == original_answer_index:
-                correct_count += 1
-        
-        total_questions = len(original_answers)
-        percentage = round((correct_count / total_questions) * 100)
-        
-        # Determine status based on percentage
-        status = None
-        for (min_val, max_val), status_text in RESULT_RANGES.items():
-            if min_val <= percentage <= max_val:
-                status = status_text
-                break
+        percentage = score_answers(original_answers, answers)
+        status = get_status(percentage)
         
         # Store answers as JSON string
         answers_json = json.dumps(answers)
         
-        # Save result to database
-        await self.conn.execute('''
-        INSERT INTO test_results (test_id, taker_id, taker_username, score, answers)
-        VALUES (?, ?, ?, ?, ?)
-        ''', (test_id, taker_id, taker_username, percentage, answers_json))
+        if self.retake_policy == 'keep_all':
+            # Save result to database
+            await self.conn.execute('''
+            INSERT INTO test_results (test_id, taker_id, taker_username, score, answers, attempts_score_sum)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ''', (test_id, taker_id, taker_username, percentage, answers_json, percentage))
+            if count_answers:
+                await self._increment_answer_counters(
+                    answer_counter_rows(original_answers, answers), test_info['bot_id']
+                )
+            await self._increment_score_histogram(test_id, percentage, 1)
+        else:
+            await self._upsert_test_result(
+                test_id, taker_id, taker_username, percentage, answers, original_answers, count_answers,
+                test_info['bot_id']
+            )
+        # Every attempt counts, whichever row the retake policy keeps
+        await self._increment_taker_stats(
+            [(taker_id, bot_key(test_info['bot_id']), taker_username, 1, percentage)]
+        )
         await self.conn.commit()
+
+        rank = await self.get_score_rank(test_id, percentage)
         
         return {
             'percentage': percentage,
             'status': status,
+            'rank': rank,
             'creator': test_info
         }
     
-    async def get_user_tests(self, user_id):
-        """Get all tests created by a user."""
+    async def _upsert_test_result(self, test_id, taker_id, taker_username, score, answers, original_answers,
+                                  count_answers=True, bot_id=None):
+        """
+        Store a pass under the keep_best or keep_latest retake policy.
+
+        The unique (test_id, taker_id) index keeps a single row per taker;
+        retakes only bump its attempts counters unless the new pass wins.
+        Runs inside the caller's transaction; the caller commits.
+
+        Args:
+            test_id: ID of the test
+            taker_id: ID of the taker
+            taker_username: Display name of the taker
+            score: Score of the new pass
+            answers: Answers of the new pass
+            original_answers: The creator's answers
+            count_answers: Whether the test feeds the answer counters
+            bot_id: Bot of the test
+        """
+        async with self.conn.execute('''
+        SELECT score, answers
+        FROM test_results
+        WHERE test_id = ? AND taker_id = ?
+        ''', (test_id, taker_id)) as cursor:
+            previous = await cursor.fetchone()
+
+        replace = (
+            previous is None
+            or self.retake_policy == 'keep_latest'
+            or score > previous[0]
+        )
+
+        await self.conn.execute('''
+        INSERT INTO test_results (test_id, taker_id, taker_username, score, answers, attempts_score_sum)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (test_id, taker_id) DO UPDATE SET
+            taker_username = excluded.taker_username,
+            attempts = attempts + 1,
+            attempts_score_sum = attempts_score_sum + excluded.score,
+            score = CASE WHEN ? THEN excluded.score ELSE score END,
+            answers = CASE WHEN ? THEN excluded.answers ELSE answers END,
+            created_at = CASE WHEN ? THEN CURRENT_TIMESTAMP ELSE created_at END
+        ''', (test_id, taker_id, taker_username, score, json.dumps(answers), score, replace, replace, replace))
+
+        if not replace:
+            return
+
+        # Derived counters follow the row that is kept
+        if previous is not None:
+            # Dropped answers already live in retired_answer_counters
+            if count_answers and previous[1] is not None:
+                previous_answers = json.loads(previous[1])
+                await self._increment_answer_counters([
+                    (q_id, option_index, role, -delta)
+                    for q_id, option_index, role, delta in answer_counter_rows(original_answers, previous_answers)
+                ], bot_id)
+            await self._increment_score_histogram(test_id, previous[0], -1)
+
+        if count_answers:
+            await self._increment_answer_counters(answer_counter_rows(original_answers, answers), bot_id)
+        await self._increment_score_histogram(test_id, score, 1)
+
+    async def update_test_answers(self, test_id, answers, chunk_size=RESCORE_CHUNK_SIZE):
+        """
+        Replace the creator's answers and rescore every stored result.
+
+        Results are rescored in SQL, one result_id range per transaction: the
+        matching answers of a row are counted with json_extract and mapped to
+        a score through a lookup of every possible count, so no row is
+        decoded in Python. Score histograms, attempt score sums, taker totals
+        and answer counters are adjusted together with each chunk. Results
+        whose answers were dropped by the retention job keep their score.
+
+        The edit is recorded in rescore_jobs together with the new answers
+        and every chunk advances it in the same transaction, so a rescore
+        cut short by a restart is finished by resume_rescores.
+
+        Args:
+            test_id: ID of the test
+            answers: The creator's new answers to the same questions
+            chunk_size: Number of results rescored per transaction
+
+        Returns:
+            dict: Number of rescored and kept results, or None if the test does not exist
+
+        Raises:
+            ValueError: If the answers are not for the test's questions
+        """
+        async with self._test_lock(test_id):
+            # An earlier edit cut short is finished against its own answers first
+            await self._run_rescore(test_id, chunk_size)
+
+            async with self.conn.execute(
+                'SELECT answers, question_set, bot_id FROM tests WHERE test_id = ?', (test_id,)
+            ) as cursor:
+                row = await cursor.fetchone()
+            if not row:
+                return None
+
+            old_answers = json.loads(row[0])
+            if answers.keys() != old_answers.keys():
+                raise ValueError("Edited answers must cover the same questions")
+            if not answers:
+                # Without questions every score stays as it is
+                async with self.conn.execute(
+                    'SELECT COUNT(*) FROM test_results WHERE test_id = ?', (test_id,)
+                ) as cursor:
+                    return {'rescored': 0, 'kept': (await cursor.fetchone())[0]}
+
+            await self.conn.execute(
+                'UPDATE tests SET answers = ? WHERE test_id = ?', (json.dumps(answers), test_id)
+            )
+            # Custom sets have their own question IDs and stay out of /qstats
+            if row[1] is None:
+                await self._increment_answer_counters(
+                    [(q_id, option_index, role, -delta)
+                     for q_id, option_index, role, delta in answer_counter_rows(old_answers)]
+                    + answer_counter_rows(answers),
+                    row[2]
+                )
+            # Results saved from now on are scored against the new answers
+            await self.conn.execute('''
+            INSERT INTO rescore_jobs (test_id, old_answers, next_result_id, last_result_id)
+            SELECT ?, ?, 0, COALESCE(MAX(result_id), 0) FROM test_results WHERE test_id = ?
+            ''', (test_id, row[0], test_id))
+            await self.conn.commit()
+
+            return await self._run_rescore(test_id, chunk_size)
+
+    async def resume_rescores(self, chunk_size=RESCORE_CHUNK_SIZE):
+        """
+        Finish the rescores of answer edits a previous run was cut short in.
+
+        Args:
+            chunk_size: Number of results rescored per transaction
+
+        Returns:
+            int: Number of tests whose rescore was finished
+        """
+        async with self.conn.execute('SELECT test_id FROM rescore_jobs') as cursor:
+            test_ids = [row[0] for row in await cursor.fetchall()]
+
+        for test_id in test_ids:
+            async with self._test_lock(test_id):
+                await self._run_rescore(test_id, chunk_size)
+        return len(test_ids)
+
+    async def _run_rescore(self, test_id, chunk_size):
+        """
+        Rescore the results a recorded answer edit has not reached yet.
+
+        Runs under the test's lock.
+
+        Returns:
+            dict: Number of rescored and kept results
+        """
+        async with self.conn.execute('''
+        SELECT j.old_answers, j.next_result_id, j.last_result_id, t.answers, t.question_set, t.bot_id
+        FROM rescore_jobs j
+        JOIN tests t ON t.test_id = j.test_id
+        WHERE j.test_id = ?
+        ''', (test_id,)) as cursor:
+            job = await cursor.fetchone()
+        if job is None:
+            return {'rescored': 0, 'kept': 0}
+
+        old_answers, next_result_id, last_result_id = json.loads(job[0]), job[1], job[2]
+        answers = json.loads(job[3])
+        count_answers = job[4] is None
+        bot_id = job[5]
+
+        async with self.conn.execute('''
+        SELECT result_id FROM test_results
+        WHERE test_id = ? AND result_id BETWEEN ? AND ?
+        ORDER BY result_id
+        ''', (test_id, next_result_id, last_result_id)) as cursor:
+            result_ids = [row[0] for row in await cursor.fetchall()]
+
+        score_sql, score_params = _rescore_expression(answers)
+
+        # Chunk queries filter on +test_id so the planner walks the
+        # result_id range instead of the test's whole index entry
+        rescored = 0
+        for start in range(0, len(result_ids), chunk_size):
+            chunk = (test_id, result_ids[start], result_ids[min(start + chunk_size, len(result_ids)) - 1])
+
+            if count_answers:
+                await self._increment_answer_counters(
+                    await self._miss_counter_deltas(chunk, old_answers, answers), bot_id
+                )
+
+            # Old and new score of every rescorable row, before the UPDATE
+            async with self.conn.execute(f'''
+            SELECT taker_id, score, {score_sql}
+            FROM test_results
+            WHERE +test_id = ? AND result_id BETWEEN ? AND ? AND answers IS NOT NULL
+            ''', score_params + list(chunk)) as cursor:
+                scores = await cursor.fetchall()
+
+            cursor = await self.conn.execute(f'''
+            UPDATE test_results
+            SET score = {score_sql},
+                attempts_score_sum = attempts_score_sum - score + {score_sql}
+            WHERE +test_id = ? AND result_id BETWEEN ? AND ? AND answers IS NOT NULL
+            ''', score_params + score_params + list(chunk))
+            rescored += cursor.rowcount
+
+            histogram_deltas = Counter()
+            taker_deltas = Counter()
+            for taker_id, old_score, new_score in scores:
+                if old_score != new_score:
+                    histogram_deltas[old_score] -= 1
+                    histogram_deltas[new_score] += 1
+                    taker_deltas[taker_id] += new_score - old_score
+            for score, delta in histogram_deltas.items():
+                if delta:
+                    await self._increment_score_histogram(test_id, score, delta)
+            await self._increment_taker_stats(
+                [(taker_id, bot_key(bot_id), None, 0, delta) for taker_id, delta in taker_deltas.items() if delta]
+            )
+
+            # The chunk and the progress past it commit together
+            await self.conn.execute(
+                'UPDATE rescore_jobs SET next_result_id = ? WHERE test_id = ?', (chunk[2] + 1, test_id)
+            )
+            await self.conn.commit()
+
+        await self.conn.execute('DELETE FROM rescore_jobs WHERE test_id = ?', (test_id,))
+        await self.conn.commit()
+
+        return {'rescored': rescored, 'kept': len(result_ids) - rescored}
+
+    async def _miss_counter_deltas(self, chunk, old_answers, answers):
+        """
+        Answer counter changes of a chunk's wrong guesses after an edit.
+
+        When the creator's answer to a question moves from option a to b,
+        guesses of a become misses and guesses of b stop being ones; every
+        other guess stays a miss. Both counts of every changed question are
+        taken in one pass over the chunk.
+
+        Returns:
+            list: (question_id, option_index, 'miss', delta) tuples
+        """
+        changed = [q_id for q_id in answers if answers[q_id] != old_answers[q_id]]
+        if not changed:
+            return []
+
+        columns = []
+        params = []
+        for q_id in changed:
+            columns.append("SUM(json_extract(answers, ?) IS ?), SUM(json_extract(answers, ?) IS ?)")
+            params += [_json_path(q_id), old_answers[q_id], _json_path(q_id), answers[q_id]]
+
+        async with self.conn.execute(f'''
+        SELECT {", ".join(columns)}
+        FROM test_results
+        WHERE +test_id = ? AND result_id BETWEEN ? AND ? AND answers IS NOT NULL
+        ''', params + list(chunk)) as cursor:
+            counts = await cursor.fetchone()
+
+        rows = []
+        for index, q_id in enumerate(changed):
+            old_guesses, new_guesses = counts[2 * index], counts[2 * index + 1]
+            if old_guesses:
+                rows.append((q_id, old_answers[q_id], 'miss', old_guesses))
+            if new_guesses:
+                rows.append((q_id, answers[q_id], 'miss', -new_guesses))
+        return rows
+
+    async def _has_retake_index(self):
+        """Whether the unique (test_id, taker_id) index exists."""
+        async with self.conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_test_results_test_taker'"
+        ) as cursor:
+            return await cursor.fetchone() is not None
+
+    async def check_retake_policy(self):
+        """
+        Make sure the schema matches the configured retake policy.
+
+        keep_best and keep_latest upsert on the unique (test_id, taker_id)
+        index, keep_all inserts retakes as new rows and must not have it.
+        Opening a database never changes the index; apply_retake_policy does.
+
+        Raises:
+            RuntimeError: The index does not match the policy
+        """
+        if await self._has_retake_index() != (self.retake_policy != 'keep_all'):
+            raise RuntimeError(
+                f"{self.db_name} is not migrated to the {self.retake_policy} retake policy; "
+                f"run 'python -m src.cli retake-policy' with RETAKE_POLICY={self.retake_policy}"
+            )
+
+    async def apply_retake_policy(self):
+        """
+        Migrate the unique (test_id, taker_id) index to the configured retake policy.
+
+        Raises:
+            RuntimeError: Repeated passes must be collapsed with dedup_test_results first
+        """
+        if self.retake_policy == 'keep_all':
+            await self.conn.execute('DROP INDEX IF EXISTS idx_test_results_test_taker')
+        else:
+            try:
+                await self.conn.execute('''
+                CREATE UNIQUE INDEX IF NOT EXISTS idx_test_results_test_taker
+                ON test_results (test_id, taker_id)
+                ''')
+            except aiosqlite.IntegrityError as e:
+                raise RuntimeError(
+                    "test_results has repeated passes of the same test; "
+                    "run 'python -m src.cli dedup-results' before switching "
+                    f"the retake policy to {self.retake_policy}"
+                ) from e
+        await self.conn.commit()
+
+    async def dedup_test_results(self, retake_policy=None):
+        """
+        Collapse repeated passes of a test by the same taker into one row.
+
+        The kept row is chosen by the retake policy and carries the number
+        and score sum of all collapsed attempts. Derived counters are rebuilt
+        and the unique (test_id, taker_id) index is created afterwards.
+
+        Args:
+            retake_policy: 'keep_best' or 'keep_latest'; defaults to the configured one
+
+        Returns:
+            int: Number of rows removed
+        """
+        retake_policy = retake_policy or self.retake_policy
+        if retake_policy not in RETAKE_ORDER:
+            raise ValueError(f"Retake policy {retake_policy} does not collapse passes")
+
+        await self.conn.execute('DROP TABLE IF EXISTS temp.retake_groups')
+        await self.conn.execute(f'''
+        CREATE TEMP TABLE retake_groups AS
+        SELECT
+            g.test_id,
+            g.taker_id,
+            SUM(g.attempts) AS attempts,
+            SUM(g.attempts_score_sum) AS attempts_score_sum,
+            (
+                SELECT r.result_id
+                FROM test_results r
+                WHERE r.test_id = g.test_id AND r.taker_id = g.taker_id
+                ORDER BY {RETAKE_ORDER[retake_policy]}
+                LIMIT 1
+            ) AS keep_id
+        FROM test_results g
+        GROUP BY g.test_id, g.taker_id
+        HAVING COUNT(*) > 1
+        ''')
+
+        await self.conn.execute('''
+        UPDATE test_results
+        SET attempts = (SELECT attempts FROM retake_groups WHERE keep_id = result_id),
+            attempts_score_sum = (SELECT attempts_score_sum FROM retake_groups WHERE keep_id = result_id)
+        WHERE result_id IN (SELECT keep_id FROM retake_groups)
+        ''')
+        cursor = await self.conn.execute('''
+        DELETE FROM test_results
+        WHERE (test_id, taker_id) IN (SELECT test_id, taker_id FROM retake_groups)
+          AND result_id NOT IN (SELECT keep_id FROM retake_groups)
+        ''')
+        removed = cursor.rowcount
+
+        await self.conn.execute('DROP TABLE temp.retake_groups')
+        await self.conn.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_test_results_test_taker
+        ON test_results (test_id, taker_id)
+        ''')
+        await self.conn.commit()
+
+        # Removed rows no longer count towards the distributions and ranks
+        await self.rebuild_answer_counters()
+        await self.rebuild_score_histograms()
+
+        return removed
+
+    async def get_user_tests(self, user_id, bot_id=None):
+        """Get all tests created by a user, with one bot only if bot_id is given."""
         async with self.conn.execute('''
         SELECT test_id, created_at
         FROM tests
-        WHERE user_id = ?
+        WHERE user_id = ? AND (? IS NULL OR bot_id = ?)
         ORDER BY created_at DESC
-        ''', (user_id,)) as cursor:
+        ''', (user_id, bot_id, bot_id)) as cursor:
             return await cursor.fetchall()
     
-    async def get_test_statistics(self, user_id):
+    async def get_test_statistics(self, user_id, bot_id=None):
         """
         Get statistics for all tests created by a user.
-        
+
+        Only aggregates are computed here; individual passes are browsed
+        page by page with get_test_results_page and get_friend_history_page.
+
         Args:
             user_id: ID of the user
-            
+            bot_id: Only count tests of this bot, all bots if None
+
         Returns:
             dict: A dictionary with test statistics
         """
-        # Get all tests created by the user
+        # Aggregate passes per test in a single query
         async with self.conn.execute('''
-        SELECT test_id
-        FROM tests
-        WHERE user_id = ?
-        ORDER BY created_at DESC
-        ''', (user_id,)) as cursor:
+        SELECT
+            t.test_id,
+            t.created_at,
+            COUNT(tr.result_id) + COALESCE(MAX(ro.passes), 0),
+            COALESCE(SUM(tr.score), 0) + COALESCE(MAX(ro.score_sum), 0)
+        FROM tests t
+        LEFT JOIN test_results tr ON tr.test_id = t.test_id
+        LEFT JOIN test_rollups ro ON ro.test_id = t.test_id
+        WHERE t.user_id = ? AND (? IS NULL OR t.bot_id = ?)
+        GROUP BY t.test_id
+        ORDER BY t.created_at DESC, t.test_id DESC
+        ''', (user_id, bot_id, bot_id)) as cursor:
             tests = await cursor.fetchall()
-        
+
         if not tests:
             return None
-        
+
         # Initialize statistics
         stats = {
             'tests_count': len(tests),
@@ -190,93 +1042,346 @@ class Database:
             'average_score': 0,
             'best_friends': [],
             'worst_friends': [],
-            'detailed_tests': []
+            'tests': []
         }
-        
-        # Collect statistics for each test
-        for test_row in tests:
-            test_id = test_row[0]
-            
-            # Get test results
-            async with self.conn.execute('''
-            SELECT tr.taker_username, tr.score, tr.created_at
-            FROM test_results tr
-            WHERE tr.test_id = ?
-            ORDER BY tr.score DESC
-            ''', (test_id,)) as cursor:
-                results = await cursor.fetchall()
-            
-            test_stats = {
-                'test_id': test_id,
-                'passes_count': len(results),
-                'average_score': 0,
-                'friends': []
-            }
-            
-            if results:
-                # Calculate average score for this test
-                total_score = sum(result[1] for result in results)
-                test_stats['average_score'] = round(total_score / len(results))
-                
-                # Add to global statistics
-                stats['total_passes'] += len(results)
-                
-                # Add friends to test statistics
-                for result in results:
-                    username, score, created_at = result
-                    test_stats['friends'].append({
-                        'username': username,
-                        'score': score,
-                        'created_at': created_at
-                    })
-                
-                # Add best and worst friends to global statistics
-                if results and len(results) > 0:
-                    best_friend = results[0]  # Already sorted by score DESC
-                    stats['best_friends'].append({
-                        'username': best_friend[0],
-                        'score': best_friend[1],
-                        'test_id': test_id
-                    })
-                    
-                    worst_friend = results[-1]  # Last result with lowest score
-                    stats['worst_friends'].append({
-                        'username': worst_friend[0],
-                        'score': worst_friend[1],
-                        'test_id': test_id
-                    })
-            
-            stats['detailed_tests'].append(test_stats)
-        
+
+        total_score = 0
+        for test_id, created_at, passes_count, score_sum in tests:
+            stats['tests'].append(test_summary(test_id, created_at, passes_count, score_sum))
+            stats['total_passes'] += passes_count
+            total_score += score_sum
+
+        # Best and worst pass of every test in one query, each found with a
+        # seek on the score index; tests whose passes were all rolled up have neither
+        async with self.conn.execute('''
+        SELECT ends.test_id, best.taker_username, best.score, worst.taker_username, worst.score
+        FROM (
+            SELECT
+                t.test_id,
+                (
+                    SELECT result_id FROM test_results
+                    WHERE test_id = t.test_id
+                    ORDER BY score DESC, result_id DESC
+                    LIMIT 1
+                ) AS best_id,
+                (
+                    SELECT result_id FROM test_results
+                    WHERE test_id = t.test_id
+                    ORDER BY score ASC, result_id ASC
+                    LIMIT 1
+                ) AS worst_id
+            FROM tests t
+            WHERE t.user_id = ? AND (? IS NULL OR t.bot_id = ?)
+        ) ends
+        JOIN test_results best ON best.result_id = ends.best_id
+        JOIN test_results worst ON worst.result_id = ends.worst_id
+        ''', (user_id, bot_id, bot_id)) as cursor:
+            extremes = await cursor.fetchall()
+
+        for test_id, best_username, best_score, worst_username, worst_score in extremes:
+            stats['best_friends'].append({'username': best_username, 'score': best_score, 'test_id': test_id})
+            stats['worst_friends'].append({'username': worst_username, 'score': worst_score, 'test_id': test_id})
+
         # Calculate overall average score
         if stats['total_passes'] > 0:
-            total_all_scores = sum(test['average_score'] * test['passes_count'] for test in stats['detailed_tests'] if test['passes_count'] > 0)
-            stats['average_score'] = round(total_all_scores / stats['total_passes'])
-        
+            stats['average_score'] = round(total_score / stats['total_passes'])
+
         # Sort best and worst friends
         stats['best_friends'] = sorted(stats['best_friends'], key=lambda x: x['score'], reverse=True)[:5]
         stats['worst_friends'] = sorted(stats['worst_friends'], key=lambda x: x['score'])[:5]
-        
+
         return stats
-    
-    async def get_top_friends(self, limit=10):
+
+    async def get_test_summaries_page(self, user_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
         """
-        Get top friends with highest average scores across all tests.
-        
+        Get one page of a creator's tests with their aggregates, newest first.
+
+        Uses keyset pagination on (created_at, test_id) over the creator
+        index; the aggregates are only computed for the tests on the page.
+
+        Args:
+            user_id: ID of the creator
+            cursor: (created_at, test_id) of the last test of the previous page
+            limit: Maximum number of tests on the page
+            bot_id: Only list tests of this bot, all bots if None
+
+        Returns:
+            dict: Per-test aggregates and the cursor of the next page (None if last)
+        """
+        aggregates = '''
+            SELECT
+                t.test_id,
+                t.created_at,
+                (SELECT COUNT(*) FROM test_results tr WHERE tr.test_id = t.test_id)
+                    + COALESCE((SELECT passes FROM test_rollups ro WHERE ro.test_id = t.test_id), 0),
+                (SELECT COALESCE(SUM(score), 0) FROM test_results tr WHERE tr.test_id = t.test_id)
+                    + COALESCE((SELECT score_sum FROM test_rollups ro WHERE ro.test_id = t.test_id), 0)
+            FROM tests t
+        '''
+        if cursor is None:
+            query = aggregates + '''
+            WHERE t.user_id = ? AND (? IS NULL OR t.bot_id = ?)
+            ORDER BY t.created_at DESC, t.test_id DESC
+            LIMIT ?
+            '''
+            params = (user_id, bot_id, bot_id, limit + 1)
+        else:
+            query = aggregates + '''
+            WHERE t.user_id = ? AND (? IS NULL OR t.bot_id = ?)
+              AND (t.created_at, t.test_id) < (?, ?)
+            ORDER BY t.created_at DESC, t.test_id DESC
+            LIMIT ?
+            '''
+            params = (user_id, bot_id, bot_id, cursor[0], cursor[1], limit + 1)
+
+        async with self.conn.execute(query, params) as db_cursor:
+            rows = await db_cursor.fetchall()
+
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            'tests': [test_summary(*row) for row in rows],
+            'next_cursor': (rows[-1][1], rows[-1][0]) if has_next else None
+        }
+
+    async def get_test_results_page(self, test_id, cursor=None, limit=STATS_PAGE_SIZE):
+        """
+        Get one page of passes of a test, best scores first.
+
+        Uses keyset pagination on (score, result_id), so every page is a
+        bounded range scan over the score index regardless of test size.
+
+        Args:
+            test_id: ID of the test
+            cursor: (score, result_id) of the last row of the previous page
+            limit: Maximum number of rows on the page
+
+        Returns:
+            dict: Page rows and the cursor of the next page (None if last)
+        """
+        if cursor is None:
+            query = '''
+            SELECT result_id, taker_id, taker_username, score, created_at
+            FROM test_results
+            WHERE test_id = ?
+            ORDER BY score DESC, result_id DESC
+            LIMIT ?
+            '''
+            params = (test_id, limit + 1)
+        else:
+            query = '''
+            SELECT result_id, taker_id, taker_username, score, created_at
+            FROM test_results
+            WHERE test_id = ? AND (score, result_id) < (?, ?)
+            ORDER BY score DESC, result_id DESC
+            LIMIT ?
+            '''
+            params = (test_id, cursor[0], cursor[1], limit + 1)
+
+        async with self.conn.execute(query, params) as db_cursor:
+            rows = await db_cursor.fetchall()
+
+        # One extra row tells whether there is a next page
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            'results': [
+                {
+                    'result_id': row[0],
+                    'taker_id': row[1],
+                    'username': row[2],
+                    'score': row[3],
+                    'created_at': row[4]
+                }
+                for row in rows
+            ],
+            'next_cursor': (rows[-1][3], rows[-1][0]) if has_next else None
+        }
+
+    async def get_friend_history_page(self, creator_id, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """
+        Get one page of a friend's passes of the creator's tests, newest first.
+
+        Uses keyset pagination on (created_at, result_id) over the taker index.
+
+        Args:
+            creator_id: ID of the test creator
+            taker_id: ID of the friend who took the tests
+            cursor: (created_at, result_id) of the last row of the previous page
+            limit: Maximum number of rows on the page
+            bot_id: Only list passes of this bot's tests, all bots if None
+
+        Returns:
+            dict: Page rows and the cursor of the next page (None if last)
+        """
+        if cursor is None:
+            query = '''
+            SELECT tr.result_id, tr.test_id, tr.taker_username, tr.score, tr.created_at
+            FROM test_results tr
+            JOIN tests t ON t.test_id = tr.test_id
+            WHERE tr.taker_id = ? AND t.user_id = ? AND (? IS NULL OR t.bot_id = ?)
+            ORDER BY tr.created_at DESC, tr.result_id DESC
+            LIMIT ?
+            '''
+            params = (taker_id, creator_id, bot_id, bot_id, limit + 1)
+        else:
+            query = '''
+            SELECT tr.result_id, tr.test_id, tr.taker_username, tr.score, tr.created_at
+            FROM test_results tr
+            JOIN tests t ON t.test_id = tr.test_id
+            WHERE tr.taker_id = ? AND t.user_id = ? AND (? IS NULL OR t.bot_id = ?)
+              AND (tr.created_at, tr.result_id) < (?, ?)
+            ORDER BY tr.created_at DESC, tr.result_id DESC
+            LIMIT ?
+            '''
+            params = (taker_id, creator_id, bot_id, bot_id, cursor[0], cursor[1], limit + 1)
+
+        async with self.conn.execute(query, params) as db_cursor:
+            rows = await db_cursor.fetchall()
+
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            'results': [
+                {
+                    'result_id': row[0],
+                    'test_id': row[1],
+                    'username': row[2],
+                    'score': row[3],
+                    'created_at': row[4]
+                }
+                for row in rows
+            ],
+            'next_cursor': (rows[-1][4], rows[-1][0]) if has_next else None
+        }
+
+    async def get_taker_stats(self, taker_id, bot_id=None):
+        """
+        Get the running totals of every pass a friend made, retakes included.
+
+        Args:
+            taker_id: ID of the friend
+            bot_id: Only count passes of tests of this bot, all bots if None
+
+        Returns:
+            dict: Number of passes, score sum and average score, or None if there are none
+        """
+        async with self.conn.execute('''
+        SELECT SUM(passes), SUM(score_sum)
+        FROM taker_stats
+        WHERE taker_id = ? AND (? IS NULL OR bot_id = ?)
+        ''', (taker_id, bot_id, bot_id)) as cursor:
+            row = await cursor.fetchone()
+
+        if not row or not row[0]:
+            return None
+
+        return {
+            'passes': row[0],
+            'score_sum': row[1],
+            'average_score': round(row[1] / row[0])
+        }
+
+    async def get_taken_tests_page(self, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """
+        Get one page of the tests a friend took, newest first.
+
+        Uses keyset pagination on (created_at, result_id); the page is read
+        from the covering taker index and joined to the creators.
+
+        Args:
+            taker_id: ID of the friend
+            cursor: (created_at, result_id) of the last row of the previous page
+            limit: Maximum number of rows on the page
+            bot_id: Only list tests of this bot, all bots if None
+
+        Returns:
+            dict: Page rows and the cursor of the next page (None if last)
+        """
+        if cursor is None:
+            query = '''
+            SELECT tr.result_id, tr.test_id, tr.score, tr.created_at, t.user_id, u.username, u.first_name
+            FROM test_results tr
+            JOIN tests t ON t.test_id = tr.test_id
+            LEFT JOIN users u ON u.user_id = t.user_id
+            WHERE tr.taker_id = ? AND (? IS NULL OR t.bot_id = ?)
+            ORDER BY tr.created_at DESC, tr.result_id DESC
+            LIMIT ?
+            '''
+            params = (taker_id, bot_id, bot_id, limit + 1)
+        else:
+            query = '''
+            SELECT tr.result_id, tr.test_id, tr.score, tr.created_at, t.user_id, u.username, u.first_name
+            FROM test_results tr
+            JOIN tests t ON t.test_id = tr.test_id
+            LEFT JOIN users u ON u.user_id = t.user_id
+            WHERE tr.taker_id = ? AND (? IS NULL OR t.bot_id = ?) AND (tr.created_at, tr.result_id) < (?, ?)
+            ORDER BY tr.created_at DESC, tr.result_id DESC
+            LIMIT ?
+            '''
+            params = (taker_id, bot_id, bot_id, cursor[0], cursor[1], limit + 1)
+
+        async with self.conn.execute(query, params) as db_cursor:
+            rows = await db_cursor.fetchall()
+
+        has_next = len(rows) > limit
+        rows = rows[:limit]
+
+        return {
+            'results': [
+                {
+                    'result_id': row[0],
+                    'test_id': row[1],
+                    'score': row[2],
+                    'created_at': row[3],
+                    'creator_id': row[4],
+                    'creator_username': row[5],
+                    'creator_first_name': row[6]
+                }
+                for row in rows
+            ],
+            'next_cursor': (rows[-1][3], rows[-1][0]) if has_next else None
+        }
+
+    async def get_top_friends(self, limit=10, bot_id=None):
+        """
+        Get top friends with highest average scores over every pass, retakes included.
+
+        Read from the per-taker totals /mystats shows, which already hold
+        the passes the retention job rolled up. For one bot the top list is
+        read off idx_taker_stats_bot_average; across all bots a taker's
+        totals are summed first, which reads every taker.
+
         Args:
             limit: Maximum number of friends to return
-            
+            bot_id: Only count passes of tests of this bot, all bots if None
+
         Returns:
             list: List of friends with their average scores
         """
-        async with self.conn.execute('''
-        SELECT taker_username, AVG(score) as avg_score, COUNT(result_id) as passes_count
-        FROM test_results
-        GROUP BY taker_username
-        HAVING passes_count > 0
-        ORDER BY avg_score DESC
-        LIMIT ?
-        ''', (limit,)) as cursor:
+        if bot_id is not None:
+            query = '''
+            SELECT taker_username, score_sum * 1.0 / passes as avg_score, passes as passes_count
+            FROM taker_stats
+            WHERE bot_id = ? AND passes > 0
+            ORDER BY score_sum * 1.0 / passes DESC
+            LIMIT ?
+            '''
+            params = (bot_id, limit)
+        else:
+            query = '''
+            SELECT taker_username, SUM(score_sum) * 1.0 / SUM(passes) as avg_score, SUM(passes) as passes_count
+            FROM taker_stats
+            GROUP BY taker_id
+            HAVING passes_count > 0
+            ORDER BY avg_score DESC
+            LIMIT ?
+            '''
+            params = (limit,)
+        async with self.conn.execute(query, params) as cursor:
             results = await cursor.fetchall()
         
         return [
@@ -288,12 +1393,433 @@ class Database:
             for result in results
         ]
     
+    async def get_taker_totals(self, bot_id=None):
+        """
+        Get score sums and pass counts of every friend, rollups included.
+
+        Used to merge /top across several databases.
+
+        Args:
+            bot_id: Only count passes of tests of this bot, all bots if None
+
+        Returns:
+            list: (taker_id, username, score_sum, passes_count) rows
+        """
+        async with self.conn.execute('''
+        SELECT taker_id, taker_username, SUM(score_sum), SUM(passes)
+        FROM taker_stats
+        WHERE ? IS NULL OR bot_id = ?
+        GROUP BY taker_id
+        ''', (bot_id, bot_id)) as cursor:
+            return await cursor.fetchall()
+
+    async def _table_columns(self, table):
+        """Column names of a table in this file, empty if it does not exist."""
+        # Unqualified, the pragma would also find the attached shared file's table
+        async with self.conn.execute(f'PRAGMA main.table_info({table})') as cursor:
+            return [row[1] for row in await cursor.fetchall()]
+
+    async def _add_column_if_missing(self, table, column, definition):
+        """
+        Add a column to an existing table unless it is already there.
+
+        Args:
+            table: Table name
+            column: Column name
+            definition: Column type and constraints
+
+        Returns:
+            bool: True if the column was added
+        """
+        if column in await self._table_columns(table):
+            return False
+
+        await self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        return True
+
+    async def _increment_answer_counters(self, rows, bot_id):
+        """
+        Add deltas to the answer distribution counters of a bot.
+
+        Runs inside the caller's transaction; the caller commits.
+
+        Args:
+            rows: (question_id, option_index, role, delta) tuples
+            bot_id: Bot of the test the deltas come from, None for no bot
+        """
+        key = bot_key(bot_id)
+        await self.conn.executemany('''
+        INSERT INTO answer_counters (bot_id, question_id, option_index, role, count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (bot_id, question_id, option_index, role)
+        DO UPDATE SET count = count + excluded.count
+        ''', [(key,) + tuple(row) for row in rows])
+
+    async def get_question_statistics(self, bot_id=None):
+        """
+        Get answer distributions for every question from the counters.
+
+        Args:
+            bot_id: Only count tests of this bot and their passes, all bots if None
+
+        Returns:
+            dict: question_id -> role -> {option_index: count}
+        """
+        async with self.conn.execute('''
+        SELECT question_id, option_index, role, SUM(count) AS total
+        FROM answer_counters
+        WHERE ? IS NULL OR bot_id = ?
+        GROUP BY question_id, option_index, role
+        HAVING total > 0
+        ''', (bot_id, bot_id)) as cursor:
+            rows = await cursor.fetchall()
+
+        stats = {}
+        for question_id, option_index, role, count in rows:
+            roles = stats.setdefault(question_id, {'creator': {}, 'taker': {}, 'miss': {}})
+            roles[role][option_index] = count
+
+        return stats
+
+    async def rebuild_answer_counters(self, chunk_size=1000):
+        """
+        Rebuild the answer distribution counters of every bot from the stored rows.
+
+        Tests and results are streamed in chunks, so memory is bounded by
+        the number of distinct counters rather than the number of rows.
+
+        Args:
+            chunk_size: Number of rows fetched at a time
+
+        Returns:
+            dict: Number of tests and results processed
+        """
+        counters = Counter()
+        tests_count = 0
+        results_count = 0
+
+        # Results whose answers were dropped by the retention job
+        async with self.conn.execute('''
+        SELECT bot_id, question_id, option_index, role, count
+        FROM retired_answer_counters
+        ''') as cursor:
+            async for bot_id, question_id, option_index, role, count in cursor:
+                counters[(bot_id, question_id, option_index, role)] += count
+
+        # Only tests on the global bank are counted
+        async with self.conn.execute('SELECT answers, bot_id FROM tests WHERE question_set IS NULL') as cursor:
+            while rows := await cursor.fetchmany(chunk_size):
+                for answers_json, bot_id in rows:
+                    for question_id, option_index, role, delta in answer_counter_rows(json.loads(answers_json)):
+                        counters[(bot_key(bot_id), question_id, option_index, role)] += delta
+                tests_count += len(rows)
+
+        # Results are ordered by test so only one test's answers are held at a time
+        current_test_id = None
+        original_answers = None
+        async with self.conn.execute('''
+        SELECT tr.test_id, tr.answers, t.answers, t.bot_id
+        FROM test_results tr
+        JOIN tests t ON t.test_id = tr.test_id
+        WHERE tr.answers IS NOT NULL AND t.question_set IS NULL
+        ORDER BY tr.test_id
+        ''') as cursor:
+            while rows := await cursor.fetchmany(chunk_size):
+                for test_id, answers_json, original_json, bot_id in rows:
+                    if test_id != current_test_id:
+                        current_test_id = test_id
+                        original_answers = json.loads(original_json)
+                    answers = json.loads(answers_json)
+                    for question_id, option_index, role, delta in answer_counter_rows(original_answers, answers):
+                        counters[(bot_key(bot_id), question_id, option_index, role)] += delta
+                results_count += len(rows)
+
+        await self.conn.execute('DELETE FROM answer_counters')
+        await self.conn.executemany('''
+        INSERT INTO answer_counters (bot_id, question_id, option_index, role, count)
+        VALUES (?, ?, ?, ?, ?)
+        ''', [key + (count,) for key, count in counters.items()])
+        await self.conn.commit()
+
+        return {'tests': tests_count, 'results': results_count}
+
+    async def _increment_taker_stats(self, rows):
+        """
+        Add to the running per-taker totals of each bot.
+
+        Runs inside the caller's transaction; the caller commits.
+
+        Args:
+            rows: (taker_id, bot key, taker_username, passes delta, score sum delta)
+                tuples; a None username keeps the stored one
+        """
+        await self.conn.executemany('''
+        INSERT INTO taker_stats (taker_id, bot_id, taker_username, passes, score_sum)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (taker_id, bot_id)
+        DO UPDATE SET
+            taker_username = COALESCE(excluded.taker_username, taker_username),
+            passes = passes + excluded.passes,
+            score_sum = score_sum + excluded.score_sum
+        ''', rows)
+
+    async def rebuild_taker_stats(self):
+        """
+        Recompute the per-taker totals of each bot from the stored results and rollups.
+
+        Kept rows carry every collapsed attempt; rows removed by the
+        retention job only left their final score in taker_rollups. The
+        name is the one of the taker's latest stored pass.
+        """
+        await self.conn.execute('DELETE FROM taker_stats')
+        # The bare taker_username comes from the row with MAX(created_at)
+        await self.conn.execute('''
+        INSERT INTO taker_stats (taker_id, bot_id, taker_username, passes, score_sum)
+        SELECT taker_id, bot_id, taker_username, passes, score_sum
+        FROM (
+            SELECT taker_id, bot_id, taker_username, SUM(passes) AS passes, SUM(score_sum) AS score_sum,
+                   MAX(created_at)
+            FROM (
+                SELECT tr.taker_id, COALESCE(t.bot_id, ?) AS bot_id, tr.taker_username,
+                       tr.attempts AS passes, tr.attempts_score_sum AS score_sum, tr.created_at
+                FROM test_results tr
+                LEFT JOIN tests t ON t.test_id = tr.test_id
+                UNION ALL
+                SELECT taker_id, bot_id, taker_username, passes, score_sum, ''
+                FROM taker_rollups
+            )
+            GROUP BY taker_id, bot_id
+        )
+        ''', (NO_BOT,))
+        await self.conn.commit()
+
+    async def _increment_score_histogram(self, test_id, score, delta):
+        """
+        Add a delta to one bucket of a test's score histogram.
+
+        Runs inside the caller's transaction; the caller commits.
+
+        Args:
+            test_id: ID of the test
+            score: Score bucket (0-100)
+            delta: Value to add to the bucket
+        """
+        await self.conn.execute('''
+        INSERT INTO score_histogram (test_id, score, count)
+        VALUES (?, ?, ?)
+        ON CONFLICT (test_id, score)
+        DO UPDATE SET count = count + excluded.count
+        ''', (test_id, score, delta))
+
+    async def get_score_rank(self, test_id, score):
+        """
+        Get the rank of a score among all passes of a test.
+
+        Reads at most 101 histogram buckets, however many passes there are.
+
+        Args:
+            test_id: ID of the test
+            score: Score to rank (0-100)
+
+        Returns:
+            dict: Place, total passes and the share of other passes beaten
+        """
+        async with self.conn.execute('''
+        SELECT score, count
+        FROM score_histogram
+        WHERE test_id = ? AND count > 0
+        ''', (test_id,)) as cursor:
+            buckets = await cursor.fetchall()
+
+        return rank_from_histogram(buckets, score)
+
+    async def rebuild_score_histograms(self):
+        """
+        Rebuild the score histograms of all tests from the stored results.
+
+        Returns:
+            int: Number of histogram buckets written
+        """
+        await self.conn.execute('DELETE FROM score_histogram')
+        cursor = await self.conn.execute('''
+        INSERT INTO score_histogram (test_id, score, count)
+        SELECT test_id, score, SUM(count)
+        FROM (
+            SELECT test_id, score, 1 AS count
+            FROM test_results
+            UNION ALL
+            SELECT test_id, score, count
+            FROM score_histogram_rollups
+        )
+        GROUP BY test_id, score
+        ''')
+        await self.conn.commit()
+
+        return cursor.rowcount
+
+    async def retire_old_results(self, max_age_days, mode, batch_size=500):
+        """
+        Retire one batch of results older than the retention age.
+
+        In "strip" mode the rows stay and only their answers are dropped; in
+        "delete" mode the rows are removed and rolled into the per-test and
+        per-taker aggregates. Either way their answer counter contribution is
+        moved to retired_answer_counters so rebuilds stay exact.
+
+        Args:
+            max_age_days: Results older than this many days are retired
+            mode: "strip" or "delete"
+            batch_size: Maximum number of results retired in one transaction
+
+        Returns:
+            int: Number of results retired, 0 when nothing is left
+        """
+        if mode not in RETENTION_MODES:
+            raise ValueError(f"Unknown retention mode: {mode}")
+
+        answers_filter = 'AND tr.answers IS NOT NULL' if mode == 'strip' else ''
+        async with self.conn.execute(f'''
+        SELECT tr.result_id, tr.test_id, tr.taker_id, tr.taker_username, tr.score, tr.answers, t.answers,
+               t.question_set, tr.attempts, tr.attempts_score_sum, t.bot_id
+        FROM test_results tr
+        JOIN tests t ON t.test_id = tr.test_id
+        WHERE tr.created_at < datetime('now', ?) {answers_filter}
+        ORDER BY tr.created_at
+        LIMIT ?
+        ''', (f'-{max_age_days} days', batch_size)) as cursor:
+            rows = await cursor.fetchall()
+
+        if not rows:
+            return 0
+
+        retired_counters = Counter()
+        for _, _, _, _, _, answers_json, original_json, question_set, _, _, bot_id in rows:
+            if answers_json is None or question_set is not None:
+                continue
+            for question_id, option_index, role, delta in answer_counter_rows(
+                json.loads(original_json), json.loads(answers_json)
+            ):
+                retired_counters[(bot_key(bot_id), question_id, option_index, role)] += delta
+
+        await self.conn.executemany('''
+        INSERT INTO retired_answer_counters (bot_id, question_id, option_index, role, count)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (bot_id, question_id, option_index, role)
+        DO UPDATE SET count = count + excluded.count
+        ''', [key + (count,) for key, count in retired_counters.items()])
+
+        result_ids = [(row[0],) for row in rows]
+        if mode == 'strip':
+            await self.conn.executemany(
+                'UPDATE test_results SET answers = NULL WHERE result_id = ?', result_ids
+            )
+        else:
+            # Per-test passes and histograms count rows, like get_test_statistics
+            await self.conn.executemany('''
+            INSERT INTO test_rollups (test_id, passes, score_sum)
+            VALUES (?, 1, ?)
+            ON CONFLICT (test_id)
+            DO UPDATE SET passes = passes + 1, score_sum = score_sum + excluded.score_sum
+            ''', [(row[1], row[4]) for row in rows])
+            # Taker totals count every collapsed attempt, like rebuild_taker_stats
+            await self.conn.executemany('''
+            INSERT INTO taker_rollups (taker_id, bot_id, taker_username, passes, score_sum)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (taker_id, bot_id)
+            DO UPDATE SET
+                taker_username = excluded.taker_username,
+                passes = passes + excluded.passes,
+                score_sum = score_sum + excluded.score_sum
+            ''', [(row[2], bot_key(row[10]), row[3], row[8], row[9]) for row in rows])
+            await self.conn.executemany('''
+            INSERT INTO score_histogram_rollups (test_id, score, count)
+            VALUES (?, ?, 1)
+            ON CONFLICT (test_id, score)
+            DO UPDATE SET count = count + 1
+            ''', [(row[1], row[4]) for row in rows])
+            await self.conn.executemany(
+                'DELETE FROM test_results WHERE result_id = ?', result_ids
+            )
+
+        await self.conn.commit()
+
+        return len(rows)
+
+    async def get_storage_report(self, max_age_days, mode=RETENTION_MODE):
+        """
+        Report how much space the retention job and vacuum could reclaim.
+
+        Args:
+            max_age_days: Retention age in days, 0 when retention is disabled
+            mode: Retention mode; already stripped results only count for "delete"
+
+        Returns:
+            dict: Page statistics and the size of retirable results
+        """
+        pragmas = {}
+        for pragma in ('page_size', 'page_count', 'freelist_count', 'auto_vacuum'):
+            async with self.conn.execute(f'PRAGMA {pragma}') as cursor:
+                pragmas[pragma] = (await cursor.fetchone())[0]
+
+        retirable_results = retirable_answer_bytes = 0
+        if max_age_days > 0:
+            answers_filter = 'AND answers IS NOT NULL' if mode == 'strip' else ''
+            async with self.conn.execute(f'''
+            SELECT COUNT(*), COALESCE(SUM(LENGTH(answers)), 0)
+            FROM test_results
+            WHERE created_at < datetime('now', ?) {answers_filter}
+            ''', (f'-{max_age_days} days',)) as cursor:
+                retirable_results, retirable_answer_bytes = await cursor.fetchone()
+
+        return {
+            'database_bytes': pragmas['page_size'] * pragmas['page_count'],
+            'free_bytes': pragmas['page_size'] * pragmas['freelist_count'],
+            'free_pages': pragmas['freelist_count'],
+            'incremental_vacuum': pragmas['auto_vacuum'] == 2,
+            'retirable_results': retirable_results,
+            'retirable_answer_bytes': retirable_answer_bytes
+        }
+
+    async def incremental_vacuum_step(self, pages):
+        """
+        Return up to the given number of free pages to the file system.
+
+        Args:
+            pages: Maximum number of pages to release
+
+        Returns:
+            int: Number of free pages left
+        """
+        async with self.conn.execute(f'PRAGMA incremental_vacuum({int(pages)})') as cursor:
+            await cursor.fetchall()
+
+        async with self.conn.execute('PRAGMA freelist_count') as cursor:
+            return (await cursor.fetchone())[0]
+
+    async def analyze_table(self, table, analysis_limit=1000):
+        """
+        Refresh the query planner statistics of one table.
+
+        Args:
+            table: Table name
+            analysis_limit: Approximate number of index rows sampled
+        """
+        await self.conn.execute(f'PRAGMA analysis_limit = {int(analysis_limit)}')
+        await self.conn.execute(f'ANALYZE {table}')
+        await self.conn.commit()
+
+    async def enable_incremental_vacuum(self):
+        """
+        Switch an existing database to incremental auto-vacuum.
+
+        Rewrites the whole file with VACUUM, so it must be run while the bot is stopped.
+        """
+        await self.conn.commit()
+        await self.conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        await self.conn.execute('VACUUM')
+
     async def close(self):
         """Close the database connection."""
         if self.conn:
             await self.conn.close()
             self.conn = None
-
-
-# Create a single instance of the database
-db = Database()
\ No newline at end of file
@@ -0,0 +1,216 @@
+"""
+Streaming export of the bot's tables for analytics.
+
+Rows are read through read-only connections in fixed-size chunks and
+written out immediately, so memory use does not depend on table size.
+Under the sharded backend users come from users.db and every shard is
+appended to one file per table, with result IDs made global as the bot
+shows them.
+"""
+import csv
+import gzip
+import json
+import os
+import time
+
+import aiosqlite
+
+from src.consts import EXPORT_CHUNK_SIZE
+from src.db import ShardedDatabase, db, sqlite_databases
+from src.questions import current_bank
+
+EXPORT_TABLES = ("users", "tests", "test_results")
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+def _open_output(path, compress):
+    """Open an export file for text writing, gzip-compressed if requested."""
+    if compress:
+        return gzip.open(path, 'wt', encoding='utf-8', newline='')
+    return open(path, 'w', encoding='utf-8', newline='')
+
+
+async def _select_list(conn, table, shard_index, shard_count, with_question_set=False):
+    """
+    Columns of a table, with the shard-local result ID made global.
+
+    With with_question_set a result also carries the question set of its
+    test, which always lives on the same shard.
+    """
+    if table != 'test_results' or (shard_count is None and not with_question_set):
+        return '*'
+    async with conn.execute(f'PRAGMA table_info({table})') as cursor:
+        columns = [row[1] for row in await cursor.fetchall()]
+    select = [
+        f'result_id * {shard_count} + {shard_index} AS result_id'
+        if column == 'result_id' and shard_count is not None else column
+        for column in columns
+    ]
+    if with_question_set:
+        select.append(
+            '(SELECT question_set FROM tests WHERE tests.test_id = test_results.test_id) AS question_set'
+        )
+    return ", ".join(select)
+
+
+def _spread_answers(raw, question_set, answer_keys):
+    """
+    Split stored answers into the bank columns and the JSON left over.
+
+    Returns:
+        tuple: Values of the answer_<id> columns and the answers cell
+    """
+    if raw is None:
+        return tuple("" for _ in answer_keys), ""
+    if question_set is not None:
+        # A custom set's IDs mean other questions, keep them out of the bank columns
+        return tuple("" for _ in answer_keys), raw
+    answers = json.loads(raw)
+    spread = tuple(answers.pop(key, "") for key in answer_keys)
+    return spread, json.dumps(answers, ensure_ascii=False) if answers else ""
+
+
+async def export_table(
+    conns, table, out_dir, fmt, compress=False, chunk_size=EXPORT_CHUNK_SIZE, shard_count=None, question_ids=None
+):
+    """
+    Stream one table into a CSV or JSON Lines file.
+
+    The answers column is decoded into a nested object in JSON Lines. CSV
+    has no nesting, so answers to the global bank are spread into one
+    answer_<question id> column per bank question, holding the chosen
+    option index. Rows of custom question sets keep their answers as JSON
+    in the answers column, next to the question_set column that tells what
+    the IDs refer to; so do bank answers to questions no longer in the
+    bank. Missing answers, and answers stripped by retention, are empty.
+
+    Args:
+        conns: Read-only aiosqlite connections holding the table, in shard order
+        table: Table to export
+        out_dir: Directory for the export file
+        fmt: "csv" or "jsonl"
+        compress: Whether to gzip the output
+        chunk_size: Number of rows fetched at a time
+        shard_count: Number of shards when conns are shards, None for a single database
+        question_ids: Bank question IDs for the CSV answer columns, the current bank's if None
+
+    Returns:
+        dict: Output path, number of rows, bytes written and duration
+    """
+    if table not in EXPORT_TABLES:
+        raise ValueError(f"Unknown table: {table}")
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown format: {fmt}")
+
+    path = os.path.join(out_dir, f"{table}.{fmt}" + (".gz" if compress else ""))
+    started = time.perf_counter()
+    rows_count = 0
+
+    spread = fmt == 'csv' and table != 'users'
+    if spread and question_ids is None:
+        question_ids = current_bank().question_ids
+    answer_keys = list(question_ids) if spread else []
+
+    with _open_output(path, compress) as output:
+        writer = None
+        for shard_index, conn in enumerate(conns):
+            select = await _select_list(conn, table, shard_index, shard_count, with_question_set=spread)
+            async with conn.execute(f'SELECT {select} FROM {table}') as cursor:
+                columns = [column[0] for column in cursor.description]
+                answers_index = columns.index('answers') if 'answers' in columns else None
+                set_index = columns.index('question_set') if 'question_set' in columns else None
+
+                if fmt == 'csv' and writer is None:
+                    writer = csv.writer(output)
+                    writer.writerow(columns + [f"answer_{key}" for key in answer_keys])
+
+                while rows := await cursor.fetchmany(chunk_size):
+                    if writer and answers_index is None:
+                        writer.writerows(rows)
+                    elif writer:
+                        for row in rows:
+                            values, rest = _spread_answers(row[answers_index], row[set_index], answer_keys)
+                            writer.writerow(row[:answers_index] + (rest,) + row[answers_index + 1:] + values)
+                    else:
+                        for row in rows:
+                            record = dict(zip(columns, row))
+                            if answers_index is not None and row[answers_index] is not None:
+                                record['answers'] = json.loads(row[answers_index])
+                            output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    rows_count += len(rows)
+
+    return {
+        'path': path,
+        'rows': rows_count,
+        'bytes': os.path.getsize(path),
+        'duration': time.perf_counter() - started
+    }
+
+
+async def export_tables(
+    tables, out_dir, fmt, compress=False, chunk_size=EXPORT_CHUNK_SIZE, storage=None, question_ids=None
+):
+    """
+    Export several tables through read-only connections to the storage files.
+
+    Args:
+        tables: Tables to export
+        out_dir: Directory for the export files
+        fmt: "csv" or "jsonl"
+        compress: Whether to gzip the output
+        chunk_size: Number of rows fetched at a time
+        storage: Storage backend to export, the bot's configured one if None
+        question_ids: Bank question IDs for the CSV answer columns, the current bank's if None
+
+    Returns:
+        list: One report per table
+
+    Raises:
+        ValueError: If the backend keeps nothing on disk
+    """
+    storage = db if storage is None else storage
+    databases = sqlite_databases(storage, include_users=True)
+    if not databases:
+        raise ValueError(f"The {type(storage).__name__} backend keeps nothing on disk to export")
+    sharded = isinstance(storage, ShardedDatabase)
+    shard_count = storage.shard_count if sharded else None
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    # A read-only connection never takes the write lock; with the bot's
+    # database in WAL mode it does not block the writer either
+    conns = [
+        await aiosqlite.connect(f"file:{database.db_name}?mode=ro", uri=True)
+        for database in databases
+    ]
+    # The sharded users file only holds users, the shards everything else
+    users_conns, data_conns = (conns[:1], conns[1:]) if sharded else (conns, conns)
+    try:
+        return [
+            await export_table(
+                users_conns if table == 'users' else data_conns,
+                table, out_dir, fmt, compress, chunk_size, shard_count, question_ids
+            )
+            for table in tables
+        ]
+    finally:
+        for conn in conns:
+            await conn.close()
+
+
+def format_export_report(report):
+    """
+    Format the throughput of one exported table.
+
+    Args:
+        report: Report from export_table
+
+    Returns:
+        str: Human-readable line
+    """
+    duration = max(report['duration'], 1e-9)
+    return (
+        f"{report['path']}: {report['rows']} rows, {report['bytes']} bytes "
+        f"in {report['duration']:.2f}s ({report['rows'] / duration:.0f} rows/s, "
+        f"{report['bytes'] / duration / 1024 / 1024:.1f} MB/s)"
+    )
@@ -0,0 +1,122 @@
+"""
+Background maintenance of the database: retention, vacuum and statistics.
+
+Every step is a short, bounded statement followed by a pause, so the bot's
+own queries on the shared connection never wait behind a long operation.
+"""
+import asyncio
+import logging
+import time
+
+from src.consts import (
+    MAINTENANCE_BATCH_SIZE,
+    MAINTENANCE_INTERVAL,
+    MAINTENANCE_STEP_PAUSE,
+    MAINTENANCE_VACUUM_PAGES,
+    RETENTION_DAYS,
+    RETENTION_MODE
+)
+
+logger = logging.getLogger(__name__)
+
+# Tables whose planner statistics are refreshed after each pass
+ANALYZED_TABLES = ("users", "tests", "test_results")
+
+
+async def run_maintenance_pass(database, retention_days=RETENTION_DAYS, mode=RETENTION_MODE):
+    """
+    Run one full maintenance pass in small time-sliced steps.
+
+    Args:
+        database: Connected Database instance
+        retention_days: Results older than this many days are retired,
+            0 skips retention and only vacuums and analyzes
+        mode: Retention mode, "strip" or "delete"
+
+    Returns:
+        dict: Work done and the longest single step in seconds
+    """
+    summary = {'retired_results': 0, 'released_pages': 0, 'analyzed_tables': 0, 'longest_step': 0.0}
+
+    async def timed(step):
+        started = time.perf_counter()
+        result = await step
+        summary['longest_step'] = max(summary['longest_step'], time.perf_counter() - started)
+        await asyncio.sleep(MAINTENANCE_STEP_PAUSE)
+        return result
+
+    # Retire old results batch by batch, only when retention is enabled
+    while retention_days > 0:
+        retired = await timed(database.retire_old_results(retention_days, mode, MAINTENANCE_BATCH_SIZE))
+        if not retired:
+            break
+        summary['retired_results'] += retired
+
+    # Give the freed pages back to the file system
+    report = await database.get_storage_report(retention_days, mode)
+    if report['incremental_vacuum']:
+        free_pages = report['free_pages']
+        while free_pages:
+            left = await timed(database.incremental_vacuum_step(MAINTENANCE_VACUUM_PAGES))
+            summary['released_pages'] += free_pages - left
+            if left >= free_pages:
+                break
+            free_pages = left
+    elif report['free_pages']:
+        logger.warning(
+            "%d free pages cannot be released: run 'python -m src.cli maintenance "
+            "--enable-incremental-vacuum' while the bot is stopped",
+            report['free_pages']
+        )
+
+    # Refresh planner statistics one table at a time
+    for table in ANALYZED_TABLES:
+        await timed(database.analyze_table(table))
+        summary['analyzed_tables'] += 1
+
+    return summary
+
+
+async def maintenance_loop(database, interval=MAINTENANCE_INTERVAL):
+    """
+    Run maintenance passes forever with a pause between them.
+
+    Args:
+        database: Connected Database instance
+        interval: Seconds between passes
+    """
+    while True:
+        try:
+            summary = await run_maintenance_pass(database)
+            logger.info(
+                "Maintenance pass: %d results retired, %d pages released, "
+                "%d tables analyzed, longest step %.3fs",
+                summary['retired_results'], summary['released_pages'],
+                summary['analyzed_tables'], summary['longest_step']
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            logger.exception("Maintenance pass failed")
+
+        await asyncio.sleep(interval)
+
+
+def format_storage_report(report):
+    """
+    Format a storage report for the dry-run output.
+
+    Args:
+        report: Report from Database.get_storage_report
+
+    Returns:
+        str: Human-readable report
+    """
+    return "\n".join([
+        f"Database size:            {report['database_bytes']} bytes",
+        f"Free pages:               {report['free_pages']} ({report['free_bytes']} bytes)",
+        f"Incremental vacuum:       {'enabled' if report['incremental_vacuum'] else 'disabled'}",
+        f"Results past retention:   {report['retirable_results']}",
+        f"Their answers payload:    {report['retirable_answer_bytes']} bytes",
+        f"Reclaimable (estimate):   {report['free_bytes'] + report['retirable_answer_bytes']} bytes",
+    ])
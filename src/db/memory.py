@@ -0,0 +1,540 @@
+"""
+Pure in-memory storage backend.
+
+Keeps everything in dicts and lists with the same semantics as the SQLite
+backend. Nothing is persisted, which makes it suitable for tests, benchmarks
+and comparing engines without disk I/O.
+"""
+import copy
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+from src.consts import RETAKE_POLICY, RETAKE_POLICIES, STATS_PAGE_SIZE
+from src.db.base import (
+    NO_BOT,
+    Storage,
+    answer_counter_rows,
+    bot_key,
+    generate_test_id,
+    get_status,
+    rank_from_histogram,
+    score_answers,
+    test_summary
+)
+
+
+def _now():
+    """Current UTC time in the format SQLite's CURRENT_TIMESTAMP uses."""
+    return datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+
+
+class MemoryDatabase(Storage):
+    """In-memory storage backend."""
+
+    def __init__(self, retake_policy=RETAKE_POLICY):
+        """
+        Initialize empty storage.
+
+        Args:
+            retake_policy: 'keep_all', 'keep_best' or 'keep_latest'
+        """
+        if retake_policy not in RETAKE_POLICIES:
+            raise ValueError(f"Unknown retake policy: {retake_policy}")
+
+        self.retake_policy = retake_policy
+        self._reset()
+
+    def _reset(self):
+        """Drop all stored data."""
+        self.users = {}
+        self.question_sets = {}
+        self.bank_versions = []
+        self.tests = {}
+        # Results are an array indexed by result_id - 1
+        self.results = []
+        self.test_results = defaultdict(list)
+        self.taker_results = {}
+        # (taker_id, bot key) -> [passes, score sum, name of the latest pass] over every attempt
+        self.taker_stats = defaultdict(lambda: [0, 0, None])
+        # (bot key, question_id, option_index, role) -> count
+        self.answer_counters = Counter()
+        # One 101-bucket score histogram per test
+        self.histograms = defaultdict(lambda: [0] * 101)
+
+    async def connect(self):
+        """Nothing to open, the storage lives in the process."""
+
+    async def close(self):
+        """Drop all stored data."""
+        self._reset()
+
+    async def check_retake_policy(self):
+        """Every retake policy works on the in-memory layout."""
+
+    async def add_user(self, user_id, username, first_name, last_name):
+        """Add or update user."""
+        self.users[user_id] = {
+            'user_id': user_id,
+            'username': username,
+            'first_name': first_name,
+            'last_name': last_name,
+            'created_at': _now()
+        }
+
+    async def add_question_set(self, set_hash, questions, user_id):
+        """Store a question set under its content hash."""
+        self.question_sets.setdefault(set_hash, copy.deepcopy(questions))
+
+    async def get_question_set(self, set_hash):
+        """Get the questions of a stored set, or None."""
+        questions = self.question_sets.get(set_hash)
+        return copy.deepcopy(questions) if questions is not None else None
+
+    async def add_bank_version(self, set_hash, questions):
+        """Store a version of the global question bank."""
+        self.question_sets.setdefault(set_hash, copy.deepcopy(questions))
+        if set_hash not in self.bank_versions:
+            self.bank_versions.append(set_hash)
+
+    async def get_bank_versions(self):
+        """Get the content hashes of all stored bank versions."""
+        return list(self.bank_versions)
+
+    async def get_referenced_bank_versions(self):
+        """Get the content hashes stored tests use, as a bank version or an uploaded set."""
+        return {
+            set_hash
+            for test in self.tests.values()
+            for set_hash in (test['bank_version'], test['question_set'])
+            if set_hash is not None
+        }
+
+    async def pin_unversioned_tests(self, set_hash):
+        """Pin tests on the global bank created before versioning."""
+        pinned = 0
+        for test in self.tests.values():
+            if test['bank_version'] is None and test['question_set'] is None:
+                test['bank_version'] = set_hash
+                pinned += 1
+        return pinned
+
+    async def assign_unowned_tests(self, bot_id):
+        """Assign tests created before multi-bot hosting to a bot, with their share of the aggregates."""
+        assigned = 0
+        for test in self.tests.values():
+            if test['bot_id'] is None:
+                test['bot_id'] = bot_id
+                assigned += 1
+
+        for key in [key for key in self.answer_counters if key[0] == NO_BOT]:
+            self.answer_counters[(bot_id,) + key[1:]] += self.answer_counters.pop(key)
+        for taker_id, _ in [key for key in self.taker_stats if key[1] == NO_BOT]:
+            passes, score_sum, username = self.taker_stats.pop((taker_id, NO_BOT))
+            stats = self.taker_stats[(taker_id, bot_id)]
+            stats[0] += passes
+            stats[1] += score_sum
+            stats[2] = stats[2] or username
+        return assigned
+
+    async def delete_bank_versions(self, set_hashes):
+        """Delete bank versions and their questions, keeping sets tests use as uploads."""
+        uploaded = {test['question_set'] for test in self.tests.values()}
+        for set_hash in set_hashes:
+            if set_hash in self.bank_versions:
+                self.bank_versions.remove(set_hash)
+                if set_hash not in uploaded:
+                    self.question_sets.pop(set_hash, None)
+
+    async def create_test(self, user_id, answers, question_set=None, bank_version=None, bot_id=None):
+        """Create a new test for a user."""
+        test_id = generate_test_id()
+        self.tests[test_id] = {
+            'test_id': test_id,
+            'user_id': user_id,
+            'answers': copy.deepcopy(answers),
+            'question_set': question_set,
+            'bank_version': bank_version,
+            'bot_id': bot_id,
+            'created_at': _now()
+        }
+        if question_set is None:
+            self.answer_counters.update(self._counter_deltas(answer_counter_rows(answers), bot_id))
+        return test_id
+
+    async def get_test(self, test_id):
+        """Get test details by test_id."""
+        test = self.tests.get(test_id)
+        if not test:
+            return None
+
+        # Same as the inner join on users in the SQLite backend
+        user = self.users.get(test['user_id'])
+        if not user:
+            return None
+
+        return {
+            'user_id': test['user_id'],
+            'answers': copy.deepcopy(test['answers']),
+            'question_set': test['question_set'],
+            'bank_version': test['bank_version'],
+            'bot_id': test['bot_id'],
+            'username': user['username'],
+            'first_name': user['first_name'],
+            'last_name': user['last_name']
+        }
+
+    async def save_test_result(self, test_id, taker_id, taker_username, answers):
+        """Save the results of a test taken by a user."""
+        test_info = await self.get_test(test_id)
+        if not test_info:
+            return None
+
+        original_answers = test_info['answers']
+        percentage = score_answers(original_answers, answers)
+        status = get_status(percentage)
+
+        previous = None
+        if self.retake_policy != 'keep_all':
+            result_id = self.taker_results.get((test_id, taker_id))
+            previous = self.results[result_id - 1] if result_id else None
+
+        if previous is None:
+            result = {
+                'result_id': len(self.results) + 1,
+                'test_id': test_id,
+                'taker_id': taker_id,
+                'taker_username': taker_username,
+                'score': percentage,
+                'answers': copy.deepcopy(answers),
+                'created_at': _now(),
+                'attempts': 1,
+                'attempts_score_sum': percentage
+            }
+            self.results.append(result)
+            self.test_results[test_id].append(result['result_id'])
+            self.taker_results[(test_id, taker_id)] = result['result_id']
+            self._count_result(test_id, original_answers, result, 1)
+        else:
+            previous['taker_username'] = taker_username
+            previous['attempts'] += 1
+            previous['attempts_score_sum'] += percentage
+            if self.retake_policy == 'keep_latest' or percentage > previous['score']:
+                self._count_result(test_id, original_answers, previous, -1)
+                previous['score'] = percentage
+                previous['answers'] = copy.deepcopy(answers)
+                previous['created_at'] = _now()
+                self._count_result(test_id, original_answers, previous, 1)
+
+        stats = self.taker_stats[(taker_id, bot_key(test_info['bot_id']))]
+        stats[0] += 1
+        stats[1] += percentage
+        stats[2] = taker_username
+
+        rank = await self.get_score_rank(test_id, percentage)
+
+        return {
+            'percentage': percentage,
+            'status': status,
+            'rank': rank,
+            'creator': test_info
+        }
+
+    async def update_test_answers(self, test_id, answers):
+        """Replace the creator's answers and rescore every stored result."""
+        test = self.tests.get(test_id)
+        if not test:
+            return None
+        if answers.keys() != test['answers'].keys():
+            raise ValueError("Edited answers must cover the same questions")
+
+        results = self._results_of(test_id)
+        if not answers:
+            # Without questions every score stays as it is
+            return {'rescored': 0, 'kept': len(results)}
+
+        # Take out everything derived from the old answers, then add it back
+        rescorable = [result for result in results if result['answers'] is not None]
+        for result in rescorable:
+            self._count_result(test_id, test['answers'], result, -1)
+        if test['question_set'] is None:
+            self.answer_counters.update({
+                key: -delta
+                for key, delta in self._counter_deltas(answer_counter_rows(test['answers']), test['bot_id']).items()
+            })
+            self.answer_counters.update(self._counter_deltas(answer_counter_rows(answers), test['bot_id']))
+
+        test['answers'] = copy.deepcopy(answers)
+        for result in rescorable:
+            score = score_answers(answers, result['answers'])
+            result['attempts_score_sum'] += score - result['score']
+            self.taker_stats[(result['taker_id'], bot_key(test['bot_id']))][1] += score - result['score']
+            result['score'] = score
+            self._count_result(test_id, answers, result, 1)
+
+        return {'rescored': len(rescorable), 'kept': len(results) - len(rescorable)}
+
+    async def resume_rescores(self):
+        """Rescores run in one step in memory, none is ever left unfinished."""
+        return 0
+
+    def _count_result(self, test_id, original_answers, result, sign):
+        """Add or remove a result's contribution to the counters and histogram."""
+        # Custom sets have their own question IDs and stay out of /qstats
+        test = self.tests[test_id]
+        if test['question_set'] is None:
+            rows = answer_counter_rows(original_answers, result['answers'])
+            self.answer_counters.update({
+                key: sign * delta for key, delta in self._counter_deltas(rows, test['bot_id']).items()
+            })
+        self.histograms[test_id][result['score']] += sign
+
+    @staticmethod
+    def _counter_deltas(rows, bot_id):
+        """Collapse counter rows of a bot's test into a Counter keyed like the counters table."""
+        deltas = Counter()
+        for question_id, option_index, role, delta in rows:
+            deltas[(bot_key(bot_id), question_id, option_index, role)] += delta
+        return deltas
+
+    def _sorted_tests(self, user_id, bot_id=None):
+        """Tests of a user, with one bot only if bot_id is given, newest first."""
+        return sorted(
+            (
+                test for test in self.tests.values()
+                if test['user_id'] == user_id and (bot_id is None or test['bot_id'] == bot_id)
+            ),
+            key=lambda test: (test['created_at'], test['test_id']),
+            reverse=True
+        )
+
+    def _results_of(self, test_id):
+        """All stored results of a test."""
+        return [self.results[result_id - 1] for result_id in self.test_results.get(test_id, [])]
+
+    async def get_user_tests(self, user_id, bot_id=None):
+        """Get all tests created by a user, with one bot only if bot_id is given."""
+        return [(test['test_id'], test['created_at']) for test in self._sorted_tests(user_id, bot_id)]
+
+    async def get_test_statistics(self, user_id, bot_id=None):
+        """Get statistics for all tests created by a user, with one bot only if bot_id is given."""
+        tests = self._sorted_tests(user_id, bot_id)
+        if not tests:
+            return None
+
+        stats = {
+            'tests_count': len(tests),
+            'total_passes': 0,
+            'average_score': 0,
+            'best_friends': [],
+            'worst_friends': [],
+            'tests': []
+        }
+
+        total_score = 0
+        for test in tests:
+            results = self._results_of(test['test_id'])
+            score_sum = sum(result['score'] for result in results)
+            stats['tests'].append(test_summary(test['test_id'], test['created_at'], len(results), score_sum))
+
+            if not results:
+                continue
+
+            stats['total_passes'] += len(results)
+            total_score += score_sum
+
+            best_friend = max(results, key=lambda result: (result['score'], result['result_id']))
+            worst_friend = min(results, key=lambda result: (result['score'], result['result_id']))
+            stats['best_friends'].append({
+                'username': best_friend['taker_username'],
+                'score': best_friend['score'],
+                'test_id': test['test_id']
+            })
+            stats['worst_friends'].append({
+                'username': worst_friend['taker_username'],
+                'score': worst_friend['score'],
+                'test_id': test['test_id']
+            })
+
+        if stats['total_passes'] > 0:
+            stats['average_score'] = round(total_score / stats['total_passes'])
+
+        stats['best_friends'] = sorted(stats['best_friends'], key=lambda x: x['score'], reverse=True)[:5]
+        stats['worst_friends'] = sorted(stats['worst_friends'], key=lambda x: x['score'])[:5]
+
+        return stats
+
+    async def get_test_summaries_page(self, user_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """Get one page of a creator's tests with their aggregates, newest first."""
+        tests = self._sorted_tests(user_id, bot_id)
+        if cursor is not None:
+            tests = [test for test in tests if (test['created_at'], test['test_id']) < tuple(cursor)]
+
+        has_next = len(tests) > limit
+        tests = tests[:limit]
+
+        summaries = []
+        for test in tests:
+            results = self._results_of(test['test_id'])
+            summaries.append(test_summary(
+                test['test_id'], test['created_at'], len(results), sum(result['score'] for result in results)
+            ))
+
+        return {
+            'tests': summaries,
+            'next_cursor': (tests[-1]['created_at'], tests[-1]['test_id']) if has_next else None
+        }
+
+    async def get_test_results_page(self, test_id, cursor=None, limit=STATS_PAGE_SIZE):
+        """Get one page of passes of a test, best scores first."""
+        results = sorted(
+            self._results_of(test_id),
+            key=lambda result: (result['score'], result['result_id']),
+            reverse=True
+        )
+        if cursor is not None:
+            results = [result for result in results if (result['score'], result['result_id']) < tuple(cursor)]
+
+        has_next = len(results) > limit
+        results = results[:limit]
+
+        return {
+            'results': [
+                {
+                    'result_id': result['result_id'],
+                    'taker_id': result['taker_id'],
+                    'username': result['taker_username'],
+                    'score': result['score'],
+                    'created_at': result['created_at']
+                }
+                for result in results
+            ],
+            'next_cursor': (results[-1]['score'], results[-1]['result_id']) if has_next else None
+        }
+
+    async def get_friend_history_page(self, creator_id, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """Get one page of a friend's passes of the creator's tests, newest first."""
+        results = sorted(
+            (
+                result for result in self.results
+                if result['taker_id'] == taker_id
+                and self.tests[result['test_id']]['user_id'] == creator_id
+                and bot_id in (None, self.tests[result['test_id']]['bot_id'])
+            ),
+            key=lambda result: (result['created_at'], result['result_id']),
+            reverse=True
+        )
+        if cursor is not None:
+            results = [result for result in results if (result['created_at'], result['result_id']) < tuple(cursor)]
+
+        has_next = len(results) > limit
+        results = results[:limit]
+
+        return {
+            'results': [
+                {
+                    'result_id': result['result_id'],
+                    'test_id': result['test_id'],
+                    'username': result['taker_username'],
+                    'score': result['score'],
+                    'created_at': result['created_at']
+                }
+                for result in results
+            ],
+            'next_cursor': (results[-1]['created_at'], results[-1]['result_id']) if has_next else None
+        }
+
+    async def get_taker_stats(self, taker_id, bot_id=None):
+        """Get the running totals of every pass a friend made, with one bot only if bot_id is given."""
+        passes = score_sum = 0
+        for (stats_taker_id, stats_bot_id), stats in self.taker_stats.items():
+            if stats_taker_id == taker_id and bot_id in (None, stats_bot_id):
+                passes += stats[0]
+                score_sum += stats[1]
+        if not passes:
+            return None
+        return {
+            'passes': passes,
+            'score_sum': score_sum,
+            'average_score': round(score_sum / passes)
+        }
+
+    async def get_taken_tests_page(self, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """Get one page of the tests a friend took, with one bot only if bot_id is given, newest first."""
+        results = sorted(
+            (
+                result for result in self.results
+                if result['taker_id'] == taker_id and bot_id in (None, self.tests[result['test_id']]['bot_id'])
+            ),
+            key=lambda result: (result['created_at'], result['result_id']),
+            reverse=True
+        )
+        if cursor is not None:
+            results = [result for result in results if (result['created_at'], result['result_id']) < tuple(cursor)]
+
+        has_next = len(results) > limit
+        results = results[:limit]
+
+        rows = []
+        for result in results:
+            creator_id = self.tests[result['test_id']]['user_id']
+            creator = self.users.get(creator_id, {})
+            rows.append({
+                'result_id': result['result_id'],
+                'test_id': result['test_id'],
+                'score': result['score'],
+                'created_at': result['created_at'],
+                'creator_id': creator_id,
+                'creator_username': creator.get('username'),
+                'creator_first_name': creator.get('first_name')
+            })
+
+        return {
+            'results': rows,
+            'next_cursor': (results[-1]['created_at'], results[-1]['result_id']) if has_next else None
+        }
+
+    async def get_top_friends(self, limit=10, bot_id=None):
+        """Get top friends with highest average scores over every pass, with one bot only if bot_id is given."""
+        totals = {}
+        for (taker_id, stats_bot_id), (passes, score_sum, username) in self.taker_stats.items():
+            if bot_id not in (None, stats_bot_id):
+                continue
+            total = totals.setdefault(taker_id, [0, 0, username])
+            total[0] += score_sum
+            total[1] += passes
+
+        ranked = sorted(
+            (total for total in totals.values() if total[1]),
+            key=lambda total: total[0] / total[1],
+            reverse=True
+        )
+
+        return [
+            {
+                'username': username,
+                'average_score': round(score_sum / passes_count),
+                'passes_count': passes_count
+            }
+            for score_sum, passes_count, username in ranked[:limit]
+        ]
+
+    async def get_question_statistics(self, bot_id=None):
+        """Get answer distributions for every question, with one bot only if bot_id is given."""
+        totals = Counter()
+        for (counter_bot_id, question_id, option_index, role), count in self.answer_counters.items():
+            if bot_id in (None, counter_bot_id):
+                totals[(question_id, option_index, role)] += count
+
+        stats = {}
+        for (question_id, option_index, role), count in totals.items():
+            if count <= 0:
+                continue
+            roles = stats.setdefault(question_id, {'creator': {}, 'taker': {}, 'miss': {}})
+            roles[role][option_index] = count
+        return stats
+
+    async def get_score_rank(self, test_id, score):
+        """Get the rank of a score among all passes of a test."""
+        histogram = self.histograms.get(test_id, [0] * 101)
+        buckets = [(bucket_score, count) for bucket_score, count in enumerate(histogram) if count > 0]
+        return rank_from_histogram(buckets, score)
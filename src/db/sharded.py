@@ -0,0 +1,470 @@
+"""
+Sharded SQLite storage backend.
+
+Tests and their results are partitioned across several SQLite files by a
+stable hash of the test ID, so passes of unrelated tests are written by
+different connections instead of queueing behind one writer lock. Users
+live in one shared file that every shard attaches for its joins.
+
+Result IDs are only unique within a shard, so outgoing IDs are made global
+as local_id * shard_count + shard_index and translated back for cursors.
+"""
+import asyncio
+import heapq
+import os
+import zlib
+
+from src.consts import RETAKE_POLICY, SHARD_COUNT, SHARD_DIR, STATS_PAGE_SIZE
+from src.db.base import Storage, generate_test_id
+from src.db.database import Database
+
+USERS_FILE = "users.db"
+
+
+def shard_file(index):
+    """File name of a shard."""
+    return f"shard-{index:02d}.db"
+
+
+def shard_index(test_id, shard_count):
+    """Stable shard number of a test."""
+    return zlib.crc32(test_id.encode('utf-8')) % shard_count
+
+
+class ShardedDatabase(Storage):
+    """Storage backend spreading tests over several SQLite files."""
+
+    def __init__(self, shard_dir=SHARD_DIR, shard_count=SHARD_COUNT, retake_policy=RETAKE_POLICY):
+        """
+        Initialize the shard layout.
+
+        Args:
+            shard_dir: Directory with users.db and the shard files
+            shard_count: Number of shards
+            retake_policy: 'keep_all', 'keep_best' or 'keep_latest'
+        """
+        if shard_count < 1:
+            raise ValueError("At least one shard is needed")
+
+        self.shard_dir = shard_dir
+        self.shard_count = shard_count
+        users_path = os.path.join(shard_dir, USERS_FILE)
+        # Only the users table of this file is used
+        self.users_db = Database(users_path, retake_policy)
+        self.shards = [
+            Database(os.path.join(shard_dir, shard_file(index)), retake_policy, users_db_name=users_path)
+            for index in range(shard_count)
+        ]
+
+    @property
+    def retake_policy(self):
+        """Retake policy every shard is opened with."""
+        return self.users_db.retake_policy
+
+    @property
+    def databases(self):
+        """Every underlying SQLite database, users file first."""
+        return [self.users_db] + self.shards
+
+    def _shard(self, test_id):
+        """(index, shard) holding a test."""
+        index = shard_index(test_id, self.shard_count)
+        return index, self.shards[index]
+
+    def _global_id(self, index, result_id):
+        """Globally unique result ID from a shard-local one."""
+        return result_id * self.shard_count + index
+
+    def _local_bound(self, index, global_id):
+        """Smallest local ID of a shard whose global ID is not below global_id."""
+        return -((index - global_id) // self.shard_count)
+
+    async def _gather(self, method_name, *args):
+        """Call a method on every shard concurrently."""
+        return await asyncio.gather(*(getattr(shard, method_name)(*args) for shard in self.shards))
+
+    async def connect(self):
+        """Open the users file and every shard."""
+        os.makedirs(self.shard_dir, exist_ok=True)
+        # The users file must exist before the shards attach it
+        await self.users_db.connect()
+        await asyncio.gather(*(shard.connect() for shard in self.shards))
+
+    async def close(self):
+        """Close every connection."""
+        await asyncio.gather(*(database.close() for database in self.databases))
+
+    async def check_retake_policy(self):
+        """Check the retake index of every shard."""
+        await self._gather('check_retake_policy')
+
+    async def apply_retake_policy(self):
+        """Migrate the retake index of every shard."""
+        await self._gather('apply_retake_policy')
+
+    async def add_user(self, user_id, username, first_name, last_name):
+        """Add or update user in the shared users file."""
+        await self.users_db.add_user(user_id, username, first_name, last_name)
+
+    async def add_question_set(self, set_hash, questions, user_id):
+        """Store a question set in the shared users file."""
+        await self.users_db.add_question_set(set_hash, questions, user_id)
+
+    async def get_question_set(self, set_hash):
+        """Get the questions of a stored set, or None."""
+        return await self.users_db.get_question_set(set_hash)
+
+    async def add_bank_version(self, set_hash, questions):
+        """Store a version of the global bank in the shared users file."""
+        await self.users_db.add_bank_version(set_hash, questions)
+
+    async def get_bank_versions(self):
+        """Get the content hashes of all stored bank versions."""
+        return await self.users_db.get_bank_versions()
+
+    async def get_referenced_bank_versions(self):
+        """Union of the content hashes tests use on every shard."""
+        return set().union(*await self._gather('get_referenced_bank_versions'))
+
+    async def pin_unversioned_tests(self, set_hash):
+        """Pin unversioned tests on every shard."""
+        return sum(await self._gather('pin_unversioned_tests', set_hash))
+
+    async def assign_unowned_tests(self, bot_id):
+        """Assign unowned tests on every shard to a bot."""
+        return sum(await self._gather('assign_unowned_tests', bot_id))
+
+    async def delete_bank_versions(self, set_hashes):
+        """Delete bank versions from the shared users file, keeping sets shard tests use as uploads."""
+        uploaded = set().union(*await self._gather('get_uploaded_question_sets'))
+        await self.users_db.delete_bank_versions(set_hashes, uploaded_elsewhere=uploaded)
+
+    async def create_test(self, user_id, answers, question_set=None, bank_version=None, bot_id=None):
+        """Create a new test on the shard its ID hashes to."""
+        test_id = generate_test_id()
+        _, shard = self._shard(test_id)
+        return await shard.create_test(user_id, answers, question_set, bank_version, bot_id, test_id=test_id)
+
+    async def get_test(self, test_id):
+        """Get test details by test_id."""
+        _, shard = self._shard(test_id)
+        return await shard.get_test(test_id)
+
+    async def save_test_result(self, test_id, taker_id, taker_username, answers):
+        """Save the results of a test on its shard."""
+        _, shard = self._shard(test_id)
+        return await shard.save_test_result(test_id, taker_id, taker_username, answers)
+
+    async def update_test_answers(self, test_id, answers):
+        """Replace the creator's answers and rescore the results on the test's shard."""
+        _, shard = self._shard(test_id)
+        return await shard.update_test_answers(test_id, answers)
+
+    async def resume_rescores(self):
+        """Finish cut short rescores on every shard."""
+        return sum(await self._gather('resume_rescores'))
+
+    async def get_user_tests(self, user_id, bot_id=None):
+        """Get all tests created by a user from every shard, newest first."""
+        per_shard = await self._gather('get_user_tests', user_id, bot_id)
+        return sorted((row for rows in per_shard for row in rows), key=lambda row: row[1], reverse=True)
+
+    async def get_test_statistics(self, user_id, bot_id=None):
+        """Merge the per-shard statistics of a creator's tests."""
+        per_shard = [stats for stats in await self._gather('get_test_statistics', user_id, bot_id) if stats]
+        if not per_shard:
+            return None
+
+        tests = sorted(
+            (test for stats in per_shard for test in stats['tests']),
+            key=lambda test: (test['created_at'], test['test_id']),
+            reverse=True
+        )
+        total_passes = sum(test['passes_count'] for test in tests)
+        total_score = sum(test['score_sum'] for test in tests)
+
+        # Each shard already kept its own top 5, the overall top 5 is among them
+        best_friends = [friend for stats in per_shard for friend in stats['best_friends']]
+        worst_friends = [friend for stats in per_shard for friend in stats['worst_friends']]
+
+        return {
+            'tests_count': len(tests),
+            'total_passes': total_passes,
+            'average_score': round(total_score / total_passes) if total_passes else 0,
+            'best_friends': sorted(best_friends, key=lambda x: x['score'], reverse=True)[:5],
+            'worst_friends': sorted(worst_friends, key=lambda x: x['score'])[:5],
+            'tests': tests
+        }
+
+    async def get_test_summaries_page(self, user_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """Merge one page of a creator's tests from every shard."""
+        # Test IDs are global, so the cursor applies to every shard as is
+        pages = await self._gather('get_test_summaries_page', user_id, cursor, limit, bot_id)
+
+        tests = [test for page in pages for test in page['tests']]
+        has_next = len(tests) > limit or any(page['next_cursor'] for page in pages)
+        merged = heapq.nlargest(limit, tests, key=lambda test: (test['created_at'], test['test_id']))
+
+        return {
+            'tests': merged,
+            'next_cursor': (merged[-1]['created_at'], merged[-1]['test_id']) if has_next else None
+        }
+
+    async def get_test_results_page(self, test_id, cursor=None, limit=STATS_PAGE_SIZE):
+        """Get one page of passes of a test from its shard."""
+        index, shard = self._shard(test_id)
+        if cursor is not None:
+            cursor = (cursor[0], self._local_bound(index, cursor[1]))
+
+        page = await shard.get_test_results_page(test_id, cursor, limit)
+        for result in page['results']:
+            result['result_id'] = self._global_id(index, result['result_id'])
+        if page['next_cursor']:
+            page['next_cursor'] = (page['next_cursor'][0], self._global_id(index, page['next_cursor'][1]))
+        return page
+
+    async def get_friend_history_page(self, creator_id, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """Merge one page of a friend's history from every shard."""
+        pages = await asyncio.gather(*(
+            shard.get_friend_history_page(
+                creator_id,
+                taker_id,
+                (cursor[0], self._local_bound(index, cursor[1])) if cursor is not None else None,
+                limit,
+                bot_id
+            )
+            for index, shard in enumerate(self.shards)
+        ))
+
+        rows = []
+        for index, page in enumerate(pages):
+            for result in page['results']:
+                result['result_id'] = self._global_id(index, result['result_id'])
+                rows.append(result)
+
+        # Every shard returned its first `limit` rows, so the merged first
+        # `limit` rows are exact
+        has_next = len(rows) > limit or any(page['next_cursor'] for page in pages)
+        merged = heapq.nlargest(limit, rows, key=lambda result: (result['created_at'], result['result_id']))
+
+        return {
+            'results': merged,
+            'next_cursor': (merged[-1]['created_at'], merged[-1]['result_id']) if has_next else None
+        }
+
+    async def get_taker_stats(self, taker_id, bot_id=None):
+        """Sum a friend's running totals over every shard."""
+        passes = 0
+        score_sum = 0
+        for stats in await self._gather('get_taker_stats', taker_id, bot_id):
+            if stats:
+                passes += stats['passes']
+                score_sum += stats['score_sum']
+        if not passes:
+            return None
+        return {
+            'passes': passes,
+            'score_sum': score_sum,
+            'average_score': round(score_sum / passes)
+        }
+
+    async def get_taken_tests_page(self, taker_id, cursor=None, limit=STATS_PAGE_SIZE, bot_id=None):
+        """Merge one page of the tests a friend took from every shard."""
+        pages = await asyncio.gather(*(
+            shard.get_taken_tests_page(
+                taker_id,
+                (cursor[0], self._local_bound(index, cursor[1])) if cursor is not None else None,
+                limit,
+                bot_id
+            )
+            for index, shard in enumerate(self.shards)
+        ))
+
+        rows = []
+        for index, page in enumerate(pages):
+            for result in page['results']:
+                result['result_id'] = self._global_id(index, result['result_id'])
+                rows.append(result)
+
+        has_next = len(rows) > limit or any(page['next_cursor'] for page in pages)
+        merged = heapq.nlargest(limit, rows, key=lambda result: (result['created_at'], result['result_id']))
+
+        return {
+            'results': merged,
+            'next_cursor': (merged[-1]['created_at'], merged[-1]['result_id']) if has_next else None
+        }
+
+    async def get_top_friends(self, limit=10, bot_id=None):
+        """Merge the per-friend totals of every shard into the top list."""
+        totals = {}
+        for rows in await self._gather('get_taker_totals', bot_id):
+            for taker_id, username, score_sum, passes_count in rows:
+                total = totals.setdefault(taker_id, [username, 0, 0])
+                total[1] += score_sum
+                total[2] += passes_count
+
+        ranked = sorted(
+            (total for total in totals.values() if total[2]),
+            key=lambda item: item[1] / item[2],
+            reverse=True
+        )
+
+        return [
+            {
+                'username': username,
+                'average_score': round(score_sum / passes_count),
+                'passes_count': passes_count
+            }
+            for username, score_sum, passes_count in ranked[:limit]
+        ]
+
+    async def get_question_statistics(self, bot_id=None):
+        """Sum the answer counters of every shard."""
+        merged = {}
+        for stats in await self._gather('get_question_statistics', bot_id):
+            for question_id, roles in stats.items():
+                merged_roles = merged.setdefault(question_id, {'creator': {}, 'taker': {}, 'miss': {}})
+                for role, options in roles.items():
+                    for option_index, count in options.items():
+                        merged_roles[role][option_index] = merged_roles[role].get(option_index, 0) + count
+        return merged
+
+    async def get_score_rank(self, test_id, score):
+        """Get the rank of a score from the test's shard."""
+        _, shard = self._shard(test_id)
+        return await shard.get_score_rank(test_id, score)
+
+
+def _source_databases(source):
+    """The SQLite databases holding tests and results of a layout."""
+    return source.shards if isinstance(source, ShardedDatabase) else [source]
+
+
+async def reshard(source, target, chunk_size=1000):
+    """
+    Copy all data from one layout into a new, empty sharded layout.
+
+    Rows are streamed in chunks; derived counters and histograms are rebuilt
+    on every target shard afterwards.
+
+    Args:
+        source: Connected Database or ShardedDatabase to read
+        target: Connected, empty ShardedDatabase to fill
+        chunk_size: Number of rows copied at a time
+
+    Returns:
+        dict: Number of users, tests and results copied
+
+    Raises:
+        RuntimeError: The source has repeated passes the target's retake policy does not keep
+    """
+    # The unique (test_id, taker_id) index of the target would reject the
+    # second pass of a retake halfway through the copy; refuse up front
+    if target.retake_policy != 'keep_all':
+        for database in _source_databases(source):
+            async with database.conn.execute(
+                'SELECT 1 FROM test_results GROUP BY test_id, taker_id HAVING COUNT(*) > 1 LIMIT 1'
+            ) as cursor:
+                if await cursor.fetchone() is not None:
+                    raise RuntimeError(
+                        f"{database.db_name} has repeated passes of the same test; run "
+                        f"'python -m src.cli dedup-results --policy {target.retake_policy}' on it "
+                        f"before resharding with the {target.retake_policy} retake policy"
+                    )
+
+    copied = {'users': 0, 'tests': 0, 'results': 0}
+    users_source = source.users_db if isinstance(source, ShardedDatabase) else source
+
+    async with users_source.conn.execute(
+        'SELECT user_id, username, first_name, last_name, created_at FROM users'
+    ) as cursor:
+        while rows := await cursor.fetchmany(chunk_size):
+            await target.users_db.conn.executemany('''
+            INSERT OR REPLACE INTO users (user_id, username, first_name, last_name, created_at)
+            VALUES (?, ?, ?, ?, ?)
+            ''', rows)
+            copied['users'] += len(rows)
+
+    async with users_source.conn.execute(
+        'SELECT set_hash, questions, user_id, created_at FROM question_sets'
+    ) as cursor:
+        while rows := await cursor.fetchmany(chunk_size):
+            await target.users_db.conn.executemany('''
+            INSERT OR IGNORE INTO question_sets (set_hash, questions, user_id, created_at)
+            VALUES (?, ?, ?, ?)
+            ''', rows)
+
+    async with users_source.conn.execute('SELECT set_hash, loaded_at FROM bank_versions') as cursor:
+        await target.users_db.conn.executemany(
+            'INSERT OR IGNORE INTO bank_versions (set_hash, loaded_at) VALUES (?, ?)',
+            await cursor.fetchall()
+        )
+    await target.users_db.conn.commit()
+
+    # Rows of these tables are keyed by test and follow it to its new shard
+    per_test_tables = {
+        'tests': ('test_id', 'user_id', 'answers', 'question_set', 'bank_version', 'bot_id', 'created_at'),
+        'test_results': (
+            'test_id', 'taker_id', 'taker_username', 'score', 'answers',
+            'created_at', 'attempts', 'attempts_score_sum'
+        ),
+        'test_rollups': ('test_id', 'passes', 'score_sum'),
+        'score_histogram_rollups': ('test_id', 'score', 'count'),
+    }
+    # Rows of these tables are summed when read, so they all go to shard 0:
+    # table -> (columns, conflict key, update on conflict)
+    global_tables = {
+        'taker_stats': (
+            ('taker_id', 'bot_id', 'taker_username', 'passes', 'score_sum'),
+            'taker_id, bot_id',
+            'taker_username = excluded.taker_username, passes = passes + excluded.passes, '
+            'score_sum = score_sum + excluded.score_sum'
+        ),
+        'taker_rollups': (
+            ('taker_id', 'bot_id', 'taker_username', 'passes', 'score_sum'),
+            'taker_id, bot_id',
+            'taker_username = excluded.taker_username, passes = passes + excluded.passes, '
+            'score_sum = score_sum + excluded.score_sum'
+        ),
+        'retired_answer_counters': (
+            ('bot_id', 'question_id', 'option_index', 'role', 'count'),
+            'bot_id, question_id, option_index, role',
+            'count = count + excluded.count'
+        ),
+    }
+
+    for database in _source_databases(source):
+        for table, columns in per_test_tables.items():
+            column_list = ", ".join(columns)
+            placeholders = ", ".join("?" for _ in columns)
+            order = ' ORDER BY result_id' if table == 'test_results' else ''
+            async with database.conn.execute(f'SELECT {column_list} FROM {table}{order}') as cursor:
+                while rows := await cursor.fetchmany(chunk_size):
+                    by_shard = {}
+                    for row in rows:
+                        by_shard.setdefault(shard_index(row[0], target.shard_count), []).append(row)
+                    for index, shard_rows in by_shard.items():
+                        await target.shards[index].conn.executemany(
+                            f'INSERT INTO {table} ({column_list}) VALUES ({placeholders})', shard_rows
+                        )
+                    if table == 'tests':
+                        copied['tests'] += len(rows)
+                    elif table == 'test_results':
+                        copied['results'] += len(rows)
+
+        for table, (columns, key_columns, updates) in global_tables.items():
+            column_list = ", ".join(columns)
+            placeholders = ", ".join("?" for _ in columns)
+            async with database.conn.execute(f'SELECT {column_list} FROM {table}') as cursor:
+                while rows := await cursor.fetchmany(chunk_size):
+                    await target.shards[0].conn.executemany(f'''
+                    INSERT INTO {table} ({column_list}) VALUES ({placeholders})
+                    ON CONFLICT ({key_columns}) DO UPDATE SET {updates}
+                    ''', rows)
+
+    for shard in target.shards:
+        await shard.conn.commit()
+        await shard.rebuild_answer_counters(chunk_size)
+        await shard.rebuild_score_histograms()
+
+    return copied
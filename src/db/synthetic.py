@@ -0,0 +1,146 @@
+"""
+Synthetic dataset generator for benchmarks.
+
+Bulk-loads realistic users, tests and results into a scratch database:
+test popularity follows a power law, every friend has a skill level that
+drives how many answers they get right, and timestamps are spread over
+the last year.
+"""
+import json
+import random
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+
+from src.db.base import answer_counter_rows, generate_test_id, score_answers
+
+FIRST_NAMES = ["Аня", "Борис", "Вера", "Глеб", "Даша", "Егор", "Женя", "Зоя", "Иван", "Катя"]
+
+
+def _random_timestamp(rng, now, days=365):
+    """Random timestamp within the last `days` days in SQLite's format."""
+    moment = now - timedelta(seconds=rng.randrange(days * 24 * 3600))
+    return moment.strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _passes_per_test(rng, tests_count, results_count, max_passes):
+    """Split results between tests so that a few tests are very popular."""
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(tests_count)]
+    rng.shuffle(weights)
+    total_weight = sum(weights)
+
+    passes = [min(max_passes, int(results_count * weight / total_weight)) for weight in weights]
+    # Hand out what rounding and the cap left over
+    remainder = results_count - sum(passes)
+    while remainder > 0:
+        index = rng.randrange(tests_count)
+        if passes[index] < max_passes:
+            passes[index] += 1
+            remainder -= 1
+    return passes
+
+
+async def generate_dataset(database, questions, users_count, results_count, tests_count=None,
+                           seed=0, chunk_size=10000, bot_id=None):
+    """
+    Bulk-load a synthetic dataset into an empty, connected SQLite backend.
+
+    Args:
+        database: Connected Database on a scratch file
+        questions: Question bank (list of dicts with id and options)
+        users_count: Number of users
+        results_count: Number of test results
+        tests_count: Number of tests, one per 20 results by default
+        seed: Random seed for reproducible datasets
+        chunk_size: Rows inserted per executemany call
+        bot_id: Bot every test belongs to, no bot if None
+
+    Returns:
+        dict: Number of users, tests and results written
+    """
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    tests_count = tests_count or max(1, results_count // 20)
+    if users_count < 2:
+        raise ValueError("At least two users are needed")
+    if tests_count > users_count:
+        raise ValueError("Every test needs its own creator")
+
+    conn = database.conn
+
+    # Users
+    users = [
+        (user_id, f"user{user_id}", rng.choice(FIRST_NAMES), "", _random_timestamp(rng, now))
+        for user_id in range(1, users_count + 1)
+    ]
+    for start in range(0, len(users), chunk_size):
+        await conn.executemany('''
+        INSERT INTO users (user_id, username, first_name, last_name, created_at)
+        VALUES (?, ?, ?, ?, ?)
+        ''', users[start:start + chunk_size])
+
+    # Tests, each created by a different user
+    counters = Counter()
+    tests = []
+    for creator_id in rng.sample(range(1, users_count + 1), tests_count):
+        answers = {str(question['id']): rng.randrange(len(question['options'])) for question in questions}
+        tests.append((generate_test_id(), creator_id, answers, _random_timestamp(rng, now)))
+        for question_id, option_index, role, delta in answer_counter_rows(answers):
+            counters[(question_id, option_index, role)] += delta
+    await conn.executemany('''
+    INSERT OR IGNORE INTO tests (test_id, user_id, answers, created_at, bot_id)
+    VALUES (?, ?, ?, ?, ?)
+    ''', [
+        (test_id, creator_id, json.dumps(answers), created_at, bot_id)
+        for test_id, creator_id, answers, created_at in tests
+    ])
+
+    # Results, at most one per friend and test so any retake policy accepts them
+    skills = [rng.uniform(0.1, 0.9) for _ in range(users_count + 1)]
+    passes = _passes_per_test(rng, tests_count, results_count, users_count - 1)
+    batch = []
+    written = 0
+    for (test_id, creator_id, original_answers, created_at), test_passes in zip(tests, passes):
+        takers = rng.sample(range(1, users_count + 1), min(test_passes + 1, users_count))
+        takers = [taker_id for taker_id in takers if taker_id != creator_id][:test_passes]
+        for taker_id in takers:
+            answers = {}
+            for question in questions:
+                q_id = str(question['id'])
+                if rng.random() < skills[taker_id]:
+                    answers[q_id] = original_answers[q_id]
+                else:
+                    answers[q_id] = rng.randrange(len(question['options']))
+            score = score_answers(original_answers, answers)
+            for question_id, option_index, role, delta in answer_counter_rows(original_answers, answers):
+                counters[(question_id, option_index, role)] += delta
+            batch.append((
+                test_id, taker_id, f"user{taker_id}", score, json.dumps(answers),
+                max(created_at, _random_timestamp(rng, now)), score
+            ))
+
+            if len(batch) >= chunk_size:
+                await _insert_results(conn, batch)
+                written += len(batch)
+                batch = []
+    if batch:
+        await _insert_results(conn, batch)
+        written += len(batch)
+
+    await database._increment_answer_counters(
+        [key + (count,) for key, count in counters.items()], bot_id
+    )
+    await conn.commit()
+
+    # Histograms and taker totals are derived from the rows in a single statement each
+    await database.rebuild_score_histograms()
+    await database.rebuild_taker_stats()
+
+    return {'users': users_count, 'tests': tests_count, 'results': written}
+
+
+async def _insert_results(conn, rows):
+    """Insert one chunk of results."""
+    await conn.executemany('''
+    INSERT INTO test_results (test_id, taker_id, taker_username, score, answers, created_at, attempts_score_sum)
+    VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
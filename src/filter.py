@@ -0,0 +1,14 @@
+"""
+Custom filters for the bot.
+"""
+from aiogram.filters import BaseFilter
+from aiogram.types import Message
+
+from src.consts import ADMIN_IDS
+
+
+class IsAdmin(BaseFilter):
+    """Pass only messages from users listed in ADMIN_IDS."""
+
+    async def __call__(self, message: Message) -> bool:
+        return message.from_user is not None and message.from_user.id in ADMIN_IDS
@@ -0,0 +1,133 @@
+"""
+Checks of the handlers, run through the real dispatcher.
+
+Updates are fed the way Telegram delivers them, including taps that race,
+against a scratch database with the replay's fake Bot API in place of
+Telegram. The fake API and the FSM storage answer after a short delay,
+so every call gives the other update a chance to run, as a round trip to
+Telegram or to a shared FSM storage such as Redis would.
+"""
+import asyncio
+import datetime
+import itertools
+import tempfile
+
+from aiogram import Bot
+from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.types import CallbackQuery, Chat, Message, Update, User
+
+from src.bootstrap import bootstrap
+from src.db import db
+from src.db.conformance import ConformanceError, expect
+from src.main import create_dispatcher
+from src.questions import current_bank
+from src.replay import ReplaySession, use_scratch_storage
+
+BOT_ID = 101
+USER_ID = 1
+# Seconds each fake Bot API call and FSM storage call takes
+API_LATENCY = 0.01
+
+HANDLER_CHECKS = []
+
+_update_ids = itertools.count(1)
+
+
+class SlowStorage(MemoryStorage):
+    """In-memory FSM storage that answers after API_LATENCY seconds."""
+
+    async def set_state(self, key, state=None):
+        """Store the state after a delay."""
+        await asyncio.sleep(API_LATENCY)
+        await super().set_state(key, state)
+
+    async def get_state(self, key):
+        """Read the state after a delay."""
+        await asyncio.sleep(API_LATENCY)
+        return await super().get_state(key)
+
+    async def set_data(self, key, data):
+        """Store the data after a delay."""
+        await asyncio.sleep(API_LATENCY)
+        await super().set_data(key, data)
+
+    async def get_data(self, key):
+        """Read the data after a delay."""
+        await asyncio.sleep(API_LATENCY)
+        return await super().get_data(key)
+
+
+def handler_check(func):
+    """Register a handler check."""
+    HANDLER_CHECKS.append(func)
+    return func
+
+
+def callback_update(data, user_id=USER_ID, message_id=1):
+    """
+    Build a button tap update.
+
+    Args:
+        data: Callback data of the button
+        user_id: User who taps it, in their private chat
+        message_id: Message the button belongs to
+
+    Returns:
+        Update: Update carrying the callback query
+    """
+    user = User(id=user_id, is_bot=False, first_name="Check")
+    message = Message(
+        message_id=message_id,
+        date=datetime.datetime.now(),
+        chat=Chat(id=user_id, type="private"),
+        text="question"
+    )
+    update_id = next(_update_ids)
+    return Update(
+        update_id=update_id,
+        callback_query=CallbackQuery(
+            id=str(update_id), from_user=user, chat_instance=str(user_id), message=message, data=data
+        )
+    )
+
+
+@handler_check
+async def check_concurrent_final_answers(dp, bot):
+    """Two taps on the last question at once create one test."""
+    await dp.feed_update(bot, callback_update("create_test"))
+    for _ in range(len(current_bank()) - 1):
+        await dp.feed_update(bot, callback_update("answer_0"))
+
+    await asyncio.gather(
+        dp.feed_update(bot, callback_update("answer_0")),
+        dp.feed_update(bot, callback_update("answer_1"))
+    )
+
+    tests = await db.get_user_tests(USER_ID)
+    expect(len(tests) == 1, tests)
+
+
+async def run_handler_checks(directory=None):
+    """
+    Run every handler check against a fresh scratch storage.
+
+    Args:
+        directory: Directory for the scratch database
+
+    Returns:
+        list: (check name, error message or None) per check
+    """
+    results = []
+    for check_func in HANDLER_CHECKS:
+        bot = Bot(token=f"{BOT_ID}:check", session=ReplaySession(API_LATENCY))
+        with tempfile.TemporaryDirectory(dir=directory) as scratch:
+            use_scratch_storage(scratch)
+            await bootstrap([bot], snapshot_path=None)
+            try:
+                await check_func(create_dispatcher(SlowStorage()), bot)
+                results.append((check_func.__name__, None))
+            except ConformanceError as error:
+                results.append((check_func.__name__, str(error)))
+            finally:
+                await db.close()
+    return results
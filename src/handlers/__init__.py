@@ -1,6 +1,6 @@
 """
 Handlers package initialization.
 """
-from src.handlers import command_handlers, test_creation, test_taking
+from src.handlers import admin, command_handlers, sharing, test_creation, test_taking
 
-__all__ = ["command_handlers", "test_creation", "test_taking"]
+__all__ = ["admin", "command_handlers", "sharing", "test_creation", "test_taking"]
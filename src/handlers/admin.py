@@ -0,0 +1,77 @@
+"""
+Admin-only command handlers.
+"""
+import logging
+import os
+from aiogram import Router, types
+from aiogram.filters import Command
+
+from src import texts
+from src.db.backup import BackupUnsupportedError, create_backup
+from src.filter import IsAdmin
+from src.questions import QuestionSetError, collect_bank_versions, reload_bank
+
+# Initialize router
+router = Router()
+router.message.filter(IsAdmin())
+logger = logging.getLogger(__name__)
+
+
+@router.message(Command("backup"))
+async def cmd_backup(message: types.Message):
+    """
+    Handle the /backup command.
+    Take an online snapshot of the database and report its timings.
+
+    Args:
+        message: Message from an admin
+    """
+    await message.answer(texts.BACKUP_STARTED)
+
+    try:
+        report = await create_backup()
+    except BackupUnsupportedError as e:
+        logger.warning("Backup requested by %s refused: %s", message.from_user.id, e)
+        await message.answer(texts.BACKUP_UNSUPPORTED)
+        return
+    except Exception:
+        logger.exception("Backup requested by %s failed", message.from_user.id)
+        await message.answer(texts.BACKUP_FAILED)
+        return
+
+    await message.answer(texts.BACKUP_DONE.format(
+        name=os.path.basename(report['path']),
+        size_kb=round(report['size'] / 1024),
+        duration=round(report['duration'], 2),
+        steps=report['steps'],
+        max_step_lock=round(report['max_step_lock'] * 1000, 1),
+        rotated=len(report['rotated'])
+    ))
+
+
+@router.message(Command("reload"))
+async def cmd_reload(message: types.Message):
+    """
+    Handle the /reload command.
+    Reload the global question bank from disk without a restart.
+
+    Args:
+        message: Message from an admin
+    """
+    try:
+        bank = await reload_bank()
+    except (OSError, QuestionSetError) as e:
+        logger.warning("Bank reload requested by %s failed: %s", message.from_user.id, e)
+        await message.answer(texts.BANK_RELOAD_FAILED.format(error=e))
+        return
+
+    if bank is None:
+        await message.answer(texts.BANK_UNCHANGED)
+        return
+
+    deleted = await collect_bank_versions()
+    await message.answer(texts.BANK_RELOADED.format(
+        version=bank.set_hash[:12],
+        count=len(bank),
+        deleted=len(deleted)
+    ))
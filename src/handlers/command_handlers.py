@@ -7,10 +7,23 @@ from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 
 from src import texts
-from src.keyboards import get_start_test_keyboard
-from src.db.database import db
+from src.keyboards import (
+    StatsOverviewCallback,
+    StatsTestPageCallback,
+    StatsFriendPageCallback,
+    MyStatsPageCallback,
+    decode_cursor_time,
+    get_start_test_keyboard,
+    get_stats_overview_keyboard,
+    get_test_page_keyboard,
+    get_friend_page_keyboard,
+    get_taken_tests_keyboard
+)
+from src.db import db
+from src.identity import serves_test
 from src.states import TestStates
 from src.handlers.test_taking import send_next_question
+from src.questions import current_bank
 
 # Initialize router
 router = Router()
@@ -42,7 +55,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
         test_id = args[0]
         test_info = await db.get_test(test_id)
 
-        if not test_info:
+        # A test link only works in the bot the test was created with
+        if not test_info or not serves_test(message.bot, test_info):
             await message.answer(texts.TEST_NOT_FOUND)
             return
 
@@ -57,6 +71,8 @@ async def cmd_start(message: types.Message, state: FSMContext):
         await state.update_data(
             test_id=test_id,
             creator_id=test_info['user_id'],
+            question_set=test_info['question_set'],
+            bank_version=test_info['bank_version'],
             current_question=0,
             answers={}
         )
@@ -85,11 +101,13 @@ async def cmd_help(message: types.Message):
 Команды:
 /start - Начать работу с ботом
 /stats - Показать статистику ваших тестов
+/mystats - Показать, как хорошо вы знаете друзей
 /top - Показать топ друзей по всем тестам
+/qstats - Показать, как отвечают на вопросы
 /help - Показать эту справку
 
 Как пользоваться:
-1. Нажмите на кнопку "Создать тест о себе"
+1. Нажмите на кнопку "Создать тест о себе" или загрузите свои вопросы json-файлом
 2. Ответьте на вопросы о себе
 3. Получите ссылку и поделитесь ею с друзьями
 4. Друзья пройдут тест и узнают, насколько хорошо они вас знают
@@ -110,65 +128,171 @@ async def cmd_stats(message: types.Message):
     """
     user_id = message.from_user.id
 
-    # Get test statistics for the user
-    stats = await db.get_test_statistics(user_id)
+    # Get test statistics for the user's tests with this bot
+    stats = await db.get_test_statistics(user_id, bot_id=message.bot.id)
 
     if not stats or stats['tests_count'] == 0:
         # No tests created
         await message.answer(texts.STATS_NO_TESTS)
         return
 
-    # Format the message
-    tests_word = get_word_form(stats['tests_count'], ["тест", "теста", "тестов"])
+    page = await db.get_test_summaries_page(user_id, bot_id=message.bot.id)
 
-    overview = texts.STATS_OVERVIEW.format(
-        tests_count=stats['tests_count'],
-        tests_word=tests_word,
-        total_passes=stats['total_passes'],
-        average_score=stats['average_score']
+    await message.answer(
+        format_stats_overview(stats),
+        reply_markup=get_stats_overview_keyboard(page['tests'], page['next_cursor'])
     )
 
-    if stats['total_passes'] == 0:
-        # No passes yet
-        await message.answer(texts.STATS_HEADER + "\n" + overview + "\n" + texts.STATS_NO_PASSES)
+
+@router.callback_query(StatsOverviewCallback.filter())
+async def show_stats_overview(callback: types.CallbackQuery, callback_data: StatsOverviewCallback):
+    """
+    Show a page of the /stats overview: the first from the "Back" buttons,
+    later ones from "Next".
+
+    Args:
+        callback: Callback query from a "Back" or "Next" button
+        callback_data: The (created_at, test_id) cursor, empty for the first page
+    """
+    await callback.answer()
+
+    user_id = callback.from_user.id
+    stats = await db.get_test_statistics(user_id, bot_id=callback.bot.id)
+
+    if not stats or stats['tests_count'] == 0:
+        await callback.message.edit_text(texts.STATS_NO_TESTS)
         return
 
-    # Format best friends
-    best_friends_text = ""
-    if stats['best_friends']:
-        for i, friend in enumerate(stats['best_friends'][:5], 1):
-            best_friends_text += f"{i}. {friend['username']} - {friend['score']}%\n"
-    else:
-        best_friends_text = "Пока нет данных"
+    cursor = None
+    if callback_data.test_id is not None:
+        cursor = (decode_cursor_time(callback_data.created_at), callback_data.test_id)
 
-    # Format worst friends
-    worst_friends_text = ""
-    if stats['worst_friends']:
-        for i, friend in enumerate(stats['worst_friends'][:5], 1):
-            worst_friends_text += f"{i}. {friend['username']} - {friend['score']}%\n"
-    else:
-        worst_friends_text = "Пока нет данных"
+    page = await db.get_test_summaries_page(user_id, cursor, bot_id=callback.bot.id)
 
-    best_friends_section = texts.STATS_BEST_FRIENDS.format(best_friends=best_friends_text)
-    worst_friends_section = texts.STATS_WORST_FRIENDS.format(worst_friends=worst_friends_text)
+    await callback.message.edit_text(
+        format_stats_overview(stats),
+        reply_markup=get_stats_overview_keyboard(page['tests'], page['next_cursor'])
+    )
 
-    # Compile the full message
-    full_message = f"{texts.STATS_HEADER}\n{overview}\n{best_friends_section}\n{worst_friends_section}"
 
-    await message.answer(full_message)
+@router.callback_query(StatsTestPageCallback.filter())
+async def show_test_page(callback: types.CallbackQuery, callback_data: StatsTestPageCallback):
+    """
+    Show a page of passes of one of the user's tests.
+
+    Args:
+        callback: Callback query from a test or "Next" button
+        callback_data: Test ID and the (score, result_id) cursor
+    """
+    await callback.answer()
+
+    # Only the creator may browse the passes of a test, through the bot of the test
+    test_info = await db.get_test(callback_data.test_id)
+    if not test_info or test_info['user_id'] != callback.from_user.id or not serves_test(callback.bot, test_info):
+        await callback.message.edit_text(texts.TEST_NOT_FOUND)
+        return
+
+    cursor = None
+    if callback_data.result_id is not None:
+        cursor = (callback_data.score, callback_data.result_id)
+
+    page = await db.get_test_results_page(callback_data.test_id, cursor)
+
+    lines = [texts.STATS_TEST_PAGE_HEADER.format(test_id=callback_data.test_id), ""]
+    for result in page['results']:
+        lines.append(texts.STATS_PAGE_ENTRY.format(
+            username=result['username'],
+            score=result['score'],
+            created_at=result['created_at']
+        ))
+    if not page['results']:
+        lines.append(texts.STATS_PAGE_EMPTY)
+
+    await callback.message.edit_text(
+        "\n".join(lines),
+        reply_markup=get_test_page_keyboard(
+            callback_data.test_id, page['results'], page['next_cursor']
+        )
+    )
+
+
+@router.callback_query(StatsFriendPageCallback.filter())
+async def show_friend_page(callback: types.CallbackQuery, callback_data: StatsFriendPageCallback):
+    """
+    Show a page of a friend's passes of the user's tests.
+
+    Args:
+        callback: Callback query from a friend or "Next" button
+        callback_data: Friend ID and the (created_at, result_id) cursor
+    """
+    await callback.answer()
+
+    cursor = None
+    if callback_data.result_id is not None:
+        cursor = (decode_cursor_time(callback_data.created_at), callback_data.result_id)
+
+    # Only passes of tests this bot serves, like the other /stats pages
+    page = await db.get_friend_history_page(
+        callback.from_user.id, callback_data.taker_id, cursor, bot_id=callback.bot.id
+    )
+
+    username = page['results'][0]['username'] if page['results'] else str(callback_data.taker_id)
+    lines = [texts.STATS_FRIEND_PAGE_HEADER.format(username=username), ""]
+    for result in page['results']:
+        lines.append(texts.STATS_HISTORY_ENTRY.format(
+            test_id=result['test_id'],
+            score=result['score'],
+            created_at=result['created_at']
+        ))
+    if not page['results']:
+        lines.append(texts.STATS_PAGE_EMPTY)
+
+    await callback.message.edit_text(
+        "\n".join(lines),
+        reply_markup=get_friend_page_keyboard(callback_data.taker_id, page['next_cursor'])
+    )
+
+
+@router.message(Command("mystats"))
+async def cmd_my_stats(message: types.Message):
+    """
+    Handle the /mystats command.
+    Show how well the user knows the friends whose tests they took.
+
+    Args:
+        message: Message from the user
+    """
+    text, markup = await format_taken_tests_page(message.from_user.id, message.bot.id)
+    await message.answer(text, reply_markup=markup)
+
+
+@router.callback_query(MyStatsPageCallback.filter())
+async def show_taken_tests_page(callback: types.CallbackQuery, callback_data: MyStatsPageCallback):
+    """
+    Show the next page of /mystats.
+
+    Args:
+        callback: Callback query from the "Next" button
+        callback_data: The (created_at, result_id) cursor
+    """
+    await callback.answer()
+
+    cursor = (decode_cursor_time(callback_data.created_at), callback_data.result_id)
+    text, markup = await format_taken_tests_page(callback.from_user.id, callback.bot.id, cursor)
+    await callback.message.edit_text(text, reply_markup=markup)
 
 
 @router.message(Command("top"))
 async def cmd_top_friends(message: types.Message):
     """
     Handle the /top command.
-    Show top friends across all tests.
+    Show top friends across all tests of this bot.
 
     Args:
         message: Message from the user
     """
     # Get top friends
-    top_friends = await db.get_top_friends(10)
+    top_friends = await db.get_top_friends(10, bot_id=message.bot.id)
 
     if not top_friends:
         await message.answer(texts.TOP_FRIENDS_EMPTY)
@@ -190,6 +314,67 @@ async def cmd_top_friends(message: types.Message):
     await message.answer(top_text)
 
 
+@router.message(Command("qstats"))
+async def cmd_question_stats(message: types.Message):
+    """
+    Handle the /qstats command.
+    Show answer distributions and the questions friends miss most often.
+
+    Args:
+        message: Message from the user
+    """
+    question_stats = await db.get_question_statistics(bot_id=message.bot.id)
+
+    sections = []
+    misses = []
+    for index, question in enumerate(current_bank().questions, 1):
+        roles = question_stats.get(str(question['id']))
+        if not roles:
+            continue
+
+        # Distribution of the creators' own answers
+        creators_total = sum(roles['creator'].values())
+        if creators_total:
+            distribution = " · ".join(
+                texts.QSTATS_OPTION.format(
+                    option=option,
+                    percentage=round(roles['creator'].get(option_index, 0) * 100 / creators_total)
+                )
+                for option_index, option in enumerate(question['options'])
+            )
+            sections.append(texts.QSTATS_QUESTION.format(
+                index=index,
+                question=question['text'],
+                distribution=distribution
+            ))
+
+        guesses = sum(roles['taker'].values())
+        if guesses:
+            misses.append((sum(roles['miss'].values()), guesses, question['text']))
+
+    if not sections:
+        await message.answer(texts.QSTATS_EMPTY)
+        return
+
+    stats_text = texts.QSTATS_HEADER + "\n\n" + "\n\n".join(sections)
+
+    if misses:
+        misses.sort(key=lambda item: item[0] / item[1], reverse=True)
+        misses_text = "\n".join(
+            texts.QSTATS_MISSES_ENTRY.format(
+                index=i,
+                question=question_text,
+                percentage=round(missed * 100 / guesses),
+                misses=missed,
+                guesses=guesses
+            )
+            for i, (missed, guesses, question_text) in enumerate(misses[:5], 1)
+        )
+        stats_text += "\n\n" + texts.QSTATS_MISSES_HEADER + "\n" + misses_text
+
+    await message.answer(stats_text)
+
+
 @router.message(Command("cancel"))
 async def cmd_cancel(message: types.Message, state: FSMContext):
     """
@@ -209,6 +394,84 @@ async def cmd_cancel(message: types.Message, state: FSMContext):
     await message.answer("Действие отменено. Вы можете начать заново.")
 
 
+async def format_taken_tests_page(taker_id, bot_id, cursor=None):
+    """
+    Format a page of /mystats.
+
+    Args:
+        taker_id: ID of the user who took the tests
+        bot_id: Bot whose tests are listed
+        cursor: (created_at, result_id) of the last row of the previous page
+
+    Returns:
+        tuple: Message text and keyboard
+    """
+    stats = await db.get_taker_stats(taker_id, bot_id=bot_id)
+    if not stats:
+        return texts.MYSTATS_EMPTY, None
+
+    page = await db.get_taken_tests_page(taker_id, cursor, bot_id=bot_id)
+
+    lines = [texts.MYSTATS_HEADER.format(**stats), ""]
+    for result in page['results']:
+        creator = result['creator_first_name'] or result['creator_username'] or str(result['creator_id'])
+        lines.append(texts.MYSTATS_ENTRY.format(
+            creator=creator,
+            score=result['score'],
+            created_at=result['created_at']
+        ))
+    if not page['results']:
+        lines.append(texts.STATS_PAGE_EMPTY)
+
+    return "\n".join(lines), get_taken_tests_keyboard(page['next_cursor'])
+
+
+def format_stats_overview(stats):
+    """
+    Format the /stats overview message.
+
+    Args:
+        stats: Statistics from get_test_statistics
+
+    Returns:
+        str: The overview message
+    """
+    tests_word = get_word_form(stats['tests_count'], ["тест", "теста", "тестов"])
+
+    overview = texts.STATS_OVERVIEW.format(
+        tests_count=stats['tests_count'],
+        tests_word=tests_word,
+        total_passes=stats['total_passes'],
+        average_score=stats['average_score']
+    )
+
+    if stats['total_passes'] == 0:
+        # No passes yet
+        return texts.STATS_HEADER + "\n" + overview + "\n" + texts.STATS_NO_PASSES
+
+    # Format best friends
+    best_friends_text = ""
+    if stats['best_friends']:
+        for i, friend in enumerate(stats['best_friends'][:5], 1):
+            best_friends_text += f"{i}. {friend['username']} - {friend['score']}%\n"
+    else:
+        best_friends_text = "Пока нет данных"
+
+    # Format worst friends
+    worst_friends_text = ""
+    if stats['worst_friends']:
+        for i, friend in enumerate(stats['worst_friends'][:5], 1):
+            worst_friends_text += f"{i}. {friend['username']} - {friend['score']}%\n"
+    else:
+        worst_friends_text = "Пока нет данных"
+
+    best_friends_section = texts.STATS_BEST_FRIENDS.format(best_friends=best_friends_text)
+    worst_friends_section = texts.STATS_WORST_FRIENDS.format(worst_friends=worst_friends_text)
+
+    # Compile the full message
+    return f"{texts.STATS_HEADER}\n{overview}\n{best_friends_section}\n{worst_friends_section}"
+
+
 def get_word_form(number, forms):
     """
     Get the correct word form based on the number.
@@ -0,0 +1,48 @@
+"""
+Handlers for sharing tests through inline mode.
+"""
+import logging
+from aiogram import Router, types
+from aiogram.types import InlineQueryResultsButton
+
+from src import texts
+from src.consts import INLINE_CACHE_TIME, INLINE_RESULTS_LIMIT
+from src.share import get_share_cards
+
+# Initialize router
+router = Router()
+logger = logging.getLogger(__name__)
+
+
+@router.inline_query()
+async def share_tests(inline_query: types.InlineQuery):
+    """
+    Answer "@bot ..." with the user's tests as ready-to-send cards.
+
+    The query text narrows the cards down to test IDs starting with it;
+    long lists are paged through Telegram's offset.
+
+    Args:
+        inline_query: Inline query from any chat
+    """
+    cards = await get_share_cards(inline_query.bot, inline_query.from_user.id)
+
+    query = inline_query.query.strip()
+    if query:
+        cards = [card for card in cards if card.id.startswith(query)]
+
+    offset = int(inline_query.offset) if inline_query.offset.isdigit() else 0
+    page = cards[offset:offset + INLINE_RESULTS_LIMIT]
+    next_offset = offset + INLINE_RESULTS_LIMIT
+    button = None
+    if not cards:
+        button = InlineQueryResultsButton(text=texts.SHARE_NO_TESTS, start_parameter="create")
+
+    # Results differ per user, so Telegram must not share its cache between them
+    await inline_query.answer(
+        page,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=True,
+        next_offset=str(next_offset) if next_offset < len(cards) else "",
+        button=button
+    )
@@ -1,23 +1,54 @@
 """
 Handlers for test creation.
 """
-import json
+import asyncio
+import contextlib
 import logging
 from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 
 from src import texts
+from src.consts import QUESTION_SET_MAX_OPTIONS, QUESTION_SET_MAX_QUESTIONS, QUESTION_SET_MIN_OPTIONS
 from src.states import TestStates
-from src.keyboards import get_options_keyboard, get_share_keyboard
-from src.db.database import db
+from src.keyboards import StatsEditCallback, get_share_keyboard
+from src.db import db
+from src.identity import get_identity, serves_test
+from src.questions import (
+    QuestionSetError,
+    check_file_size,
+    current_bank,
+    get_question_set,
+    parse_question_file,
+    save_question_set
+)
+from src.share import add_share_card, make_test_link
 
 # Initialize router
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Load questions from JSON file
-with open('questions.json', 'r', encoding='utf-8') as f:
-    QUESTIONS = json.load(f)['questions']
+# (bot ID, user ID) -> [lock, number of holders and waiters]
+_answer_locks = {}
+
+
+@contextlib.asynccontextmanager
+async def _answer_lock(bot_id, user_id):
+    """
+    Serialize one user's answer taps.
+
+    Two taps on the last question may both read the state before either
+    stores the answer, and would both create or rescore the test.
+    """
+    key = (bot_id, user_id)
+    entry = _answer_locks.setdefault(key, [asyncio.Lock(), 0])
+    entry[1] += 1
+    try:
+        async with entry[0]:
+            yield
+    finally:
+        entry[1] -= 1
+        if not entry[1]:
+            del _answer_locks[key]
 
 
 @router.callback_query(F.data == "create_test")
@@ -35,12 +66,115 @@ async def create_test(callback: types.CallbackQuery, state: FSMContext):
 
     # Set state
     await state.set_state(TestStates.creating_test)
-    await state.update_data(current_question=0, answers={})
+    # The session stays on this bank version even if the bank is reloaded
+    await state.update_data(
+        current_question=0,
+        answers={},
+        question_set=None,
+        bank_version=current_bank().set_hash,
+        edit_test_id=None
+    )
 
     # Send first question
     await send_next_question(callback.bot, callback.message.chat.id, state)
 
 
+@router.callback_query(StatsEditCallback.filter())
+async def edit_test_answers(callback: types.CallbackQuery, callback_data: StatsEditCallback, state: FSMContext):
+    """
+    Start answering a test's questions again to replace the creator's answers.
+
+    Args:
+        callback: Callback query from the "Edit Answers" button
+        callback_data: ID of the test
+        state: FSM context for managing conversation state
+    """
+    await callback.answer()
+
+    # Only the creator may change the answers, through the bot of the test
+    test_info = await db.get_test(callback_data.test_id)
+    if not test_info or test_info['user_id'] != callback.from_user.id or not serves_test(callback.bot, test_info):
+        await callback.message.answer(texts.TEST_NOT_FOUND)
+        return
+
+    await callback.message.answer(texts.EDIT_TEST_START)
+
+    # The edit goes over the same questions the test was created with
+    await state.set_state(TestStates.creating_test)
+    await state.update_data(
+        current_question=0,
+        answers={},
+        question_set=test_info['question_set'],
+        bank_version=test_info['bank_version'],
+        edit_test_id=callback_data.test_id
+    )
+
+    await send_next_question(callback.bot, callback.message.chat.id, state)
+
+
+@router.callback_query(F.data == "upload_questions")
+async def upload_questions(callback: types.CallbackQuery, state: FSMContext):
+    """
+    Ask the creator for a custom question set.
+
+    Args:
+        callback: Callback query from the "Upload Questions" button
+        state: FSM context for managing conversation state
+    """
+    await callback.answer()
+
+    await state.set_state(TestStates.uploading_questions)
+    await callback.message.answer(texts.UPLOAD_QUESTIONS_PROMPT.format(
+        max_questions=QUESTION_SET_MAX_QUESTIONS,
+        min_options=QUESTION_SET_MIN_OPTIONS,
+        max_options=QUESTION_SET_MAX_OPTIONS
+    ))
+
+
+@router.message(TestStates.uploading_questions, F.document)
+async def process_question_file(message: types.Message, state: FSMContext):
+    """
+    Validate an uploaded question set and start creating a test on it.
+
+    Args:
+        message: Message with the JSON document
+        state: FSM context for managing conversation state
+    """
+    try:
+        check_file_size(message.document.file_size or 0)
+        file = await message.bot.download(message.document)
+        questions = parse_question_file(file.read())
+    except QuestionSetError as e:
+        await message.answer(texts.UPLOAD_QUESTIONS_FAILED.format(error=e))
+        return
+
+    # Equal sets are stored once, whoever uploads them
+    question_set = await save_question_set(questions, message.from_user.id)
+    await message.answer(texts.UPLOAD_QUESTIONS_ACCEPTED.format(count=len(question_set)))
+
+    await state.set_state(TestStates.creating_test)
+    await state.update_data(
+        current_question=0,
+        answers={},
+        question_set=question_set.set_hash,
+        bank_version=None,
+        edit_test_id=None
+    )
+
+    await send_next_question(message.bot, message.chat.id, state)
+
+
+@router.message(TestStates.uploading_questions)
+async def handle_message_during_upload(message: types.Message):
+    """
+    Remind the creator that a JSON file is expected.
+
+    Args:
+        message: Message from the user
+    """
+    await message.answer(texts.UPLOAD_QUESTIONS_EXPECTED)
+
+
 @router.callback_query(TestStates.creating_test, F.data.startswith("answer_"))
 async def process_creating_answer(callback: types.CallbackQuery, state: FSMContext):
     """
@@ -52,6 +186,16 @@ async def process_creating_answer(callback: types.CallbackQuery, state: FSMConte
     """
     await callback.answer()
 
+    async with _answer_lock(callback.bot.id, callback.from_user.id):
+        await _process_creating_answer(callback, state)
+
+
+async def _process_creating_answer(callback, state):
+    """Store one answer and send the next question or finish, under the user's answer lock."""
+    # A tap queued behind the one that finished the test finds the state cleared
+    if await state.get_state() != TestStates.creating_test:
+        return
+
     # Get the selected answer index
     answer_index = int(callback.data.split("_")[1])
 
@@ -59,36 +203,61 @@ async def process_creating_answer(callback: types.CallbackQuery, state: FSMConte
     data = await state.get_data()
     current_question_index = data['current_question']
     answers = data['answers']
+    question_set = await get_question_set(data.get('question_set'), data.get('bank_version'))
+
+    if question_set is None:
+        await callback.message.answer(texts.QUESTION_SET_MISSING)
+        await state.clear()
+        return
+
+    # A repeated tap on the last question arrives once every answer is in
+    if current_question_index >= len(question_set):
+        return
 
     # Save this answer
-    question_id = str(QUESTIONS[current_question_index]['id'])
+    question_id = question_set.question_ids[current_question_index]
     answers[question_id] = answer_index
 
     # Move to next question
     current_question_index += 1
     await state.update_data(current_question=current_question_index, answers=answers)
 
-    if current_question_index < len(QUESTIONS):
+    if current_question_index < len(question_set):
         # Still have questions - send the next one
         await send_next_question(callback.bot, callback.message.chat.id, state, callback.message.message_id)
+    elif data.get('edit_test_id'):
+        # Editing an existing test - rescore every stored result
+        summary = await db.update_test_answers(data['edit_test_id'], answers)
+        text = texts.TEST_NOT_FOUND if summary is None else texts.TEST_ANSWERS_UPDATED.format(**summary)
+        await callback.message.edit_text(text)
+
+        await state.clear()
     else:
         # Test completed - save it and generate link
         user_id = callback.from_user.id
-        test_id = await db.create_test(user_id, answers)
-
-        # Get bot username for creating the deep link
+        custom_set = data.get('question_set')
         bot = callback.bot
-        bot_info = await bot.get_me()
-        bot_username = bot_info.username
+        test_id = await db.create_test(
+            user_id,
+            answers,
+            question_set=custom_set,
+            bank_version=None if custom_set else question_set.set_hash,
+            bot_id=bot.id
+        )
+
+        # Bot username for the deep link, cached at startup
+        bot_username = (await get_identity(bot)).username
 
-        test_link = f"https://t.me/{bot_username}?start={test_id}"
+        test_link = make_test_link(bot_username, test_id)
+        # The inline share card is built now, not on every @bot query
+        add_share_card(bot, user_id, test_id, test_link)
 
         # Send completion message with the link
         await bot.edit_message_text(
             text=texts.TEST_CREATED.format(link=test_link),
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id,
-            reply_markup=get_share_keyboard(test_link)
+            reply_markup=get_share_keyboard(test_link, test_id)
         )
 
         # Reset state
@@ -108,19 +277,16 @@ async def send_next_question(bot, chat_id, state, message_id=None):
     # Get current state data
     data = await state.get_data()
     current_question_index = data['current_question']
+    question_set = await get_question_set(data.get('question_set'), data.get('bank_version'))
 
-    # Get the current question
-    question = QUESTIONS[current_question_index]
-
-    # Prepare the message text
-    message_text = texts.QUESTION_TEMPLATE.format(
-        current=current_question_index + 1,
-        total=len(QUESTIONS),
-        question=question['text']
-    )
+    if question_set is None:
+        await bot.send_message(chat_id=chat_id, text=texts.QUESTION_SET_MISSING)
+        await state.clear()
+        return
 
-    # Get the keyboard with options
-    markup = get_options_keyboard(question['options'])
+    # Prerendered text and keyboard of the current question
+    message_text = question_set.creating_texts[current_question_index]
+    markup = question_set.markups[current_question_index]
 
     # Send or edit the message
     if message_id:
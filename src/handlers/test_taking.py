@@ -1,24 +1,20 @@
 """
 Handlers for taking tests created by other users.
 """
-import json
 import logging
 from aiogram import Router, F, types
 from aiogram.fsm.context import FSMContext
 
 from src import texts
 from src.states import TestStates
-from src.keyboards import get_options_keyboard
-from src.db.database import db
+from src.db import db
+from src.questions import get_question_set
+from src.render import render_answer_details
 
 # Initialize router
 router = Router()
 logger = logging.getLogger(__name__)
 
-# Load questions from JSON file
-with open('questions.json', 'r', encoding='utf-8') as f:
-    QUESTIONS = json.load(f)['questions']
-
 
 @router.callback_query(TestStates.taking_test, F.data.startswith("answer_"))
 async def process_taking_answer(callback: types.CallbackQuery, state: FSMContext):
@@ -34,10 +30,16 @@ async def process_taking_answer(callback: types.CallbackQuery, state: FSMContext
     answers = data['answers']
     test_id = data['test_id']
     creator_id = data['creator_id']
+    question_set = await get_question_set(data.get('question_set'), data.get('bank_version'))
+
+    if question_set is None:
+        await callback.message.answer(texts.QUESTION_SET_MISSING)
+        await state.clear()
+        return
 
     # Check if index is valid
-    if current_question_index >= len(QUESTIONS):
-        logger.error(f"Question index out of range: {current_question_index}, total questions: {len(QUESTIONS)}")
+    if current_question_index >= len(question_set):
+        logger.error(f"Question index out of range: {current_question_index}, total questions: {len(question_set)}")
         await callback.bot.edit_message_text(
             text="Произошла ошибка при обработке ответа. Пожалуйста, начните тест заново.",
             chat_id=callback.message.chat.id,
@@ -47,7 +49,7 @@ async def process_taking_answer(callback: types.CallbackQuery, state: FSMContext
         return
 
     # Save this answer
-    question_id = str(QUESTIONS[current_question_index]['id'])
+    question_id = question_set.question_ids[current_question_index]
     answers[question_id] = answer_index
 
     # Move to next question
@@ -56,7 +58,7 @@ async def process_taking_answer(callback: types.CallbackQuery, state: FSMContext
 
     # Rest of the function remains the same...
 
-    if current_question_index < len(QUESTIONS):
+    if current_question_index < len(question_set):
         # Still have questions - send the next one
         await send_next_question(callback.bot, callback.message.chat.id, state, callback.message.message_id)
     else:
@@ -78,54 +80,31 @@ async def process_taking_answer(callback: types.CallbackQuery, state: FSMContext
 
         # Send result to test taker
         creator_name = result['creator']['first_name'] or result['creator']['username'] or "этого пользователя"
+        rank = result['rank']
+        if rank['beaten_percentage'] is None:
+            rank_text = texts.TEST_RANK_FIRST
+        else:
+            rank_text = texts.TEST_RANK.format(**rank)
         await callback.bot.edit_message_text(
             text=texts.TEST_COMPLETED.format(
                 creator_name=creator_name,
                 percentage=result['percentage'],
                 status=result['status']
-            ),
+            ) + "\n\n" + rank_text,
             chat_id=callback.message.chat.id,
             message_id=callback.message.message_id
         )
 
-        # Prepare detailed answers for notification
-        # Prepare detailed answers for notification
-        answers_details = ""
-        for question in QUESTIONS:
-            q_id = str(question['id'])
-            if q_id in answers:
-                user_answer_index = answers[q_id]
-                user_answer = question['options'][user_answer_index]
-
-                # Check if the creator has answered this question
-                if q_id in result['creator']['answers']:
-                    correct_answer_index = result['creator']['answers'][q_id]
-                    correct_answer = question['options'][correct_answer_index]
-
-                    # Mark if answer is correct
-                    is_correct = "✅" if user_answer_index == correct_answer_index else "❌"
-
-                    answers_details += f"{is_correct} {question['text']}\n"
-                    answers_details += f"- Выбран ответ: {user_answer}\n"
-                    if user_answer_index != correct_answer_index:
-                        answers_details += f"- Правильный ответ: {correct_answer}\n"
-                    answers_details += "\n"
-                else:
-                    # Creator didn't answer this question
-                    answers_details += f"❓ {question['text']}\n"
-                    answers_details += f"- Выбран ответ: {user_answer}\n"
-                    answers_details += "- Создатель теста не ответил на этот вопрос\n\n"
-
-        # Notify test creator
-        await callback.bot.send_message(
-            chat_id=creator_id,
-            text=texts.NEW_RESULT_NOTIFICATION.format(
-                username=f"@{taker_username}" if '@' not in taker_username else taker_username,
-                percentage=result['percentage'],
-                status=result['status'],
-                answers_details=answers_details
-            )
+        # Notify test creator, in several messages if the details are long
+        header = texts.NEW_RESULT_NOTIFICATION.format(
+            username=f"@{taker_username}" if '@' not in taker_username else taker_username,
+            percentage=result['percentage'],
+            status=result['status']
         )
+        for text in render_answer_details(
+            question_set.detail_fragments, header, result['creator']['answers'], answers
+        ):
+            await callback.bot.send_message(chat_id=creator_id, text=text)
 
         # Reset state
         await state.clear()
@@ -146,9 +125,10 @@ async def handle_message_during_test(message: types.Message, state: FSMContext):
     # Resend the current question
     data = await state.get_data()
     current_question_index = data.get('current_question', 0)
+    question_set = await get_question_set(data.get('question_set'), data.get('bank_version'))
 
     # Only resend if we're within question bounds
-    if 0 <= current_question_index < len(QUESTIONS):
+    if question_set is not None and 0 <= current_question_index < len(question_set):
         await send_next_question(message.bot, message.chat.id, state)
 
 
@@ -159,10 +139,16 @@ async def send_next_question(bot, chat_id, state, message_id=None):
     # Get current state data
     data = await state.get_data()
     current_question_index = data['current_question']
+    question_set = await get_question_set(data.get('question_set'), data.get('bank_version'))
+
+    if question_set is None:
+        await bot.send_message(chat_id=chat_id, text=texts.QUESTION_SET_MISSING)
+        await state.clear()
+        return
 
     # Check if index is valid
-    if current_question_index >= len(QUESTIONS):
-        logger.error(f"Question index out of range: {current_question_index}, total questions: {len(QUESTIONS)}")
+    if current_question_index >= len(question_set):
+        logger.error(f"Question index out of range: {current_question_index}, total questions: {len(question_set)}")
         await bot.send_message(
             chat_id=chat_id,
             text="Произошла ошибка при загрузке следующего вопроса. Пожалуйста, начните тест заново."
@@ -170,20 +156,9 @@ async def send_next_question(bot, chat_id, state, message_id=None):
         await state.clear()
         return
 
-    # Get the current question
-    question = QUESTIONS[current_question_index]
-
-    # Rest of the function remains the same...
-
-    # Prepare the message text
-    message_text = texts.TAKING_TEST_QUESTION.format(
-        current=current_question_index + 1,
-        total=len(QUESTIONS),
-        question=question['text']
-    )
-
-    # Get the keyboard with options
-    markup = get_options_keyboard(question['options'])
+    # Prerendered text and keyboard of the current question
+    message_text = question_set.taking_texts[current_question_index]
+    markup = question_set.markups[current_question_index]
 
     # Send or edit the message
     if message_id:
@@ -0,0 +1,57 @@
+"""
+Cached identity of the bots.
+
+A bot's own user never changes while it runs, so it is fetched once at
+startup instead of with a getMe round trip wherever a deep link is built.
+"""
+
+# Bot ID -> the bot's User
+_identities = {}
+
+
+async def fetch_identity(bot):
+    """
+    Ask Telegram who the bot is and cache the answer.
+
+    Args:
+        bot: Bot instance
+
+    Returns:
+        User: The bot's user
+    """
+    identity = await bot.get_me()
+    _identities[bot.id] = identity
+    return identity
+
+
+async def get_identity(bot):
+    """
+    Get the bot's user, fetching it only if startup did not.
+
+    Args:
+        bot: Bot instance
+
+    Returns:
+        User: The bot's user
+    """
+    identity = _identities.get(bot.id)
+    if identity is None:
+        identity = await fetch_identity(bot)
+    return identity
+
+
+def serves_test(bot, test_info):
+    """
+    Check that a test belongs to this bot.
+
+    Tests are only reachable through the bot they were created with;
+    tests from before multi-bot hosting have no bot and are served by all.
+
+    Args:
+        bot: Bot instance
+        test_info: Test details from get_test
+
+    Returns:
+        bool: True if the bot may serve the test
+    """
+    return test_info['bot_id'] in (None, bot.id)
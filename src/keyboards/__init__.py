@@ -1,14 +1,38 @@
 """
 Keyboard utilities for the bot.
 """
+from src.keyboards.callbacks import (
+    StatsOverviewCallback,
+    StatsTestPageCallback,
+    StatsEditCallback,
+    StatsFriendPageCallback,
+    MyStatsPageCallback,
+    decode_cursor_time
+)
 from src.keyboards.inline import (
     get_options_keyboard,
     get_start_test_keyboard,
-    get_share_keyboard
+    get_share_keyboard,
+    get_take_test_keyboard,
+    get_stats_overview_keyboard,
+    get_test_page_keyboard,
+    get_friend_page_keyboard,
+    get_taken_tests_keyboard
 )
 
 __all__ = [
+    "StatsOverviewCallback",
+    "StatsTestPageCallback",
+    "StatsEditCallback",
+    "StatsFriendPageCallback",
+    "MyStatsPageCallback",
+    "decode_cursor_time",
     "get_options_keyboard",
     "get_start_test_keyboard",
-    "get_share_keyboard"
+    "get_share_keyboard",
+    "get_take_test_keyboard",
+    "get_stats_overview_keyboard",
+    "get_test_page_keyboard",
+    "get_friend_page_keyboard",
+    "get_taken_tests_keyboard"
 ]
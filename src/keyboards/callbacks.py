@@ -0,0 +1,69 @@
+"""
+Callback data factories for the Friends Test bot.
+"""
+from datetime import datetime
+from typing import Optional
+
+from aiogram.filters.callback_data import CallbackData
+
+# Compact timestamp format: callback data is limited to 64 bytes
+# and ':' is reserved as the field separator
+CURSOR_TIME_FORMAT = "%Y%m%d%H%M%S"
+DB_TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+
+class StatsOverviewCallback(CallbackData, prefix="so"):
+    """Page of the /stats overview, keyed by the (created_at, test_id) cursor; no cursor is the first page."""
+    created_at: Optional[str] = None
+    test_id: Optional[str] = None
+
+
+class StatsTestPageCallback(CallbackData, prefix="st"):
+    """Page of passes of one test, keyed by the (score, result_id) cursor."""
+    test_id: str
+    score: Optional[int] = None
+    result_id: Optional[int] = None
+
+
+class StatsEditCallback(CallbackData, prefix="se"):
+    """Start editing the creator's answers to a test."""
+    test_id: str
+
+
+class StatsFriendPageCallback(CallbackData, prefix="sf"):
+    """Page of one friend's history, keyed by the (created_at, result_id) cursor."""
+    taker_id: int
+    created_at: Optional[str] = None
+    result_id: Optional[int] = None
+
+
+class MyStatsPageCallback(CallbackData, prefix="ms"):
+    """Page of the tests the user took, keyed by the (created_at, result_id) cursor."""
+    created_at: str
+    result_id: int
+
+
+def encode_cursor_time(created_at):
+    """
+    Convert a database timestamp into its compact callback form.
+
+    Args:
+        created_at (str): Timestamp as stored by SQLite
+
+    Returns:
+        str: Timestamp without separators
+    """
+    return datetime.strptime(created_at, DB_TIME_FORMAT).strftime(CURSOR_TIME_FORMAT)
+
+
+def decode_cursor_time(value):
+    """
+    Convert a compact callback timestamp back into the database form.
+
+    Args:
+        value (str): Timestamp without separators
+
+    Returns:
+        str: Timestamp as stored by SQLite
+    """
+    return datetime.strptime(value, CURSOR_TIME_FORMAT).strftime(DB_TIME_FORMAT)
@@ -5,6 +5,14 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 from src import texts
+from src.keyboards.callbacks import (
+    StatsOverviewCallback,
+    StatsTestPageCallback,
+    StatsEditCallback,
+    StatsFriendPageCallback,
+    MyStatsPageCallback,
+    encode_cursor_time
+)
 
 
 def get_options_keyboard(options):
@@ -32,30 +40,215 @@ def get_options_keyboard(options):
 
 def get_start_test_keyboard():
     """
-    Create a keyboard with the "Create Test" button.
+    Create a keyboard with the "Create Test" and "Upload Questions" buttons.
 
     Returns:
-        InlineKeyboardMarkup: Keyboard with the create test button
+        InlineKeyboardMarkup: Keyboard with the create test buttons
     """
     builder = InlineKeyboardBuilder()
     builder.add(
-        InlineKeyboardButton(text=texts.CREATE_TEST_BUTTON, callback_data="create_test")
+        InlineKeyboardButton(text=texts.CREATE_TEST_BUTTON, callback_data="create_test"),
+        InlineKeyboardButton(text=texts.UPLOAD_QUESTIONS_BUTTON, callback_data="upload_questions")
     )
+    builder.adjust(1)
     return builder.as_markup()
 
 
-def get_share_keyboard(test_link):
+def get_share_keyboard(test_link, test_id):
     """
-    Create a keyboard with a button to share the test.
+    Create a keyboard with buttons to share the test.
 
     Args:
         test_link (str): Link to share
+        test_id (str): ID of the test, prefilled as the inline query
+
+    Returns:
+        InlineKeyboardMarkup: Keyboard with link and inline share buttons
+    """
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text=texts.SHARE_TEST_BUTTON, url=test_link),
+        InlineKeyboardButton(text=texts.SHARE_INLINE_BUTTON, switch_inline_query=test_id)
+    )
+    builder.adjust(1)
+    return builder.as_markup()
+
+
+def get_take_test_keyboard(test_link):
+    """
+    Create the keyboard of a shared test card.
+
+    Args:
+        test_link (str): Deep link to the test
+
+    Returns:
+        InlineKeyboardMarkup: Keyboard with a button that starts the test
+    """
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(text=texts.TAKE_TEST_BUTTON, url=test_link)
+    )
+    return builder.as_markup()
+
+
+def get_stats_overview_keyboard(tests, next_cursor):
+    """
+    Create a keyboard with a button per test for the statistics browser.
+
+    Args:
+        tests (list): Per-test aggregates of the page from get_test_summaries_page
+        next_cursor (tuple): (created_at, test_id) of the next page or None
+
+    Returns:
+        InlineKeyboardMarkup: Keyboard with test buttons and the next page button
+    """
+    builder = InlineKeyboardBuilder()
+
+    for test in tests:
+        builder.add(
+            InlineKeyboardButton(
+                text=texts.STATS_TEST_BUTTON.format(
+                    test_id=test['test_id'],
+                    passes_count=test['passes_count'],
+                    average_score=test['average_score']
+                ),
+                callback_data=StatsTestPageCallback(test_id=test['test_id']).pack()
+            )
+        )
+
+    if next_cursor:
+        created_at, test_id = next_cursor
+        builder.add(
+            InlineKeyboardButton(
+                text=texts.STATS_NEXT_PAGE_BUTTON,
+                callback_data=StatsOverviewCallback(
+                    created_at=encode_cursor_time(created_at),
+                    test_id=test_id
+                ).pack()
+            )
+        )
+
+    builder.adjust(1)
+
+    return builder.as_markup()
+
+
+def get_test_page_keyboard(test_id, results, next_cursor):
+    """
+    Create a keyboard for a page of test passes.
+
+    Args:
+        test_id (str): ID of the test
+        results (list): Rows of the current page
+        next_cursor (tuple): (score, result_id) of the next page or None
+
+    Returns:
+        InlineKeyboardMarkup: Keyboard with friend, next page, edit and back buttons
+    """
+    builder = InlineKeyboardBuilder()
+
+    # One history button per friend on the page
+    seen_takers = set()
+    for result in results:
+        if result['taker_id'] in seen_takers:
+            continue
+        seen_takers.add(result['taker_id'])
+        builder.add(
+            InlineKeyboardButton(
+                text=texts.STATS_FRIEND_BUTTON.format(username=result['username']),
+                callback_data=StatsFriendPageCallback(taker_id=result['taker_id']).pack()
+            )
+        )
+
+    if next_cursor:
+        score, result_id = next_cursor
+        builder.add(
+            InlineKeyboardButton(
+                text=texts.STATS_NEXT_PAGE_BUTTON,
+                callback_data=StatsTestPageCallback(
+                    test_id=test_id, score=score, result_id=result_id
+                ).pack()
+            )
+        )
+
+    builder.add(
+        InlineKeyboardButton(
+            text=texts.EDIT_ANSWERS_BUTTON,
+            callback_data=StatsEditCallback(test_id=test_id).pack()
+        )
+    )
+    builder.add(
+        InlineKeyboardButton(
+            text=texts.STATS_BACK_BUTTON,
+            callback_data=StatsOverviewCallback().pack()
+        )
+    )
+
+    builder.adjust(2)
+
+    return builder.as_markup()
+
+
+def get_friend_page_keyboard(taker_id, next_cursor):
+    """
+    Create a keyboard for a page of a friend's history.
+
+    Args:
+        taker_id (int): ID of the friend
+        next_cursor (tuple): (created_at, result_id) of the next page or None
 
     Returns:
-        InlineKeyboardMarkup: Keyboard with share button
+        InlineKeyboardMarkup: Keyboard with next page and back buttons
     """
     builder = InlineKeyboardBuilder()
+
+    if next_cursor:
+        created_at, result_id = next_cursor
+        builder.add(
+            InlineKeyboardButton(
+                text=texts.STATS_NEXT_PAGE_BUTTON,
+                callback_data=StatsFriendPageCallback(
+                    taker_id=taker_id,
+                    created_at=encode_cursor_time(created_at),
+                    result_id=result_id
+                ).pack()
+            )
+        )
+
     builder.add(
-        InlineKeyboardButton(text=texts.SHARE_TEST_BUTTON, url=test_link)
+        InlineKeyboardButton(
+            text=texts.STATS_BACK_BUTTON,
+            callback_data=StatsOverviewCallback().pack()
+        )
+    )
+
+    builder.adjust(1)
+
+    return builder.as_markup()
+
+
+def get_taken_tests_keyboard(next_cursor):
+    """
+    Create a keyboard for a page of /mystats.
+
+    Args:
+        next_cursor (tuple): (created_at, result_id) of the next page or None
+
+    Returns:
+        InlineKeyboardMarkup: Keyboard with the next page button, or None on the last page
+    """
+    if not next_cursor:
+        return None
+
+    created_at, result_id = next_cursor
+    builder = InlineKeyboardBuilder()
+    builder.add(
+        InlineKeyboardButton(
+            text=texts.STATS_NEXT_PAGE_BUTTON,
+            callback_data=MyStatsPageCallback(
+                created_at=encode_cursor_time(created_at),
+                result_id=result_id
+            ).pack()
+        )
     )
     return builder.as_markup()
@@ -8,9 +8,14 @@ import logging
 from aiogram import Bot, Dispatcher
 from aiogram.fsm.storage.memory import MemoryStorage
 
-from src.handlers import command_handlers, test_creation, test_taking
-from src.consts import BOT_TOKEN
-from src.db.database import db
+from src.handlers import admin, command_handlers, sharing, test_creation, test_taking
+from src.bootstrap import bootstrap, save_cache_snapshot
+from src.consts import BACKUP_INTERVAL, BOT_TOKENS, CACHE_SNAPSHOT_FILE, RECORD_UPDATES_FILE, RETENTION_DAYS
+from src.db import db, sqlite_databases
+from src.db.backup import backup_loop
+from src.db.maintenance import maintenance_loop
+from src.questions import bank_watch_loop
+from src.recording import UpdateRecorder
 
 # Configure logging
 logging.basicConfig(
@@ -22,32 +27,84 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-async def main():
-    """Initialize and start the bot."""
-    logger.info("Starting the bot")
+def create_dispatcher(storage=None):
+    """
+    Create the dispatcher with every router included.
 
-    # Initialize database connection
-    logger.info("Connecting to database")
-    await db.connect()
-    logger.info("Database connection established")
+    Args:
+        storage: FSM storage, in-memory if None
 
-    # Initialize bot and dispatcher
-    bot = Bot(token=BOT_TOKEN)
-    storage = MemoryStorage()
+    Returns:
+        Dispatcher: Dispatcher with the FSM storage
+    """
+    storage = MemoryStorage() if storage is None else storage
     dp = Dispatcher(storage=storage)
 
-    # Include routers
+    dp.include_router(admin.router)
     dp.include_router(command_handlers.router)
     dp.include_router(test_creation.router)
     dp.include_router(test_taking.router)
+    dp.include_router(sharing.router)
+    return dp
+
+
+async def main():
+    """Initialize and start the bot."""
+    logger.info("Starting the bot")
+
+    # One process serves every configured bot
+    bots = [Bot(token=token) for token in BOT_TOKENS]
+
+    # Database, question bank, bot identities and warm caches, phase by phase
+    await bootstrap(bots)
+
+    # Initialize dispatcher with all routers
+    dp = create_dispatcher()
+
+    # Anonymized update log for replay benchmarks, before any handler runs
+    recorder = None
+    if RECORD_UPDATES_FILE:
+        recorder = UpdateRecorder(RECORD_UPDATES_FILE)
+        dp.update.outer_middleware(recorder)
 
     # Start polling
-    await bot.delete_webhook(drop_pending_updates=True)
-    logger.info("Bot started.")
+    for bot in bots:
+        await bot.delete_webhook(drop_pending_updates=True)
+    logger.info("Bot started with %d tokens.", len(bots))
+
+    # Reload the question bank when questions.json changes
+    background_tasks = [asyncio.create_task(bank_watch_loop())]
+
+    # Retention, vacuum, analyze and snapshots only apply to SQLite files;
+    # every shard is maintained on its own. Retention only runs when enabled
+    databases = sqlite_databases(db)
+    if databases and RETENTION_DAYS <= 0:
+        logger.info("Retention disabled: results are kept, maintenance only vacuums and analyzes")
+    for database in databases:
+        background_tasks.append(asyncio.create_task(maintenance_loop(database)))
+
+    # Periodic online snapshots of the database or of the whole shard layout
+    if databases and BACKUP_INTERVAL > 0:
+        background_tasks.append(asyncio.create_task(backup_loop()))
 
     try:
-        await dp.start_polling(bot)
+        await dp.start_polling(*bots)
     finally:
+        for task in background_tasks:
+            task.cancel()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+
+        if recorder is not None:
+            recorder.close()
+
+        # Let the next start begin with warm caches
+        if CACHE_SNAPSHOT_FILE:
+            try:
+                saved = save_cache_snapshot(CACHE_SNAPSHOT_FILE)
+                logger.info("Cache snapshot written: %s", saved)
+            except OSError as e:
+                logger.error("Cache snapshot was not written: %s", e)
+
         # Close database connection when bot stops
         logger.info("Closing database connection")
         await db.close()
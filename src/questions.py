@@ -0,0 +1,395 @@
+"""
+Question sets: validation, content hashing and an in-memory cache.
+
+Tests use either the global bank from QUESTIONS_FILE or a set uploaded by
+the creator. Uploaded sets are stored once per content hash; at runtime
+they are served from a bounded LRU of parsed sets whose question texts
+and keyboards are rendered up front, so a question tap never parses JSON.
+
+The global bank is versioned the same way: editing QUESTIONS_FILE swaps in
+a new version without a restart, while tests and running sessions stay on
+the version they started with until nothing references it any more.
+"""
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+
+from src import texts
+from src.cache import LRUCache
+from src.consts import (
+    BANK_GC_INTERVAL,
+    BANK_SESSION_TTL,
+    BANK_WATCH_INTERVAL,
+    OPTION_TEXT_MAX_LENGTH,
+    QUESTION_SET_CACHE_SIZE,
+    QUESTION_SET_MAX_BYTES,
+    QUESTION_SET_MAX_OPTIONS,
+    QUESTION_SET_MAX_QUESTIONS,
+    QUESTION_SET_MIN_OPTIONS,
+    QUESTION_TEXT_MAX_LENGTH,
+    QUESTIONS_FILE
+)
+from src.db import db
+from src.keyboards import get_options_keyboard
+from src.render import AnswerDetailFragments
+
+logger = logging.getLogger(__name__)
+
+
+class QuestionSetError(ValueError):
+    """An uploaded question set is malformed; the message is shown to the user."""
+
+
+class QuestionSet:
+    """Parsed question set with prerendered messages and notification fragments."""
+
+    def __init__(self, questions, set_hash):
+        """
+        Prerender every question of a set.
+
+        Args:
+            questions: Validated list of questions
+            set_hash: Content hash of the set
+        """
+        self.set_hash = set_hash
+        self.questions = questions
+        self.question_ids = [str(question['id']) for question in questions]
+        total = len(questions)
+        self.creating_texts = [
+            texts.QUESTION_TEMPLATE.format(current=index, total=total, question=question['text'])
+            for index, question in enumerate(questions, 1)
+        ]
+        self.taking_texts = [
+            texts.TAKING_TEST_QUESTION.format(current=index, total=total, question=question['text'])
+            for index, question in enumerate(questions, 1)
+        ]
+        self.markups = [get_options_keyboard(question['options']) for question in questions]
+        self.detail_fragments = AnswerDetailFragments(questions)
+
+    def __len__(self):
+        return len(self.questions)
+
+
+def validate_questions(data):
+    """
+    Check a decoded question set and normalize it.
+
+    Args:
+        data: {"questions": [...]} like questions.json, or the bare list
+
+    Returns:
+        list: Questions with id, stripped text and options
+
+    Raises:
+        QuestionSetError: If the set breaks any of the limits
+    """
+    if isinstance(data, dict):
+        data = data.get('questions')
+    if not isinstance(data, list) or not data:
+        raise QuestionSetError(texts.QSET_ERROR_NO_QUESTIONS)
+    if len(data) > QUESTION_SET_MAX_QUESTIONS:
+        raise QuestionSetError(texts.QSET_ERROR_TOO_MANY.format(limit=QUESTION_SET_MAX_QUESTIONS))
+
+    questions = []
+    seen_ids = set()
+    for number, question in enumerate(data, 1):
+        if not isinstance(question, dict):
+            raise QuestionSetError(texts.QSET_ERROR_QUESTION.format(number=number))
+
+        question_id = question.get('id', number)
+        if isinstance(question_id, bool) or not isinstance(question_id, (int, str)) or str(question_id) in seen_ids:
+            raise QuestionSetError(texts.QSET_ERROR_ID.format(number=number))
+        seen_ids.add(str(question_id))
+
+        text = question.get('text')
+        if not isinstance(text, str) or not text.strip() or len(text) > QUESTION_TEXT_MAX_LENGTH:
+            raise QuestionSetError(texts.QSET_ERROR_TEXT.format(number=number, limit=QUESTION_TEXT_MAX_LENGTH))
+
+        options = question.get('options')
+        if (
+            not isinstance(options, list)
+            or not QUESTION_SET_MIN_OPTIONS <= len(options) <= QUESTION_SET_MAX_OPTIONS
+            or not all(
+                isinstance(option, str) and option.strip() and len(option) <= OPTION_TEXT_MAX_LENGTH
+                for option in options
+            )
+        ):
+            raise QuestionSetError(texts.QSET_ERROR_OPTIONS.format(
+                number=number,
+                min_options=QUESTION_SET_MIN_OPTIONS,
+                max_options=QUESTION_SET_MAX_OPTIONS,
+                limit=OPTION_TEXT_MAX_LENGTH
+            ))
+
+        questions.append({
+            'id': question_id,
+            'text': text.strip(),
+            'options': [option.strip() for option in options]
+        })
+
+    return questions
+
+
+def check_file_size(size):
+    """Reject files over QUESTION_SET_MAX_BYTES before they are downloaded."""
+    if size > QUESTION_SET_MAX_BYTES:
+        raise QuestionSetError(texts.QSET_ERROR_TOO_BIG.format(limit_kb=QUESTION_SET_MAX_BYTES // 1024))
+
+
+def parse_question_file(raw):
+    """
+    Decode and validate an uploaded JSON file.
+
+    Args:
+        raw: File contents
+
+    Returns:
+        list: Validated questions
+
+    Raises:
+        QuestionSetError: If the file is too big, not JSON or malformed
+    """
+    check_file_size(len(raw))
+    return validate_questions(_decode_json(raw))
+
+
+def _decode_json(raw):
+    """Decode UTF-8 JSON, reporting failures as QuestionSetError."""
+    try:
+        return json.loads(raw.decode('utf-8'))
+    except (UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise QuestionSetError(texts.QSET_ERROR_JSON) from e
+
+
+def content_hash(questions):
+    """Hash of a set's canonical JSON, so equal sets share one stored copy."""
+    canonical = json.dumps(questions, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+
+def load_bank_file(path=QUESTIONS_FILE):
+    """
+    Read and validate the global bank.
+
+    Raises:
+        OSError: If the file cannot be read
+        QuestionSetError: If it is malformed
+    """
+    with open(path, 'rb') as f:
+        questions = validate_questions(_decode_json(f.read()))
+    return QuestionSet(questions, content_hash(questions))
+
+
+# Current version of the global bank, replaced as a whole on reload
+_bank = load_bank_file()
+# Older bank versions and uploads -> when a session last asked for them
+_set_last_used = {}
+
+# Parsed sets by content hash: uploads and older bank versions
+question_set_cache = LRUCache(QUESTION_SET_CACHE_SIZE)
+
+
+def current_bank():
+    """The current version of the global bank."""
+    return _bank
+
+
+async def get_question_set(set_hash=None, bank_version=None):
+    """
+    Get the questions of a test or session, parsing only on a cache miss.
+
+    Args:
+        set_hash: Content hash of an uploaded set, None for the global bank
+        bank_version: Version of the global bank the test or session is
+            pinned to, None for the current one
+
+    Returns:
+        QuestionSet: The set, or None if it is not stored
+    """
+    if set_hash is None:
+        if bank_version is None or bank_version == _bank.set_hash:
+            return _bank
+        set_hash = bank_version
+
+    # A session on an older version, or on an upload with the same content
+    # as one, keeps it from being collected
+    _set_last_used[set_hash] = time.monotonic()
+
+    question_set = question_set_cache.get(set_hash)
+    if question_set is None:
+        questions = await db.get_question_set(set_hash)
+        if questions is None:
+            return None
+        question_set = QuestionSet(questions, set_hash)
+        question_set_cache.put(set_hash, question_set)
+
+    return question_set
+
+
+async def save_question_set(questions, user_id):
+    """
+    Store a validated set (once per content) and cache it.
+
+    Args:
+        questions: Validated list of questions
+        user_id: ID of the uploader
+
+    Returns:
+        QuestionSet: The stored set
+    """
+    set_hash = content_hash(questions)
+    # The creation session that follows keeps the set from being collected
+    _set_last_used[set_hash] = time.monotonic()
+    if set_hash in question_set_cache:
+        return question_set_cache.get(set_hash)
+
+    await db.add_question_set(set_hash, questions, user_id)
+    question_set = QuestionSet(questions, set_hash)
+    question_set_cache.put(set_hash, question_set)
+    return question_set
+
+
+async def register_bank():
+    """
+    Store the current bank version; called once the database is connected.
+
+    Tests created before the bank was versioned are pinned to it.
+    """
+    await db.add_bank_version(_bank.set_hash, _bank.questions)
+    pinned = await db.pin_unversioned_tests(_bank.set_hash)
+    if pinned:
+        logger.info("Pinned %d older tests to bank version %s", pinned, _bank.set_hash[:12])
+
+
+async def preload_bank_versions():
+    """
+    Parse every older bank version a stored test is pinned to.
+
+    Returns:
+        int: Number of versions loaded into the cache
+    """
+    loaded = 0
+    for set_hash in await db.get_referenced_bank_versions():
+        if set_hash != _bank.set_hash and await get_question_set(set_hash) is not None:
+            loaded += 1
+    return loaded
+
+
+async def reload_bank(path=QUESTIONS_FILE):
+    """
+    Swap in the global bank from disk if its content changed.
+
+    The new version is stored before the swap, so no test can reference a
+    version that is not in the database.
+
+    Returns:
+        QuestionSet: The new version, or None if the content is unchanged
+
+    Raises:
+        OSError: If the file cannot be read
+        QuestionSetError: If it is malformed; the current version stays
+    """
+    global _bank
+
+    bank = load_bank_file(path)
+    if bank.set_hash == _bank.set_hash:
+        return None
+
+    await db.add_bank_version(bank.set_hash, bank.questions)
+    previous, _bank = _bank, bank
+
+    # Running sessions may still be on the previous version
+    question_set_cache.put(previous.set_hash, previous)
+    _set_last_used[previous.set_hash] = time.monotonic()
+
+    logger.info(
+        "Question bank reloaded: %s -> %s, %d questions",
+        previous.set_hash[:12], bank.set_hash[:12], len(bank)
+    )
+    return bank
+
+
+async def collect_bank_versions(session_ttl=BANK_SESSION_TTL):
+    """
+    Delete bank versions no test and no recent session uses.
+
+    A version is kept while a stored test uses its content, as a bank
+    version or as an uploaded set. Sessions live in memory, so after a
+    restart none of them can be on an older version; within a process a
+    version is kept while a session, on it or on an upload with the same
+    content, asked for it in the last session_ttl seconds.
+
+    Args:
+        session_ttl: Seconds after which an idle session counts as abandoned
+
+    Returns:
+        list: Content hashes of the deleted versions
+    """
+    referenced = await db.get_referenced_bank_versions()
+    now = time.monotonic()
+
+    stale = []
+    for set_hash in await db.get_bank_versions():
+        if set_hash == _bank.set_hash or set_hash in referenced:
+            continue
+        last_used = _set_last_used.get(set_hash)
+        if last_used is not None and now - last_used < session_ttl:
+            continue
+        stale.append(set_hash)
+
+    if stale:
+        await db.delete_bank_versions(stale)
+        for set_hash in stale:
+            question_set_cache.pop(set_hash)
+            _set_last_used.pop(set_hash, None)
+        logger.info("Deleted %d unused bank versions", len(stale))
+
+    # Forget sessions that are over, whatever set they were on
+    for set_hash, last_used in list(_set_last_used.items()):
+        if now - last_used >= session_ttl:
+            del _set_last_used[set_hash]
+
+    return stale
+
+
+def _file_stamp(path):
+    """Modification time and size of a file, None if it is missing."""
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+async def bank_watch_loop(path=QUESTIONS_FILE, interval=BANK_WATCH_INTERVAL, gc_interval=BANK_GC_INTERVAL):
+    """
+    Reload the bank when its file changes and collect unused versions.
+
+    Args:
+        path: Bank file to watch
+        interval: Seconds between checks of the file
+        gc_interval: Seconds between collections of unused versions
+    """
+    last_stamp = _file_stamp(path)
+    last_collection = None
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            stamp = _file_stamp(path)
+            if stamp is not None and stamp != last_stamp:
+                last_stamp = stamp
+                await reload_bank(path)
+
+            if last_collection is None or time.monotonic() - last_collection >= gc_interval:
+                last_collection = time.monotonic()
+                await collect_bank_versions()
+        except asyncio.CancelledError:
+            raise
+        except QuestionSetError as e:
+            logger.error("Question bank %s was not reloaded: %s", path, e)
+        except Exception:
+            logger.exception("Question bank watcher failed")
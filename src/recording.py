@@ -0,0 +1,194 @@
+"""
+Recording of incoming updates for replay benchmarks.
+
+UpdateRecorder is an opt-in outer middleware that appends every update,
+with its arrival time and the bot it came to, to a gzip-compressed JSON
+Lines log. Updates are anonymized on the way: user and chat IDs become
+pseudonyms under a key that only lives in memory for one run, names are
+dropped and free text is masked. User and result IDs inside callback
+data get pseudonyms under the same key, so a friend's ID in a /stats
+button still matches the pseudonym of that friend's own updates; callback
+data of unknown shape is masked. Commands, deep link payloads, test IDs
+and the shape of the traffic are kept, which is all src/replay.py needs
+to feed the log through the handlers again.
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import re
+import secrets
+import time
+
+from aiogram import BaseMiddleware
+
+from src.keyboards import (
+    MyStatsPageCallback,
+    StatsEditCallback,
+    StatsFriendPageCallback,
+    StatsOverviewCallback,
+    StatsTestPageCallback
+)
+
+logger = logging.getLogger(__name__)
+
+# Fields that identify a person or a chat beyond the pseudonymized ID
+DROPPED_KEYS = frozenset({
+    'last_name', 'title', 'bio', 'description', 'phone_number', 'contact',
+    'location', 'venue', 'poll', 'story', 'sender_business_bot'
+})
+# Masked in place, keeping their length
+MASKED_KEYS = frozenset({'caption', 'file_name'})
+# Command arguments and deep link payloads Telegram allows
+COMMAND_TOKEN = re.compile(r"[A-Za-z0-9_@/-]{1,64}")
+# Inline queries are only ever test ID prefixes
+TEST_ID_PREFIX = re.compile(r"(s(_\d*)?)?")
+# Callback data factories -> their fields holding user or result IDs
+CALLBACK_ID_FIELDS = {
+    StatsOverviewCallback: (),
+    StatsTestPageCallback: ('result_id',),
+    StatsEditCallback: (),
+    StatsFriendPageCallback: ('taker_id', 'result_id'),
+    MyStatsPageCallback: ('result_id',)
+}
+# Callback data of the plain buttons, free of IDs
+PLAIN_CALLBACK_DATA = re.compile(r"answer_\d+|create_test|upload_questions")
+
+
+def _mask(text):
+    """Replace text with a placeholder of the same length."""
+    return "x" * len(text)
+
+
+def anonymize_text(text):
+    """
+    Keep commands and their payloads, mask anything a person wrote.
+
+    Args:
+        text: Message text
+
+    Returns:
+        str: The command with its arguments, or the masked text
+    """
+    if not text.startswith("/"):
+        return _mask(text)
+    tokens = []
+    for token in text.split():
+        if not COMMAND_TOKEN.fullmatch(token):
+            break
+        tokens.append(token)
+    return " ".join(tokens) or _mask(text)
+
+
+class UpdateRecorder(BaseMiddleware):
+    """Outer update middleware that appends anonymized updates to a log."""
+
+    def __init__(self, path):
+        """
+        Open the log for appending.
+
+        Every run appends a new gzip member, so one file can hold several
+        runs; pseudonyms only agree within a run.
+
+        Args:
+            path: Log file
+        """
+        self.path = path
+        self.recorded = 0
+        self._key = secrets.token_bytes(32)
+        self._file = gzip.open(path, 'at', encoding='utf-8', compresslevel=6)
+
+    def pseudonym(self, entity_id):
+        """Stable, irreversible stand-in for a user or chat ID, keeping its sign."""
+        digest = hmac.new(self._key, str(abs(entity_id)).encode(), hashlib.sha256).digest()
+        value = int.from_bytes(digest[:5], 'big') + 1
+        return -value if entity_id < 0 else value
+
+    def anonymize_callback_data(self, data):
+        """
+        Replace the user and result IDs in callback data with pseudonyms.
+
+        Args:
+            data: Callback data of a button
+
+        Returns:
+            str: The data with pseudonymized IDs, or masked if its shape is unknown
+        """
+        if PLAIN_CALLBACK_DATA.fullmatch(data):
+            return data
+        prefix = data.split(":", 1)[0]
+        for factory, fields in CALLBACK_ID_FIELDS.items():
+            if factory.__prefix__ != prefix:
+                continue
+            try:
+                callback = factory.unpack(data)
+            except (TypeError, ValueError):
+                break
+            return callback.model_copy(update={
+                field: self.pseudonym(getattr(callback, field))
+                for field in fields
+                if getattr(callback, field) is not None
+            }).pack()
+        return _mask(data)
+
+    def anonymize(self, value, key=None):
+        """
+        Anonymize a dumped update recursively.
+
+        Args:
+            value: Part of the update as plain JSON data
+            key: Field the value belongs to
+
+        Returns:
+            Anonymized copy of the value
+        """
+        if isinstance(value, list):
+            return [self.anonymize(item, key) for item in value]
+        if not isinstance(value, dict):
+            if key == 'text' and isinstance(value, str):
+                return anonymize_text(value)
+            if key in MASKED_KEYS and isinstance(value, str):
+                return _mask(value)
+            if key == 'query' and isinstance(value, str) and not TEST_ID_PREFIX.fullmatch(value):
+                return _mask(value)
+            if key == 'data' and isinstance(value, str):
+                return self.anonymize_callback_data(value)
+            return value
+
+        # Users have is_bot, chats have a type; both are identified by id
+        is_entity = isinstance(value.get('id'), int) and ('is_bot' in value or 'type' in value)
+        anonymized = {}
+        for field, item in value.items():
+            if field in DROPPED_KEYS:
+                continue
+            if is_entity and field == 'id':
+                anonymized[field] = self.pseudonym(item)
+            elif is_entity and field in ('first_name', 'username'):
+                anonymized[field] = f"user{abs(self.pseudonym(value['id']))}"
+            else:
+                anonymized[field] = self.anonymize(item, field)
+        return anonymized
+
+    def record(self, update, bot_id):
+        """Append one update to the log."""
+        line = {
+            'at': round(time.time(), 3),
+            'bot_id': bot_id,
+            'update': self.anonymize(update.model_dump(mode="json", by_alias=True, exclude_none=True))
+        }
+        self._file.write(json.dumps(line, ensure_ascii=False) + "\n")
+        self.recorded += 1
+
+    async def __call__(self, handler, event, data):
+        """Record the update, then handle it; recording never fails an update."""
+        try:
+            self.record(event, data['bot'].id)
+        except (OSError, ValueError) as e:
+            logger.warning("Update %s was not recorded: %s", event.update_id, e)
+        return await handler(event, data)
+
+    def close(self):
+        """Flush and close the log."""
+        self._file.close()
+        logger.info("Recorded %d updates to %s", self.recorded, self.path)
@@ -0,0 +1,138 @@
+"""
+Rendering of the answer details sent to a creator after each pass.
+
+The details of a question are one of three shapes: a right guess, a
+wrong guess followed by the right answer, or a guess at a question the
+creator skipped. Every shape is formatted once per question set, split
+into at most two fragments per question and option with their lengths
+precomputed, so a notification is a selection of fragments joined once
+per message. Messages are split on question boundaries to stay within
+Telegram's length limit.
+"""
+from src import texts
+from src.consts import TELEGRAM_MESSAGE_LIMIT
+
+
+def utf16_length(text):
+    """Length of a text as Telegram counts it, in UTF-16 code units."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class AnswerDetailFragments:
+    """Prebuilt fragments of the answer details of one question set."""
+
+    def __init__(self, questions):
+        """
+        Format every fragment the details of a set can contain.
+
+        Per question and chosen option: the whole block of a right guess,
+        the whole block of a guess at a skipped question, and the opening
+        of a wrong guess; per option, the closing line naming the right
+        answer.
+
+        Args:
+            questions: Validated list of questions
+        """
+        self.question_ids = [str(question['id']) for question in questions]
+        self.right_blocks = []
+        self.unknown_blocks = []
+        self.wrong_openings = []
+        self.wrong_closings = []
+        for question in questions:
+            right = texts.DETAIL_CORRECT.format(question=question['text'])
+            wrong = texts.DETAIL_WRONG.format(question=question['text'])
+            unknown = texts.DETAIL_UNKNOWN.format(question=question['text'])
+            chosen = [texts.DETAIL_CHOSEN.format(option=option) for option in question['options']]
+
+            self.right_blocks.append(self._measure([right + line + "\n" for line in chosen]))
+            self.unknown_blocks.append(self._measure([
+                unknown + line + texts.DETAIL_NO_CREATOR_ANSWER + "\n" for line in chosen
+            ]))
+            self.wrong_openings.append(self._measure([wrong + line for line in chosen]))
+            self.wrong_closings.append(self._measure([
+                texts.DETAIL_RIGHT.format(option=option) + "\n" for option in question['options']
+            ]))
+
+    @staticmethod
+    def _measure(fragments):
+        """Fragments with a parallel list of their lengths."""
+        return fragments, [utf16_length(fragment) for fragment in fragments]
+
+
+def _split_text(text, limit):
+    """Cut a text that is too long for one message into pieces of at most limit units."""
+    pieces = []
+    piece = []
+    length = 0
+    for char in text:
+        char_length = utf16_length(char)
+        if length + char_length > limit:
+            pieces.append("".join(piece))
+            piece = []
+            length = 0
+        piece.append(char)
+        length += char_length
+    if piece:
+        pieces.append("".join(piece))
+    return pieces
+
+
+def render_answer_details(fragments, header, creator_answers, answers, limit=TELEGRAM_MESSAGE_LIMIT):
+    """
+    Render a notification with answer details as one or more messages.
+
+    Questions are never split between messages; the header only opens
+    the first one.
+
+    Args:
+        fragments: AnswerDetailFragments of the test's question set
+        header: Text preceding the details
+        creator_answers: The creator's answers (question_id -> option index)
+        answers: The taker's answers
+        limit: Maximum message length in UTF-16 code units
+
+    Returns:
+        list: Message texts
+    """
+    messages = []
+    parts = [header]
+    length = utf16_length(header)
+    oversized = length > limit
+
+    for index, q_id in enumerate(fragments.question_ids):
+        chosen = answers.get(q_id)
+        if chosen is None:
+            continue
+
+        correct = creator_answers.get(q_id)
+        if correct is None:
+            blocks, lengths = fragments.unknown_blocks[index]
+            block = (blocks[chosen],)
+            block_length = lengths[chosen]
+        elif correct == chosen:
+            blocks, lengths = fragments.right_blocks[index]
+            block = (blocks[chosen],)
+            block_length = lengths[chosen]
+        else:
+            openings, opening_lengths = fragments.wrong_openings[index]
+            closings, closing_lengths = fragments.wrong_closings[index]
+            block = (openings[chosen], closings[correct])
+            block_length = opening_lengths[chosen] + closing_lengths[correct]
+
+        if length + block_length > limit and length:
+            messages.append("".join(parts))
+            parts = []
+            length = 0
+        parts.extend(block)
+        length += block_length
+        oversized = oversized or length > limit
+
+    if parts:
+        messages.append("".join(parts))
+
+    # Validation keeps a question far below the limit, but a message that
+    # still does not fit is cut rather than rejected by Telegram
+    if oversized:
+        messages = [piece for message in messages for piece in _split_text(message, limit)]
+
+    return messages
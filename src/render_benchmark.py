@@ -0,0 +1,121 @@
+"""
+Microbenchmark of notification rendering against question count.
+
+Synthetic question sets of growing size are rendered with the fragment
+renderer and with the former string concatenation, which is kept here as
+the baseline; both outputs are checked to carry the same text.
+"""
+import random
+import statistics
+import time
+
+from src import texts
+from src.consts import OPTION_TEXT_MAX_LENGTH, QUESTION_TEXT_MAX_LENGTH
+from src.render import AnswerDetailFragments, render_answer_details, utf16_length
+
+HEADER = texts.NEW_RESULT_NOTIFICATION.format(username="@friend", percentage=50, status="—")
+
+
+def synthetic_questions(count, options_count=4, seed=0):
+    """
+    Generate a question set with texts of realistic, varying length.
+
+    Args:
+        count: Number of questions
+        options_count: Options per question
+        seed: Random seed
+
+    Returns:
+        list: Questions in the validated format
+    """
+    rng = random.Random(seed)
+    words = "кто что где когда почему как любимый чаще всего лучше никогда утром вечером".split()
+
+    def phrase(max_length):
+        text = " ".join(rng.choice(words) for _ in range(rng.randint(2, 12)))
+        return text[:max_length]
+
+    return [
+        {
+            'id': index,
+            'text': phrase(QUESTION_TEXT_MAX_LENGTH) + "?",
+            'options': [phrase(OPTION_TEXT_MAX_LENGTH) for _ in range(options_count)]
+        }
+        for index in range(1, count + 1)
+    ]
+
+
+def _render_concatenated(questions, creator_answers, answers):
+    """The former notification body: repeated += over every question."""
+    answers_details = ""
+    for question in questions:
+        q_id = str(question['id'])
+        if q_id in answers:
+            user_answer_index = answers[q_id]
+            user_answer = question['options'][user_answer_index]
+
+            if q_id in creator_answers:
+                correct_answer_index = creator_answers[q_id]
+                correct_answer = question['options'][correct_answer_index]
+
+                is_correct = "✅" if user_answer_index == correct_answer_index else "❌"
+
+                answers_details += f"{is_correct} {question['text']}\n"
+                answers_details += f"- Выбран ответ: {user_answer}\n"
+                if user_answer_index != correct_answer_index:
+                    answers_details += f"- Правильный ответ: {correct_answer}\n"
+                answers_details += "\n"
+            else:
+                answers_details += f"❓ {question['text']}\n"
+                answers_details += f"- Выбран ответ: {user_answer}\n"
+                answers_details += "- Создатель теста не ответил на этот вопрос\n\n"
+    return HEADER + answers_details
+
+
+def _median_ms(func, repeat):
+    """Median duration of a call in milliseconds."""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append(time.perf_counter() - started)
+    return round(statistics.median(samples) * 1000, 4)
+
+
+def benchmark_render(question_counts, repeat=200, seed=0):
+    """
+    Time rendering of one notification for every question count.
+
+    Args:
+        question_counts: Sizes of the synthetic question sets
+        repeat: Renders per measurement
+        seed: Random seed of the sets and answers
+
+    Returns:
+        list: Per size, the timings, number of messages and whether the
+            rendered text matches the baseline
+    """
+    rng = random.Random(seed)
+    report = []
+    for count in question_counts:
+        questions = synthetic_questions(count, seed=seed)
+        creator_answers = {str(q['id']): rng.randrange(len(q['options'])) for q in questions}
+        answers = {str(q['id']): rng.randrange(len(q['options'])) for q in questions}
+
+        started = time.perf_counter()
+        fragments = AnswerDetailFragments(questions)
+        build_ms = round((time.perf_counter() - started) * 1000, 4)
+
+        messages = render_answer_details(fragments, HEADER, creator_answers, answers)
+        baseline = _render_concatenated(questions, creator_answers, answers)
+
+        report.append({
+            'questions': count,
+            'build_ms': build_ms,
+            'render_ms': _median_ms(lambda: render_answer_details(fragments, HEADER, creator_answers, answers), repeat),
+            'concatenation_ms': _median_ms(lambda: _render_concatenated(questions, creator_answers, answers), repeat),
+            'messages': len(messages),
+            'longest_message': max(utf16_length(message) for message in messages),
+            'matches_baseline': "".join(messages) == baseline
+        })
+    return report
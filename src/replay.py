@@ -0,0 +1,405 @@
+"""
+Replay of recorded update logs for performance regression testing.
+
+A log written by UpdateRecorder is fed through the real dispatcher and
+handlers against a scratch database, with a local fake Bot API in place
+of Telegram. Updates are scheduled at their recorded offsets, divided by
+the speed factor (0 feeds them as fast as possible); updates of one user
+still run one after another, as they do against Telegram. The report
+holds per-kind latencies, schedule lag and throughput and carries the git
+revision, so runs of two revisions on the same log can be compared with
+compare_replays.
+
+Tests referenced by the log do not exist in the scratch database, so a
+stand-in test on the current bank is created for each of them before the
+clock starts and the references are rewritten to it. Friends browsed in
+/stats and users paging /mystats get stand-in passes, so their pages read
+rows instead of an empty index; the recorder gives a friend the same
+pseudonym in button data as in their own updates, so no IDs need mapping.
+Buttons of later pages carry recorded cursors and read whatever stand-in
+rows precede them. Uploaded question files are not recorded, uploads are
+replayed as empty files.
+"""
+import asyncio
+import collections
+import datetime
+import gzip
+import itertools
+import json
+import logging
+import os
+import random
+import re
+import tempfile
+import time
+
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.methods import GetFile, GetMe
+from aiogram.types import Chat, File, Message, Update, User
+
+from src.bootstrap import bootstrap
+from src.db import Database, ShardedDatabase, db
+from src.db.benchmark import git_revision, summarize_timings
+from src.keyboards import MyStatsPageCallback, StatsFriendPageCallback
+from src.main import create_dispatcher
+from src.questions import current_bank
+
+logger = logging.getLogger(__name__)
+
+# Test IDs as they appear in deep links, callback data and inline queries
+TEST_ID = re.compile(r"\bs_\d{10}\b")
+# Creator of stand-in tests first referenced by someone else's deep link
+STAND_IN_CREATOR_ID = 1
+# Update fields that carry the sender
+SENDER_FIELDS = ("message", "edited_message", "callback_query", "inline_query")
+
+
+class ReplaySession(BaseSession):
+    """Local fake Bot API: answers every method at once, or after api_latency seconds."""
+
+    def __init__(self, api_latency=0.0):
+        """
+        Initialize the fake API.
+
+        Args:
+            api_latency: Seconds every API call takes
+        """
+        super().__init__()
+        self.api_latency = api_latency
+        self.calls = collections.Counter()
+        self._message_ids = itertools.count(1)
+
+    async def make_request(self, bot, method, timeout=None):
+        """Answer a method with the smallest valid result."""
+        self.calls[type(method).__name__] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+        if isinstance(method, GetMe):
+            return User(id=bot.id, is_bot=True, first_name="Replay", username=f"replay{bot.id}_bot")
+        if isinstance(method, GetFile):
+            return File(file_id=method.file_id, file_unique_id=method.file_id, file_path=method.file_id)
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None and 'Message' in str(method.__returning__):
+            return Message(
+                message_id=getattr(method, 'message_id', None) or next(self._message_ids),
+                date=datetime.datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, 'text', None)
+            )
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        """Uploaded files are not recorded, every download is empty."""
+        return
+        yield
+
+    async def close(self):
+        """Nothing to close."""
+
+
+def load_log(path):
+    """
+    Read a recorded log, oldest update first.
+
+    Args:
+        path: gzip-compressed JSON Lines log
+
+    Returns:
+        list: Records with 'at', 'bot_id' and 'update'
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record['at'])
+    return records
+
+
+def update_kind(update):
+    """
+    Name the kind of an update for the report.
+
+    Args:
+        update: Update as plain JSON data
+
+    Returns:
+        str: e.g. "message:/start", "callback:st" or "inline_query"
+    """
+    if 'callback_query' in update:
+        data = update['callback_query'].get('data', "")
+        if data and not data.strip("x"):
+            return "callback:masked"
+        return "callback:" + re.sub(r"_?\d+$", "", data.split(":")[0])
+    if 'message' in update:
+        message = update['message']
+        text = message.get('text', "")
+        if text.startswith("/"):
+            command = text.split()[0].split("@")[0]
+            return f"message:{command} link" if " " in text else f"message:{command}"
+        return "message:document" if 'document' in message else "message:text"
+    if 'inline_query' in update:
+        return "inline_query"
+    return next(iter(key for key in update if key != 'update_id'), "unknown")
+
+
+def _sender_id(update):
+    """ID of the user who sent an update, if any."""
+    for field in SENDER_FIELDS:
+        if field in update:
+            return update[field].get('from', {}).get('id')
+    return None
+
+
+def use_scratch_storage(directory):
+    """
+    Point the global storage, not connected yet, at files in directory.
+
+    Args:
+        directory: Directory for the scratch database files
+    """
+    if isinstance(db, ShardedDatabase):
+        db.shard_dir = directory
+        databases = db.databases
+    elif isinstance(db, Database):
+        databases = [db]
+    else:
+        databases = []
+
+    for database in databases:
+        database.db_name = os.path.join(directory, os.path.basename(database.db_name))
+        if database.users_db_name:
+            database.users_db_name = os.path.join(directory, os.path.basename(database.users_db_name))
+
+
+def _random_answers(bank, rng):
+    """Random answers to every question of a bank."""
+    return {
+        str(question['id']): rng.randrange(len(question['options']))
+        for question in bank.questions
+    }
+
+
+async def create_stand_in_tests(records, seed=0):
+    """
+    Create a test in the scratch database for every test the log references.
+
+    A test first referenced from a callback (a creator browsing /stats)
+    belongs to that user, any other to STAND_IN_CREATOR_ID.
+
+    Args:
+        records: Records from load_log
+        seed: Random seed of the creators' answers
+
+    Returns:
+        dict: Recorded test ID -> stand-in test ID
+    """
+    rng = random.Random(seed)
+    bank = current_bank()
+    await db.add_user(STAND_IN_CREATOR_ID, "creator", "Creator", "")
+
+    stand_ins = {}
+    for record in records:
+        update = record['update']
+        for test_id in TEST_ID.findall(json.dumps(update)):
+            if test_id in stand_ins:
+                continue
+            creator_id = STAND_IN_CREATOR_ID
+            if 'callback_query' in update:
+                creator_id = _sender_id(update)
+                await db.add_user(creator_id, f"user{creator_id}", f"user{creator_id}", "")
+            stand_ins[test_id] = await db.create_test(
+                creator_id, _random_answers(bank, rng), bank_version=bank.set_hash, bot_id=record['bot_id']
+            )
+    return stand_ins
+
+
+async def create_stand_in_passes(records, stand_ins, seed=0):
+    """
+    Save passes for the friends and takers the log browses.
+
+    A friend whose history a creator pages through passes each of the
+    creator's stand-in tests of that bot, a test being created first if
+    the creator has none. A user paging /mystats passes every stand-in
+    test of that bot they did not create.
+
+    Args:
+        records: Records from load_log
+        stand_ins: Recorded test ID -> stand-in test ID, from create_stand_in_tests
+        seed: Random seed of the answers
+
+    Returns:
+        int: Number of passes saved
+    """
+    rng = random.Random(seed)
+    bank = current_bank()
+
+    # (creator, friend, bot) pairs and (taker, bot) pairs browsed in the log
+    friends = set()
+    takers = set()
+    for record in records:
+        data = record['update'].get('callback_query', {}).get('data', "")
+        prefix = data.split(":", 1)[0]
+        if prefix == StatsFriendPageCallback.__prefix__:
+            taker_id = StatsFriendPageCallback.unpack(data).taker_id
+            friends.add((_sender_id(record['update']), taker_id, record['bot_id']))
+        elif prefix == MyStatsPageCallback.__prefix__:
+            takers.add((_sender_id(record['update']), record['bot_id']))
+
+    tests = []
+    for test_id in stand_ins.values():
+        test_info = await db.get_test(test_id)
+        tests.append((test_id, test_info['user_id'], test_info['bot_id']))
+
+    passes = 0
+    for creator_id, taker_id, bot_id in sorted(friends):
+        creator_tests = [test_id for test_id, user_id, test_bot in tests if (user_id, test_bot) == (creator_id, bot_id)]
+        if not creator_tests:
+            await db.add_user(creator_id, f"user{creator_id}", f"user{creator_id}", "")
+            test_id = await db.create_test(
+                creator_id, _random_answers(bank, rng), bank_version=bank.set_hash, bot_id=bot_id
+            )
+            tests.append((test_id, creator_id, bot_id))
+            creator_tests = [test_id]
+        await db.add_user(taker_id, f"user{taker_id}", f"user{taker_id}", "")
+        for test_id in creator_tests:
+            await db.save_test_result(test_id, taker_id, f"user{taker_id}", _random_answers(bank, rng))
+            passes += 1
+
+    for taker_id, bot_id in sorted(takers):
+        await db.add_user(taker_id, f"user{taker_id}", f"user{taker_id}", "")
+        for test_id, user_id, test_bot in tests:
+            if test_bot == bot_id and user_id != taker_id:
+                await db.save_test_result(test_id, taker_id, f"user{taker_id}", _random_answers(bank, rng))
+                passes += 1
+
+    return passes
+
+
+def _prepare_update(update, stand_ins):
+    """Build the Update with test references rewritten to their stand-ins."""
+    text = TEST_ID.sub(lambda match: stand_ins.get(match.group(0), match.group(0)), json.dumps(update))
+    return Update.model_validate(json.loads(text))
+
+
+async def replay_log(path, speed=1.0, api_latency=0.0, max_gap=60.0, seed=0, directory=None):
+    """
+    Feed a recorded log through the dispatcher and time every update.
+
+    Args:
+        path: Log written by UpdateRecorder
+        speed: Recorded time is divided by this, 0 feeds updates without waiting
+        api_latency: Seconds every fake Bot API call takes
+        max_gap: Longest idle gap of the recording kept, in recorded seconds
+        seed: Random seed of the stand-in tests
+        directory: Directory for the scratch database
+
+    Returns:
+        dict: JSON-serializable report
+    """
+    records = load_log(path)
+    if not records:
+        raise ValueError(f"No updates recorded in {path}")
+
+    session = ReplaySession(api_latency)
+    bots = {
+        bot_id: Bot(token=f"{bot_id}:replay", session=session)
+        for bot_id in dict.fromkeys(record['bot_id'] for record in records)
+    }
+
+    with tempfile.TemporaryDirectory(dir=directory) as scratch:
+        use_scratch_storage(scratch)
+        await bootstrap(list(bots.values()), snapshot_path=None)
+        try:
+            stand_ins = await create_stand_in_tests(records, seed)
+            stand_in_passes = await create_stand_in_passes(records, stand_ins, seed)
+            dp = create_dispatcher()
+
+            # Recorded offsets with idle gaps capped at max_gap
+            offsets = [0.0]
+            for previous, record in zip(records, records[1:]):
+                offsets.append(offsets[-1] + min(record['at'] - previous['at'], max_gap))
+
+            latencies = collections.defaultdict(list)
+            lags = []
+            errors = collections.Counter()
+            loop = asyncio.get_running_loop()
+            clock_start = loop.time()
+
+            async def feed(record, offset, previous):
+                due = clock_start + (offset / speed if speed > 0 else 0)
+                if due > loop.time():
+                    await asyncio.sleep(due - loop.time())
+                if previous is not None:
+                    await previous
+                lags.append(max(0.0, loop.time() - due))
+
+                kind = update_kind(record['update'])
+                update = _prepare_update(record['update'], stand_ins)
+                started = time.perf_counter()
+                try:
+                    await dp.feed_update(bots[record['bot_id']], update)
+                except Exception:
+                    logger.debug("Update %s failed", update.update_id, exc_info=True)
+                    errors[kind] += 1
+                latencies[kind].append(time.perf_counter() - started)
+
+            # Each user's updates wait for the one before, as with Telegram
+            last_by_sender = {}
+            tasks = []
+            for record, offset in zip(records, offsets):
+                sender_id = _sender_id(record['update'])
+                task = asyncio.create_task(feed(record, offset, last_by_sender.get(sender_id)))
+                if sender_id is not None:
+                    last_by_sender[sender_id] = task
+                tasks.append(task)
+            await asyncio.gather(*tasks)
+            wall_seconds = loop.time() - clock_start
+        finally:
+            await db.close()
+
+    all_latencies = [sample for samples in latencies.values() for sample in samples]
+    return {
+        'revision': git_revision(),
+        'started_at': datetime.datetime.now(datetime.timezone.utc).isoformat(timespec='seconds'),
+        'log': os.path.basename(path),
+        'speed': speed,
+        'api_latency_ms': round(api_latency * 1000, 3),
+        'backend': type(db).__name__,
+        'updates': len(records),
+        'stand_in_tests': len(stand_ins),
+        'stand_in_passes': stand_in_passes,
+        'errors': sum(errors.values()),
+        'errors_by_kind': dict(sorted(errors.items())),
+        'recorded_seconds': round(offsets[-1], 3),
+        'wall_seconds': round(wall_seconds, 3),
+        'throughput_per_second': round(len(records) / wall_seconds, 1) if wall_seconds else None,
+        'latency': summarize_timings(all_latencies),
+        'lag': summarize_timings(lags),
+        'kinds': {kind: summarize_timings(samples) for kind, samples in sorted(latencies.items())},
+        'api_calls': dict(session.calls.most_common())
+    }
+
+
+def compare_replays(baseline, candidate):
+    """
+    Compare the latencies of two replays of the same log.
+
+    Args:
+        baseline: Report of the earlier revision
+        candidate: Report of the newer revision
+
+    Returns:
+        list: (name, baseline median ms, candidate median ms, baseline p95 ms, candidate p95 ms, ratio) rows,
+            overall latency first
+    """
+    pairs = [("all updates", baseline['latency'], candidate['latency'])]
+    pairs.extend(
+        (kind, baseline['kinds'][kind], timing)
+        for kind, timing in candidate['kinds'].items()
+        if kind in baseline['kinds']
+    )
+    rows = []
+    for name, before, after in pairs:
+        ratio = after['median_ms'] / before['median_ms'] if before['median_ms'] else None
+        rows.append((name, before['median_ms'], after['median_ms'], before['p95_ms'], after['p95_ms'], ratio))
+    return rows
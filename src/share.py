@@ -0,0 +1,85 @@
+"""
+Share cards for inline mode.
+
+Typing @bot in any chat lists the user's tests as ready-to-send messages
+with the deep link. A card is built once, when its test is created, and
+kept in a per-user index for every bot, so answering an inline query is a slice of a
+prebuilt list; Telegram caches the answer per user for INLINE_CACHE_TIME.
+"""
+from datetime import datetime, timezone
+
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+
+from src import texts
+from src.cache import LRUCache
+from src.consts import SHARE_INDEX_SIZE
+from src.db import db
+from src.identity import get_identity
+from src.keyboards import get_take_test_keyboard
+
+# (bot_id, user_id) -> share cards of the user's tests with that bot, newest first
+share_index = LRUCache(SHARE_INDEX_SIZE)
+
+
+def make_test_link(bot_username, test_id):
+    """Deep link that starts a test."""
+    return f"https://t.me/{bot_username}?start={test_id}"
+
+
+def build_share_card(test_id, link, created_at):
+    """
+    Build the inline result that shares one test.
+
+    Args:
+        test_id: ID of the test
+        link: Deep link to the test
+        created_at: Creation time as stored by the database
+
+    Returns:
+        InlineQueryResultArticle: Card with the invitation and a start button
+    """
+    return InlineQueryResultArticle(
+        id=test_id,
+        title=texts.SHARE_CARD_TITLE,
+        description=texts.SHARE_CARD_DESCRIPTION.format(test_id=test_id, created_at=created_at[:10]),
+        input_message_content=InputTextMessageContent(
+            message_text=texts.SHARE_CARD_MESSAGE.format(link=link)
+        ),
+        reply_markup=get_take_test_keyboard(link)
+    )
+
+
+def add_share_card(bot, user_id, test_id, link):
+    """
+    Put the card of a new test in front of its creator's cards.
+
+    Creators who are not indexed yet get every card, this one included,
+    from the database on their first inline query.
+    """
+    cards = share_index.get((bot.id, user_id))
+    if cards is not None:
+        created_at = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+        cards.insert(0, build_share_card(test_id, link, created_at))
+
+
+async def get_share_cards(bot, user_id):
+    """
+    Get the share cards of a user's tests, loading them on an index miss.
+
+    Args:
+        bot: Bot the cards are for, only its tests are listed
+        user_id: ID of the creator
+
+    Returns:
+        list: Cards, newest test first
+    """
+    key = (bot.id, user_id)
+    cards = share_index.get(key)
+    if cards is None:
+        bot_username = (await get_identity(bot)).username
+        cards = [
+            build_share_card(test_id, make_test_link(bot_username, test_id), created_at)
+            for test_id, created_at in await db.get_user_tests(user_id, bot_id=bot.id)
+        ]
+        share_index.put(key, cards)
+    return cards
@@ -6,5 +6,6 @@ from aiogram.fsm.state import State, StatesGroup
 
 class TestStates(StatesGroup):
     """States for test creation and completion."""
+    uploading_questions = State()  # User is sending a custom question set
     creating_test = State()  # User is creating a test
     taking_test = State()    # User is taking someone else's test
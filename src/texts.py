@@ -6,19 +6,61 @@ All text messages used in the bot.
 START_MESSAGE = "👋 Привет! Это бот для создания теста \"Насколько хорошо тебя знают твои друзья\"."
 CREATE_TEST_BUTTON = "🎮 Создать тест о себе"
 CREATE_TEST_START = "Отлично! Сейчас я задам тебе несколько вопросов о тебе. Выбери правильные ответы."
+UPLOAD_QUESTIONS_BUTTON = "📄 Загрузить свои вопросы"
+
+# Custom question sets
+UPLOAD_QUESTIONS_PROMPT = """Пришлите json-файл со своими вопросами в таком формате:
+
+{{"questions": [{{"id": 1, "text": "Любимый цвет", "options": ["Синий", "Красный"]}}]}}
+
+До {max_questions} вопросов, у каждого от {min_options} до {max_options} вариантов ответа.
+/cancel - отменить"""
+UPLOAD_QUESTIONS_EXPECTED = "Пришлите вопросы json-файлом или нажмите /cancel."
+UPLOAD_QUESTIONS_ACCEPTED = "✅ Вопросы приняты: {count}. Теперь ответьте на них сами."
+UPLOAD_QUESTIONS_FAILED = "Не получилось загрузить вопросы: {error}\nИсправьте файл и пришлите его ещё раз."
+QSET_ERROR_TOO_BIG = "файл больше {limit_kb} КБ"
+QSET_ERROR_JSON = "файл не похож на json в кодировке UTF-8"
+QSET_ERROR_NO_QUESTIONS = "в файле нет списка questions с вопросами"
+QSET_ERROR_TOO_MANY = "вопросов больше {limit}"
+QSET_ERROR_QUESTION = "вопрос {number} должен быть объектом с полями id, text и options"
+QSET_ERROR_ID = "у вопроса {number} нет id или такой id уже встречался"
+QSET_ERROR_TEXT = "у вопроса {number} пустой текст или он длиннее {limit} символов"
+QSET_ERROR_OPTIONS = "у вопроса {number} должно быть от {min_options} до {max_options} непустых вариантов ответа не длиннее {limit} символов"
+QUESTION_SET_MISSING = "Вопросы этого теста не найдены. Возможно, ссылка устарела."
 
 # Test flow messages
 QUESTION_TEMPLATE = "Вопрос {current}/{total}:\n\n{question}"
 TEST_CREATED = "🎉 Поздравляю! Вы создали свой тест.\nВаша ссылка: {link}"
+EDIT_ANSWERS_BUTTON = "✏️ Изменить ответы"
+EDIT_TEST_START = "Ответь на вопросы заново — результаты друзей пересчитаются по новым ответам."
+TEST_ANSWERS_UPDATED = "✅ Ответы обновлены. Пересчитано результатов: {rescored}, без изменений (старые или объединённые): {kept}."
 SHARE_TEST_BUTTON = "📲 Поделиться тестом"
+SHARE_INLINE_BUTTON = "💬 Отправить в чат"
+TAKE_TEST_BUTTON = "✅ Пройти тест"
+
+# Inline mode share cards
+SHARE_CARD_TITLE = "🤔 Насколько хорошо ты меня знаешь?"
+SHARE_CARD_DESCRIPTION = "Тест {test_id} от {created_at}"
+SHARE_CARD_MESSAGE = "🤔 Насколько хорошо ты меня знаешь? Пройди мой тест и узнай!\n{link}"
+SHARE_NO_TESTS = "У вас пока нет тестов — создать"
 
 # Taking a test messages
 TAKING_TEST_START = "Вы проходите тест пользователя {creator_name}. Ответьте на вопросы и узнайте, насколько хорошо вы знаете этого человека!"
 TAKING_TEST_QUESTION = "Вопрос {current}/{total}:\n\n{question}"
 TEST_COMPLETED = "Тест завершен!\n\nВы знаете {creator_name} на {percentage}%\n{status}"
+TEST_RANK = "Вы обошли {beaten_percentage}% друзей: {place} место из {total}"
+TEST_RANK_FIRST = "Вы первый, кто прошёл этот тест!"
 
 # Notifications
-NEW_RESULT_NOTIFICATION = "Пользователь {username} прошёл ваш тест с результатом: {percentage}% ({status})\n\nВопросы и ответы:\n{answers_details}"
+NEW_RESULT_NOTIFICATION = "Пользователь {username} прошёл ваш тест с результатом: {percentage}% ({status})\n\nВопросы и ответы:\n"
+
+# Answer details in the notification, one block per question
+DETAIL_CORRECT = "✅ {question}\n"
+DETAIL_WRONG = "❌ {question}\n"
+DETAIL_UNKNOWN = "❓ {question}\n"
+DETAIL_CHOSEN = "- Выбран ответ: {option}\n"
+DETAIL_RIGHT = "- Правильный ответ: {option}\n"
+DETAIL_NO_CREATOR_ANSWER = "- Создатель теста не ответил на этот вопрос\n"
 
 # Statistics messages
 STATS_HEADER = "📊 Статистика ваших тестов"
@@ -38,11 +80,49 @@ STATS_WORST_FRIENDS = """
 STATS_NO_TESTS = "У вас пока нет созданных тестов. Нажмите на кнопку \"Создать тест о себе\", чтобы создать свой первый тест!"
 STATS_NO_PASSES = "Ваши тесты ещё никто не проходил. Поделитесь ссылкой с друзьями!"
 
+# Statistics browser
+STATS_TEST_BUTTON = "📋 {test_id} — {passes_count} прох., {average_score}%"
+STATS_TEST_PAGE_HEADER = "📋 Прохождения теста {test_id}:"
+STATS_FRIEND_PAGE_HEADER = "👤 История прохождений {username}:"
+STATS_PAGE_ENTRY = "• {username} - {score}% ({created_at})"
+STATS_HISTORY_ENTRY = "• {test_id} - {score}% ({created_at})"
+STATS_PAGE_EMPTY = "Здесь пока ничего нет."
+STATS_NEXT_PAGE_BUTTON = "Дальше ➡️"
+STATS_BACK_BUTTON = "⬅️ К статистике"
+STATS_FRIEND_BUTTON = "👤 {username}"
+
+# Tests the user took
+MYSTATS_HEADER = "🧩 Насколько хорошо вы знаете друзей\nПрохождений: {passes}, средний результат: {average_score}%"
+MYSTATS_ENTRY = "• {creator} - {score}% ({created_at})"
+MYSTATS_EMPTY = "Вы ещё не проходили тесты друзей. Попросите у них ссылку!"
+
 # Top friends statistics
 TOP_FRIENDS_HEADER = "🏆 Топ-10 друзей по знанию всех тестов:"
 TOP_FRIENDS_ENTRY = "{index}. {username} - {score}% (прошёл {passes_count} {passes_word})"
 TOP_FRIENDS_EMPTY = "Пока не набрано достаточно статистики. Чем больше людей пройдут тесты, тем точнее будет топ!"
 
+# Question statistics
+QSTATS_HEADER = "📈 Как создатели отвечают на вопросы:"
+QSTATS_QUESTION = "{index}. {question}\n{distribution}"
+QSTATS_OPTION = "{option} {percentage}%"
+QSTATS_MISSES_HEADER = "❌ Чаще всего ошибаются в вопросах:"
+QSTATS_MISSES_ENTRY = "{index}. {question} — {percentage}% ошибок ({misses} из {guesses})"
+QSTATS_EMPTY = "Пока нет ни одного теста, статистика по вопросам появится позже."
+
+# Admin commands
+BACKUP_STARTED = "💾 Делаю резервную копию базы..."
+BACKUP_DONE = """💾 Копия {name} готова
+Размер: {size_kb} КБ
+Время: {duration} с, шагов: {steps}
+Самая долгая блокировка: {max_step_lock} мс
+Удалено старых копий: {rotated}"""
+BACKUP_FAILED = "Не удалось сделать резервную копию, подробности в логах."
+BACKUP_UNSUPPORTED = "Хранилище держит данные только в памяти, копировать нечего."
+BANK_RELOADED = """🔄 Вопросы обновлены: версия {version}, вопросов: {count}
+Начатые тесты доиграют на старой версии. Удалено неиспользуемых версий: {deleted}"""
+BANK_UNCHANGED = "Файл с вопросами не изменился."
+BANK_RELOAD_FAILED = "Вопросы не обновлены, осталась текущая версия: {error}"
+
 # Errors
 TEST_NOT_FOUND = "Тест не найден. Возможно, создатель удалил его или ссылка неверна."
 ERROR_MESSAGE = "Произошла ошибка. Пожалуйста, попробуйте еще раз или обратитесь к администратору."